@@ -1,8 +1,18 @@
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 
+from parameter_mask import add_parameter_columns, contains_any, parameter_masks
+from table_store import iter_table, load_table, save_table
+
+# calculate_statsで追加で計算する統計量 ('median', 'std', 'p90' など)
+EXTRA_STATS = []
+
+# 結果ファイルをチャンクに分けて集計する場合の1チャンクの行数 (Noneの場合は一度に読み込む)
+CHUNK_SIZE = None
+
 
 def main():
     """
@@ -15,11 +25,8 @@ def main():
 
     data_file = 'format_benchmark_parameter_loocv.csv'
 
-    # データの読み込み
-    df = load_data(data_dir, data_file)
-
-    # Parameterごとの統計量の計算
-    results_df = calculate_stats(df)
+    # データの読み込みとParameterごとの統計量の計算
+    results_df = load_stats(data_dir, data_file)
 
     # 結果を保存
     save_results(results_df, output_dir, "benchmark_parameter_stats_results_with_metadata.csv")
@@ -36,102 +43,280 @@ def main():
                  "benchmark_parameter_stats_results_filterd_by_variable_toc.csv")
 
     data_file = 'format_spec_parameter_loocv.csv'
-    # データの読み込み
-    df = load_data(data_dir, data_file)
-    # Parameterごとの統計量の計算
-    results_df = calculate_stats(df, has_time_cost=False)
+    # データの読み込みとParameterごとの統計量の計算
+    results_df = load_stats(data_dir, data_file, has_time_cost=False)
     # 結果を保存
     save_results(results_df, output_dir, "spec_mape_test_stats_results_with_metadata.csv")
 
 
-def calculate_stats(df, has_time_cost=True):
+def load_stats(data_dir, data_file, has_time_cost=True):
+    """
+    データを読み込み、各Variable Parameterの統計量を計算する関数。
+    CHUNK_SIZEを指定した場合は、CHUNK_SIZE行ずつ読み込んで集計する。
+
+    Args:
+        data_dir (str): データディレクトリのパス
+        data_file (str): データファイル名
+        has_time_cost (bool): データに "Time Cost (s)" 列が含まれるかどうか
+
+    Returns:
+        pd.DataFrame: 統計量を計算した結果
+    """
+    if CHUNK_SIZE is None:
+        return calculate_stats(load_data(data_dir, data_file), has_time_cost)
+    return calculate_stats_chunked(data_dir, data_file, CHUNK_SIZE, has_time_cost)
+
+
+def calculate_stats(df, has_time_cost=True, extra_stats=None):
     """
     各Variable Parameterの統計量を計算する関数。
 
     Args:
         df (pd.DataFrame): 入力データフレーム
         has_time_cost (bool): データフレームに "Time Cost (s)" 列が含まれるかどうか
+        extra_stats (list or None): 追加で計算する統計量 ('median', 'std', 'p90' など)。
+            Noneの場合はEXTRA_STATS
 
     Returns:
-        pd.DataFrame: 統計量を計算した結果
+        pd.DataFrame: 統計量を計算した結果 (平均MAPEの昇順)
     """
-    unique_inputs = df['Variable Parameter'].unique()
-    results = []
-
-    for input_value in unique_inputs:
-        filtered_df = df[df['Variable Parameter'] == input_value]
-
-        # 各種指標を計算
-        avg_mape_test = round(filtered_df["MAPE test (%)"].mean(), 5)
-        min_mape_test = filtered_df["MAPE test (%)"].min()
-        max_mape_test = filtered_df["MAPE test (%)"].max()
-        low_mape_list, high_mape_list = filter_leave_one_by_mape(filtered_df)
-
-        # 他の列の代表値を取得
-        ml = filtered_df["ML"].iloc[0] if not filtered_df["ML"].empty else None
-        loss = filtered_df["loss"].iloc[0] if not filtered_df["loss"].empty else None
-        parameter_num = filtered_df['Parameter Num'].iloc[
-            0] if not filtered_df['Parameter Num'].empty else None
-        const_parameters = filtered_df['Const Parameter'].iloc[
-            0] if not filtered_df['Const Parameter'].empty else None
-        variable_parameter_num = filtered_df['Variable Parameter Num'].iloc[
-            0] if not filtered_df['Variable Parameter Num'].empty else None
-        variable_parameters = filtered_df['Variable Parameter'].iloc[
-            0] if not filtered_df['Variable Parameter'].empty else None
-
-        # "Time Cost (s)" を含む場合にのみ計算
-        time_cost = (round(filtered_df["Time Cost (s)"].iloc[0], 5)
-                     if has_time_cost and not filtered_df["Time Cost (s)"].empty else None)
-
-        # 結果をリストに追加
-        result = {
-            'ML': ml,
-            'loss': loss,
-            'Parameter Num': parameter_num,
-            'Const Parameter': const_parameters,
-            'Variable Parameter Num': variable_parameter_num,
-            'Variable Parameter': variable_parameters,
-        }
+    accumulator = StatsAccumulator(has_time_cost, extra_stats)
+    accumulator.add(df)
+    return accumulator.result()
 
-        # "Time Cost (s)" を含む場合、Variable Parameter の右隣に追加
-        if has_time_cost:
-            result["Time Cost (s)"] = time_cost
 
-        result.update({
-            "average MAPE test (%)": avg_mape_test,
-            "min MAPE test (%)": min_mape_test,
-            "max MAPE test (%)": max_mape_test,
-            "Low Mape Server": low_mape_list,
-            "High Mape Server": high_mape_list
-        })
+def calculate_stats_chunked(data_dir, data_file, chunksize, has_time_cost=True, extra_stats=None):
+    """
+    データをchunksize行ずつ読み込み、各Variable Parameterの統計量を集計する関数。
+    メモリに保持するのは組み合わせごとの集計値とMAPEの値 (1行あたり16バイト) のみ。
 
-        results.append(result)
-        results_df = pd.DataFrame(results).sort_values(by="average MAPE test (%)", ascending=True)
+    Args:
+        data_dir (str): データディレクトリのパス
+        data_file (str): データファイル名
+        chunksize (int): 1チャンクの行数
+        has_time_cost (bool): データに "Time Cost (s)" 列が含まれるかどうか
+        extra_stats (list or None): 追加で計算する統計量。Noneの場合はEXTRA_STATS
 
-    return results_df
+    Returns:
+        pd.DataFrame: 統計量を計算した結果 (calculate_statsと同じ)
+    """
+    accumulator = StatsAccumulator(has_time_cost, extra_stats)
+    try:
+        data_path = os.path.join(data_dir, data_file)
+        for df in iter_table(data_path, chunksize):
+            # 欠損値の確認
+            if df.isna().any().any():
+                raise ValueError("データに欠損値（NaN）が含まれています。")
+            accumulator.add(df)
+    except FileNotFoundError:
+        print(f"ファイル {data_file} が見つかりませんでした。")
+        sys.exit(1)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    return accumulator.result()
+
+
+class StatsAccumulator:
+    """
+    各Variable Parameterの統計量をチャンク単位で集計するクラス。
+    組み合わせごとにMAPE test (%) の件数・最小・最大、Low/High Mape Serverのリスト、
+    先頭行のメタデータとMAPEの値を保持する。平均は最後に組み合わせごとの値を元の行順で
+    合計して求める (組み合わせごとにSeries.meanを計算した場合と同じ丸めになるように)。
+    追加の統計量 (中央値、パーセンタイルなど) は、MAPEをグループ内で一度だけ並べ替えて求める。
+    """
 
+    def __init__(self, has_time_cost=True, extra_stats=None, low_threshold=10, high_threshold=20):
+        """
+        Args:
+            has_time_cost (bool): データに "Time Cost (s)" 列が含まれるかどうか
+            extra_stats (list or None): 追加で計算する統計量。Noneの場合はEXTRA_STATS
+            low_threshold (float): Low Mape Serverに含める MAPE test (%) の上限値
+            high_threshold (float): High Mape Serverに含める MAPE test (%) の下限値
+        """
+        self.has_time_cost = has_time_cost
+        self.extra_stats = EXTRA_STATS if extra_stats is None else extra_stats
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.metadata_columns = [
+            'ML', 'loss', 'Parameter Num', 'Const Parameter', 'Variable Parameter Num',
+            'Variable Parameter'
+        ]
+        # "Time Cost (s)" を含む場合、Variable Parameter の右隣に追加
+        if has_time_cost:
+            self.metadata_columns.append("Time Cost (s)")
+
+        # Variable Parameter -> グループ番号 (出現順)
+        self._groups = {}
+        self._metadata = []
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._mins = np.zeros(0)
+        self._maxs = np.zeros(0)
+        self._low_lists = []
+        self._high_lists = []
+        self._values = []
+
+    def add(self, df):
+        """
+        チャンクを集計に加える。
+
+        Args:
+            df (pd.DataFrame): 入力データフレーム (チャンク)
+        """
+        # リストの列はハッシュできないため、タプルにして組み合わせを区別する
+        codes, uniques = pd.factorize(df['Variable Parameter'].map(hashable_value))
+        n_known = len(self._groups)
+        groups = np.array([self._groups.setdefault(value, len(self._groups)) for value in uniques],
+                          dtype=np.intp)
+        n_groups = len(self._groups)
+
+        # 新しい組み合わせは先頭行のメタデータを保持し、集計値の配列を広げる
+        new = np.flatnonzero(groups >= n_known)
+        if len(new):
+            first_rows = np.unique(codes, return_index=True)[1]
+            self._metadata.append(df[self.metadata_columns].take(first_rows[new]))
+            n_new = n_groups - n_known
+            self._counts = np.concatenate([self._counts, np.zeros(n_new, dtype=np.int64)])
+            self._mins = np.concatenate([self._mins, np.full(n_new, np.inf)])
+            self._maxs = np.concatenate([self._maxs, np.full(n_new, -np.inf)])
+            self._low_lists.extend([] for _ in range(n_new))
+            self._high_lists.extend([] for _ in range(n_new))
+
+        rows = groups[codes]
+        values = df["MAPE test (%)"].to_numpy(dtype=np.float64)
+        self._counts += np.bincount(rows, minlength=n_groups)
+        np.minimum.at(self._mins, rows, values)
+        np.maximum.at(self._maxs, rows, values)
+        self._values.append((rows, values))
+
+        low_lists, high_lists = filter_leave_one_by_mape(df, codes, len(uniques),
+                                                         self.low_threshold, self.high_threshold)
+        for group, low_list, high_list in zip(groups, low_lists, high_lists):
+            self._low_lists[group].extend(low_list)
+            self._high_lists[group].extend(high_list)
+
+    def result(self):
+        """
+        集計した統計量を返す。
+
+        Returns:
+            pd.DataFrame: 統計量を計算した結果 (平均MAPEの昇順)
+        """
+        counts = self._counts
+        rows = np.concatenate([r for r, _ in self._values] or [np.zeros(0, dtype=np.intp)])
+        values = np.concatenate([v for _, v in self._values] or [np.zeros(0)])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        # 平均はグループごとに元の行順で合計する (bincountの逐次加算とは丸めが異なるため)
+        grouped_values = values[np.argsort(rows, kind='stable')]
+        means = np.array([grouped_values[start:start + count].sum() / count
+                          for start, count in zip(starts, counts)])
+        stats = {
+            "average MAPE test (%)": means.round(5),
+            "min MAPE test (%)": self._mins,
+            "max MAPE test (%)": self._maxs,
+        }
+        if self.extra_stats:
+            # グループ内でMAPEを昇順に並べる
+            sorted_values = values[np.lexsort((values, rows))]
+            for name in self.extra_stats:
+                stats[f"{name} MAPE test (%)"] = group_statistic(name, sorted_values, starts, counts,
+                                                                 means, values, rows).round(5)
+        stats.update({"Low Mape Server": self._low_lists, "High Mape Server": self._high_lists})
+
+        # 他の列はグループの先頭行の値を使う
+        if self._metadata:
+            results_df = pd.concat(self._metadata, ignore_index=True)
+        else:
+            results_df = pd.DataFrame(columns=self.metadata_columns)
+        if self.has_time_cost:
+            results_df["Time Cost (s)"] = results_df["Time Cost (s)"].round(5)
+        results_df = results_df.assign(**stats)
+
+        # 平均MAPEの昇順に並べる (同じ値の組み合わせの順序も以前と同じになるように既定の並べ替えを使う)
+        results_df = results_df.sort_values(by="average MAPE test (%)", ascending=True)
+
+        # 特徴量の組み合わせのビットマスクと正規形を追加
+        return add_parameter_columns(results_df)
+
+
+def group_statistic(name, sorted_values, starts, counts, means, values, codes):
+    """
+    グループごとの追加の統計量を計算する関数。
+
+    Args:
+        name (str): 統計量の名前 ('median', 'std', 'p<パーセント>')
+        sorted_values (np.ndarray): グループ内で昇順に並べたMAPE
+        starts (np.ndarray): 各グループの先頭位置
+        counts (np.ndarray): 各グループの行数
+        means (np.ndarray): 各グループの平均
+        values (np.ndarray): 元の順序のMAPE
+        codes (np.ndarray): 各行のグループ番号
 
-def filter_leave_one_by_mape(df, low_threshold=10, high_threshold=20):
+    Returns:
+        np.ndarray: グループごとの統計量
+    """
+    if name == 'std':
+        # 不偏標準偏差 (pandasのstdと同じくddof=1)
+        squares = np.bincount(codes, weights=(values - means[codes])**2, minlength=len(counts))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(squares / (counts - 1))
+    if name == 'median':
+        quantile = 0.5
+    elif name.startswith('p') and name[1:].replace('.', '', 1).isdigit():
+        quantile = float(name[1:]) / 100
+    else:
+        raise ValueError(f"未対応の統計量です: {name}")
+
+    # 線形補間によるパーセンタイル (pandasのquantileと同じ)。
+    # 補間の割合はグループ内の位置から求める (先頭位置を足してからでは丸め誤差が入る)
+    offset = quantile * (counts - 1)
+    lower_offset = np.floor(offset)
+    fraction = offset - lower_offset
+    lower = starts + lower_offset.astype(np.intp)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def filter_leave_one_by_mape(df, codes, n_groups, low_threshold=10, high_threshold=20):
     """
-    MAPE test (%) を基準に Leave One のリストを作成する関数。
+    MAPE test (%) を基準に、グループごとの Leave One のリストを作成する関数。
 
     Args:
         df : データフレーム。
+        codes (np.ndarray): 各行のグループ番号。
+        n_groups (int): グループ数。
         low_threshold (float): MAPE test (%) の下限値。
         high_threshold (float): MAPE test (%) の上限値。
 
     Returns:
-        tuple: (low_mape_list, high_mape_list)
-            - low_mape_list: MAPE test (%) が low_threshold 以下の Leave One リスト。
-            - high_mape_list: MAPE test (%) が high_threshold 以上の Leave One リスト。
+        tuple: (low_mape_lists, high_mape_lists)
+            - low_mape_lists: グループごとの MAPE test (%) が low_threshold 以下の Leave One リスト。
+            - high_mape_lists: グループごとの MAPE test (%) が high_threshold 以上の Leave One リスト。
+    """
+    mape = df["MAPE test (%)"].to_numpy()
+    leave_one = df["Leave One"].to_numpy()
+
+    def group_lists(mask):
+        # 条件を満たす行をグループ番号で安定ソートし、元の行順のままグループごとに分割する
+        selected = np.flatnonzero(mask)
+        selected = selected[np.argsort(codes[selected], kind='stable')]
+        bounds = np.cumsum(np.bincount(codes[selected], minlength=n_groups))[:-1]
+        return [part.tolist() for part in np.split(leave_one[selected], bounds)]
+
+    return group_lists(mape <= low_threshold), group_lists(mape >= high_threshold)
+
+
+def hashable_value(value):
     """
-    # DataFrame の作成
+    リスト列の値をハッシュできる値 (タプル) に変換する (文字列などはそのまま)。
 
-    # 条件に基づくリスト作成
-    low_mape_list = df[df["MAPE test (%)"] <= low_threshold]["Leave One"].tolist()
-    high_mape_list = df[df["MAPE test (%)"] >= high_threshold]["Leave One"].tolist()
+    Args:
+        value: 列の値
 
-    return low_mape_list, high_mape_list
+    Returns:
+        ハッシュできる値
+    """
+    return tuple(value) if isinstance(value, list) else value
 
 
 def filter_variable_parameters(df, matrix_benchmarks, transfer_benchmarks):
@@ -146,22 +331,10 @@ def filter_variable_parameters(df, matrix_benchmarks, transfer_benchmarks):
     Returns:
         pd.DataFrame: 条件を満たす行を抽出したデータフレーム
     """
+    masks = parameter_masks(df)
 
-    # ベンチマークが含まれているかを判定するヘルパー関数
-    def contains_any(item_list, benchmarks):
-        return any(benchmark in item_list for benchmark in benchmarks)
-
-    # Variable Parameter列をリスト化
-    df["Variable Parameter List"] = df["Variable Parameter"].apply(eval)
-
-    # 行列計算ベンチマークと転送ベンチマークの両方を含む行をフィルタリング
-    filtered_df = df[
-        df["Variable Parameter List"].apply(lambda x: contains_any(x, matrix_benchmarks)) &
-        df["Variable Parameter List"].apply(lambda x: contains_any(x, transfer_benchmarks))]
-
-    # 不要な中間列を削除
-    filtered_df = filtered_df.drop(columns=["Variable Parameter List"])
-    return filtered_df
+    # 行列計算ベンチマークと転送ベンチマークの両方を含む行をビット演算でフィルタリング
+    return df[contains_any(masks, matrix_benchmarks) & contains_any(masks, transfer_benchmarks)]
 
 
 def load_data(data_dir, data_file):
@@ -177,7 +350,7 @@ def load_data(data_dir, data_file):
     """
     try:
         data_path = os.path.join(data_dir, data_file)
-        df = pd.read_csv(data_path)
+        df = load_table(data_path)
 
         # 欠損値の確認
         if df.isna().any().any():
@@ -202,7 +375,7 @@ def save_results(df, output_dir, output_file):
     """
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, output_file)
-    df.to_csv(output_path, index=False)
+    save_table(df, output_path, index=False)
     print(f"結果を {output_path} に保存しました。")
 
 
@@ -0,0 +1,418 @@
+import argparse
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from queue import Empty
+
+import numpy as np
+import pandas as pd
+
+# 計測対象のステージ (実行順)
+STAGES = [
+    'create_data_for_mlmodel',
+    'const_model',
+    'format_original_mlresult',
+    'analyze_ml_results',
+    'calculate_feature_importance',
+]
+
+# 計測シナリオ
+#   row_scale: results_all.csv と ml_results の行数の倍率
+#   server_copies: サーバーを何倍に増やすか (複製したサーバーは " v2" などの接尾辞を付ける)
+#   extra_benchmarks: 追加する合成ベンチマーク列の数
+SCENARIOS = {
+    'bundled': {'row_scale': 1, 'server_copies': 1, 'extra_benchmarks': 0},
+    'rows10x': {'row_scale': 10, 'server_copies': 1, 'extra_benchmarks': 0},
+    'rows100x': {'row_scale': 100, 'server_copies': 1, 'extra_benchmarks': 0},
+    'wide': {'row_scale': 1, 'server_copies': 2, 'extra_benchmarks': 9},
+}
+
+# 計測結果の履歴
+history_dir = './benchmark_results'
+history_file = 'history.json'
+
+# 入力データの置き場所
+data_dir = './data'
+ml_results_dir = './ml_results'
+mlresults_analyze_dir = './mlresults_analyze'
+shap_param_file = 'soturon_shap_param_list.csv'
+
+# 複製したサーバー名の接尾辞
+SERVER_COPY_SUFFIX = re.compile(r' v\d+$')
+
+# 1ステージの実行時間の上限 (s)。超えた場合は子プロセスを止めてエラーとして記録する (Noneの場合は無制限)
+STAGE_TIMEOUT = None
+# 子プロセスの計測結果を待つ間に、子プロセスが終了していないかを確認する間隔 (s)
+RESULT_POLL_INTERVAL = 1.0
+
+
+def main():
+    """
+    メイン処理: 指定したシナリオごとにパイプラインの各ステージを計測し、履歴に追記する。
+    """
+    parser = argparse.ArgumentParser(description='パイプラインの各ステージの実行時間を計測する')
+    parser.add_argument('--scenarios', nargs='+', default=['bundled'], choices=list(SCENARIOS))
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--history', default=os.path.join(history_dir, history_file))
+    parser.add_argument('--keep-workdir', action='store_true', help='作業ディレクトリを残す')
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    for scenario in args.scenarios:
+        run = run_scenario(scenario, args.stages, args.keep_workdir)
+        print_comparison(run, history)
+        history.append(run)
+        save_history(history, args.history)
+
+
+def run_scenario(scenario, stages, keep_workdir=False):
+    """
+    シナリオの入力データを作業ディレクトリに用意し、各ステージを別プロセスで計測する。
+
+    Args:
+        scenario (str): シナリオ名
+        stages (list): 計測するステージ名のリスト
+        keep_workdir (bool): 作業ディレクトリを削除しない場合True
+
+    Returns:
+        dict: 計測結果
+    """
+    config = SCENARIOS[scenario]
+    workdir = tempfile.mkdtemp(prefix=f'mlmodel_bench_{scenario}_')
+    try:
+        overrides = prepare_workdir(workdir, **config)
+        results = []
+        # 指定されていない前段のステージも出力を作るために実行する (記録はしない)
+        last = max(STAGES.index(stage) for stage in stages)
+        for stage in STAGES[:last + 1]:
+            print(f"[{scenario}] running {stage} ...")
+            result = measure_stage(stage, workdir, overrides)
+            print(f"[{scenario}] {stage}: {result['status']}, {result['wall_time_s']:.3f} s, "
+                  f"{format_mb(result['peak_rss_mb'])} "
+                  f"(workers {format_mb(result['peak_rss_children_mb'])}), "
+                  f"{result['fits']} fits, {result['n_workers']} workers")
+            if result['error']:
+                print(result['error'])
+            if stage in stages:
+                results.append(result)
+    finally:
+        if keep_workdir:
+            print(f"work directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'scenario': scenario,
+        'config': config,
+        'stages': results,
+    }
+
+
+def prepare_workdir(workdir, row_scale=1, server_copies=1, extra_benchmarks=0, seed=0):
+    """
+    作業ディレクトリに入力データをコピーし、シナリオに応じて合成データに拡張する。
+
+    Args:
+        workdir (str): 作業ディレクトリ
+        row_scale (int): 行数の倍率
+        server_copies (int): サーバーを何倍に増やすか
+        extra_benchmarks (int): 追加する合成ベンチマーク列の数
+        seed (int): 乱数シード
+
+    Returns:
+        dict: 各ステージのモジュール変数の上書き (モジュール名 -> {変数名: 値})
+    """
+    rng = np.random.default_rng(seed)
+    for name in ('data', 'ml_results', 'mldata_analyze'):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    shutil.copy(os.path.join(mlresults_analyze_dir, shap_param_file),
+                os.path.join(workdir, 'mldata_analyze', shap_param_file))
+
+    # 推論結果: サーバーの複製と行数の拡張
+    results_df = pd.read_csv(os.path.join(data_dir, 'results_all.csv'))
+    testbench_df = pd.read_csv(os.path.join(data_dir, 'testbench_all.csv'), index_col=0)
+    results_frames = [results_df]
+    testbench_frames = [testbench_df]
+    for copy in range(2, server_copies + 1):
+        # サーバーごとに推論時間とベンチマーク値を同じ倍率で変える
+        factors = pd.Series(rng.lognormal(0, 0.1, len(testbench_df)), index=testbench_df.index)
+        copied = results_df.copy()
+        copied['Inference Time (s)'] *= copied['Server Info'].map(factors).to_numpy()
+        copied['Server Info'] = copied['Server Info'] + f' v{copy}'
+        results_frames.append(copied)
+        copied_bench = testbench_df.mul(factors, axis=0)
+        copied_bench.index = copied_bench.index + f' v{copy}'
+        testbench_frames.append(copied_bench)
+    results_df = pd.concat(results_frames, ignore_index=True)
+    testbench_df = pd.concat(testbench_frames)
+
+    if row_scale > 1:
+        tiles = []
+        for i in range(row_scale):
+            tile = results_df.copy()
+            tile['Directory Name'] = tile['Directory Name'] + f'_r{i}'
+            tile['Inference Time (s)'] *= 1 + rng.normal(0, 0.02, len(tile))
+            tiles.append(tile)
+        results_df = pd.concat(tiles, ignore_index=True)
+
+    # 合成ベンチマーク列: 既存のベンチマークの線形結合にノイズを加えたもの
+    base_columns = list(testbench_df.columns)
+    extra_columns = []
+    for j in range(extra_benchmarks):
+        column = f'synthetic_{j}'
+        weights = rng.random(len(base_columns))
+        testbench_df[column] = (testbench_df[base_columns].to_numpy() @ weights *
+                                rng.lognormal(0, 0.05, len(testbench_df)))
+        extra_columns.append(column)
+
+    results_df.to_csv(os.path.join(workdir, 'data', 'results_all.csv'), index=False)
+    testbench_df.to_csv(os.path.join(workdir, 'data', 'testbench_all.csv'))
+
+    # 後段のステージの入力 (LOOCVの結果) を行数の倍率だけ複製する
+    for name in ('original_benchmark_parameter_loocv.csv', 'original_spec_parameter_loocv.csv',
+                 'format_benchmark_parameter_loocv.csv', 'format_spec_parameter_loocv.csv'):
+        df = pd.read_csv(os.path.join(ml_results_dir, name), index_col=0)
+        df = pd.concat([df] * row_scale, ignore_index=True)
+        df.to_csv(os.path.join(workdir, 'ml_results', name))
+
+    const_model = importlib.import_module('const_model')
+    return {
+        'const_model': {
+            'SERVER_LIST': list(results_df['Server Info'].unique()),
+            'benchmark_parameters': const_model.benchmark_parameters + extra_columns,
+        },
+    }
+
+
+def measure_stage(stage, workdir, overrides):
+    """
+    ステージを別プロセスで実行し、実行時間・ピークRSS・学習回数を計測する。
+    子プロセスが計測結果を送らずに終了した場合や、STAGE_TIMEOUTを超えた場合はエラーとして記録する。
+
+    Args:
+        stage (str): ステージ名 (モジュール名)
+        workdir (str): 作業ディレクトリ
+        overrides (dict): モジュール変数の上書き
+
+    Returns:
+        dict: 計測結果
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=run_stage,
+                          args=(stage, workdir, overrides, queue, multiprocessing.get_start_method()))
+    start = time.perf_counter()
+    process.start()
+    result, error = receive_result(process, queue, start)
+    process.join()
+    if result is None:
+        result = {
+            'status': 'error',
+            'error': error,
+            'wall_time_s': time.perf_counter() - start,
+            'peak_rss_mb': None,
+            'peak_rss_children_mb': None,
+            'fits': None,
+            'n_workers': None,
+            'start_method': None,
+        }
+    result['stage'] = stage
+    result['fits_per_s'] = (result['fits'] / result['wall_time_s']
+                            if result['fits'] and result['wall_time_s'] > 0 else None)
+    return result
+
+
+def receive_result(process, queue, start):
+    """
+    子プロセスの計測結果を受け取る。子プロセスが異常終了した場合に待ち続けないように、
+    一定間隔で終了コードを確認する。
+
+    Args:
+        process (multiprocessing.Process): ステージを実行する子プロセス
+        queue (multiprocessing.Queue): 計測結果の送信元
+        start (float): 子プロセスを開始した時刻 (time.perf_counter)
+
+    Returns:
+        tuple: (result, error)
+            result: 計測結果 (受け取れなかった場合はNone)
+            error: 受け取れなかった理由
+    """
+    while True:
+        try:
+            return queue.get(timeout=RESULT_POLL_INTERVAL), None
+        except Empty:
+            pass
+        if process.exitcode is not None:
+            # 終了直前に送られた結果が届いていれば使う
+            try:
+                return queue.get(timeout=RESULT_POLL_INTERVAL), None
+            except Empty:
+                return None, f"stage process exited with code {process.exitcode} without a result"
+        if STAGE_TIMEOUT is not None and time.perf_counter() - start > STAGE_TIMEOUT:
+            process.terminate()
+            return None, f"stage timed out after {STAGE_TIMEOUT} s"
+
+
+def format_mb(value):
+    """
+    メモリ使用量 (MB) を表示用の文字列にする。
+
+    Args:
+        value (float or None): メモリ使用量 (MB)
+
+    Returns:
+        str: 表示用の文字列
+    """
+    return '-' if value is None else f"{value:.1f} MB"
+
+
+def run_stage(stage, workdir, overrides, queue, start_method=None):
+    """
+    子プロセスでステージのmain関数を実行する。
+
+    Args:
+        stage (str): ステージ名 (モジュール名)
+        workdir (str): 作業ディレクトリ
+        overrides (dict): モジュール変数の上書き
+        queue (multiprocessing.Queue): 計測結果の送信先
+        start_method (str or None): ワーカープロセスの起動方法 (親プロセスの既定の方法)
+    """
+    import lightgbm
+
+    # spawnで起動したこのプロセスでは既定の起動方法がspawnになるため、
+    # ステージを直接実行した場合と同じ起動方法でワーカープロセスを起動するように戻す
+    if start_method is not None:
+        multiprocessing.set_start_method(start_method, force=True)
+
+    # LightGBMの学習回数を数える。forkで起動したワーカープロセスでの学習も数えるように共有メモリに置く
+    fits = multiprocessing.Value('q', 0)
+    train = lightgbm.train
+
+    def counted_train(*args, **kwargs):
+        with fits.get_lock():
+            fits.value += 1
+        return train(*args, **kwargs)
+
+    lightgbm.train = counted_train
+
+    status, error = 'ok', None
+    start = time.perf_counter()
+    try:
+        # 複製したサーバーのスペックは元のサーバーのものを使う
+        create_data = importlib.import_module('create_data_for_mlmodel')
+        get_server_spec = create_data.get_server_spec
+        create_data.get_server_spec = lambda server: get_server_spec(
+            SERVER_COPY_SUFFIX.sub('', server))
+
+        for module_name, values in overrides.items():
+            module = importlib.import_module(module_name)
+            for name, value in values.items():
+                setattr(module, name, value)
+
+        module = importlib.import_module(stage)
+        os.chdir(workdir)
+        start = time.perf_counter()
+        module.main()
+    except BaseException:  # SystemExitも計測結果として記録する
+        status, error = 'error', traceback.format_exc(limit=3)
+    wall_time = time.perf_counter() - start
+
+    # ワーカープロセス数 (並列に学習するステージのみ) と起動方法。
+    # fork以外で起動したワーカーの学習は数えられないため、学習回数と合わせて記録する
+    const_model = sys.modules.get('const_model')
+    queue.put({
+        'status': status,
+        'error': error,
+        'wall_time_s': wall_time,
+        # Linuxのru_maxrssはKB単位
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # 終了したワーカープロセスのうち最大のピークRSS
+        'peak_rss_children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'fits': fits.value,
+        'n_workers': getattr(const_model, 'N_WORKERS', None),
+        'start_method': multiprocessing.get_start_method(),
+    })
+
+
+def print_comparison(run, history):
+    """
+    同じシナリオの前回の計測結果と比較して表示する。
+
+    Args:
+        run (dict): 今回の計測結果
+        history (list): これまでの計測結果
+    """
+    previous = next((r for r in reversed(history) if r['scenario'] == run['scenario']), None)
+    if previous is None:
+        return
+    previous_stages = {s['stage']: s for s in previous['stages']}
+    print(f"[{run['scenario']}] compared with {previous['commit']} ({previous['timestamp']})")
+    for stage in run['stages']:
+        before = previous_stages.get(stage['stage'])
+        if before is None or before['status'] != 'ok' or before['wall_time_s'] <= 0:
+            continue
+        ratio = stage['wall_time_s'] / before['wall_time_s']
+        print(f"  {stage['stage']}: {before['wall_time_s']:.3f} s -> "
+              f"{stage['wall_time_s']:.3f} s (x{ratio:.2f})")
+
+
+def load_history(history_path):
+    """
+    計測結果の履歴を読み込む。
+
+    Args:
+        history_path (str): 履歴ファイルのパス
+
+    Returns:
+        list: 計測結果のリスト
+    """
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(history, history_path):
+    """
+    計測結果の履歴を保存する。
+
+    Args:
+        history (list): 計測結果のリスト
+        history_path (str): 履歴ファイルのパス
+    """
+    os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+    with open(history_path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    print(f"計測結果を {history_path} に保存しました。")
+
+
+def git_commit():
+    """
+    現在のgitコミットを取得する。
+
+    Returns:
+        str or None: コミットハッシュ
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
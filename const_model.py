@@ -1,10 +1,20 @@
 import itertools
+import json
 import os
+import time
 
+import numpy as np
 import pandas as pd
 
 import light_gbm as lgb_reg
-from format_mldata import format_data_loocv
+import tracing
+from format_mldata import load_dataset
+from format_original_mlresult import rename_list, weights
+from model_registry import ModelRegistry
+from parameter_mask import add_parameter_columns
+from result_store import ResultStore, fold_key
+from search_progress import SearchProgress
+from table_store import save_table
 """
 入力候補
 ['Directory Name', 'Total Frames', 'Width', 'Height', 'Pixels',
@@ -47,24 +57,165 @@ server_spec_parameters = [
 # ターゲット変数
 target = 'Inference Time (s)'
 
+# 並列実行するワーカープロセス数 (1の場合は逐次実行)
+N_WORKERS = 1
+# ワーカーごとのLightGBMスレッド数 (Noneの場合はLightGBMの既定値)
+LGB_NUM_THREADS = None
+# foldごとの評価結果を逐次保存するSQLiteファイル (output_dir内)
+RESULT_STORE_FILE = 'search_results.sqlite'
+# foldごとに全候補特徴量のDatasetを一度だけビン分割し、組み合わせ間で使い回すかどうか
+REUSE_BINNING = False
+
+# 特徴量の組み合わせの探索方法 ('exhaustive', 'forward', 'backward', 'beam')
+SEARCH_STRATEGY = 'exhaustive'
+# beam探索のビーム幅
+BEAM_WIDTH = 3
+# 探索時のスコア = 平均MAPE test (%) + COST_WEIGHT * ベンチマークのTime Cost (s)
+COST_WEIGHT = 0.0
+
+# 指定した場合、リッジ回帰 (linear_model) の平均MAPE test (%) で組み合わせを順位付けし、
+# 上位LINEAR_SCREEN_TOP_K個のみをLightGBMで評価する (exhaustiveの場合のみ。Noneの場合は絞り込まない)
+LINEAR_SCREEN_TOP_K = None
+
+# 見込みのない組み合わせのfoldを打ち切る場合の閾値
+# (上位RACE_TOP_K番目の平均MAPE, またはRACE_THRESHOLD。Noneの場合は打ち切らない)
+RACE_TOP_K = None
+RACE_THRESHOLD = None
+# 打ち切りを判定する前に評価する最小fold数
+RACE_MIN_FOLDS = 3
+# 平均MAPEの下側信頼限界の信頼係数 (片側95%)
+RACE_Z = 1.645
+
+# 学習済みモデルを保存し、同じ学習を再実行するときに再学習せずに使うディレクトリ
+# (output_dir内。例: 'models')。モデルの保存に容量と時間がかかるため、既定では保存しない。
+# onboard_serverは追加前のfoldのモデルから学習を続けるために、ONBOARD_MODEL_REGISTRY_DIRを使う
+MODEL_REGISTRY_DIR = None
+# 保存するモデルの合計サイズの上限 (MB)。超えた場合は最後に使われた時刻が古いものから削除する
+MODEL_REGISTRY_MAX_MB = 1024
+
+# hyperparameter_searchで選んだ学習パラメータを使うかどうか (Falseの場合はLightGBMの既定値)
+USE_TUNED_PARAMS = False
+# hyperparameter_searchで選んだ学習パラメータのJSONファイル (output_dir内)
+TUNED_PARAMS_FILE = 'best_lgb_params.json'
+
+# 学習と同時にテストデータのSHAP値から特徴量の重要度を計算し、評価結果に 'SHAP Value' として含めるかどうか
+COMPUTE_SHAP = False
+
+# 指定した場合、学習のフェーズ (データ読み込み、Dataset構築、学習、予測など) の時間を計測し、
+# Chromeのトレース形式 (chrome://tracing, Perfetto) のJSONと、フェーズごとの集計表 (.csv) を保存する
+# (output_dir内。Noneの場合は計測しない)
+TRACE_FILE = None
+
+# 探索の進捗 (評価済み・残りのfold数, fits/s, 残り時間, ワーカーの稼働率, 最良の平均MAPE) を
+# 一定間隔で保存するJSONファイル (output_dir内。例: 'progress.json'。Noneの場合は端末への表示のみ)
+PROGRESS_FILE = None
+
+# ビン分割済みのfoldのキャッシュ (プロセスごと)
+_binned_folds = {}
+# 開いたモデルレジストリのキャッシュ (プロセスごと。ディレクトリ -> ModelRegistry)
+_model_registries = {}
+# ワーカープロセスで開いた結果ストアのキャッシュ (プロセスごと。ファイルのパス -> ResultStore)
+_result_stores = {}
+
 
 def main():
     """
     メイン処理: ベンチマークデータの特徴量の組み合わせを評価し、結果をCSVに保存する。
+    評価済みのfoldはRESULT_STORE_FILEに保存され、再実行時は読み飛ばされる。
     """
+    os.makedirs(output_dir, exist_ok=True)
+    store = ResultStore(os.path.join(output_dir, RESULT_STORE_FILE))
+    if TRACE_FILE is not None:
+        tracing.enable()
+
     #specの特徴量組み合わせ
-    parameters_conbs = get_parameters_conb(server_spec_parameters, max_size=1)
     data_path = os.path.join(data_dir, server_spec_data_file)
-    model_info = search_parameters_conb(parameters_conbs, data_path)
+    model_info = run_search(server_spec_parameters, data_path, store, max_size=1)
     output_csv = "original_one_spec_parameter_loocv.csv"
     output_results_to_csv(model_info, output_csv)
 
     # ベンチマークデータの特徴量組み合わせ
-    parameters_conbs = get_parameters_conb(benchmark_parameters, max_size=1)
     data_path = os.path.join(data_dir, benchmark_data_file)
-    model_info = search_parameters_conb(parameters_conbs, data_path)
+    model_info = run_search(benchmark_parameters, data_path, store, max_size=1)
     output_csv = "original_one_benchmark_parameter_loocv.csv"
     output_results_to_csv(model_info, output_csv)
+    store.close()
+    if TRACE_FILE is not None:
+        tracing.finish(os.path.join(output_dir, TRACE_FILE))
+
+
+def run_search(parameters, data_path, store, max_size=None, init_keys=None, servers=None):
+    """
+    SEARCH_STRATEGYで指定した方法で特徴量の組み合わせを探索する。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        store (ResultStore or None): 評価結果の保存先
+        max_size (int or None): 組み合わせの最大サイズ
+        init_keys (dict or None): 学習を続けるモデルのキー (search_parameters_conbを参照)
+        servers (list or None): Leave-one-outで除外するサーバー名のリスト (Noneの場合はSERVER_LIST)
+
+    Returns:
+        list: 評価したすべての組み合わせのモデルの評価結果
+    """
+    # 段階的な探索でも、探索全体の進捗を1つにまとめて表示・保存する
+    servers = list(SERVER_LIST if servers is None else servers)
+    progress = make_progress(N_WORKERS, data_path, len(servers))
+    search_kwargs = {
+        'progress': progress,
+        'n_workers': N_WORKERS,
+        'num_threads': LGB_NUM_THREADS,
+        'store': store,
+        'reuse_binning': REUSE_BINNING,
+        'race_top_k': RACE_TOP_K,
+        'race_threshold': RACE_THRESHOLD,
+        'shap_values': COMPUTE_SHAP,
+        'init_keys': init_keys,
+        'lgb_params': load_tuned_params(),
+        # 探索の段階ごとに評価する組み合わせが変わっても、同じDatasetとキーを使うように全候補でビン分割する
+        'binning_parameters': parameters,
+        'servers': servers,
+    }
+    if SEARCH_STRATEGY == 'exhaustive':
+        parameters_conbs = get_parameters_conb(parameters, max_size=max_size)
+        if LINEAR_SCREEN_TOP_K is not None:
+            from linear_model import screen_parameters_conbs
+            parameters_conbs = screen_parameters_conbs(const_parameters, parameters_conbs,
+                                                       data_path, servers, target,
+                                                       LINEAR_SCREEN_TOP_K)
+            print(f"linear screening: {len(parameters_conbs)} combinations are evaluated "
+                  f"with LightGBM")
+        model_info = search_parameters_conb(parameters_conbs, data_path, **search_kwargs)
+        progress.close()
+        return model_info
+
+    strategy = SEARCH_STRATEGIES[SEARCH_STRATEGY]
+    best_parameters, best_score, model_info = strategy(parameters,
+                                                       data_path,
+                                                       cost_weight=COST_WEIGHT,
+                                                       max_size=max_size,
+                                                       width=BEAM_WIDTH,
+                                                       **search_kwargs)
+    progress.close()
+    print(f"best parameters ({SEARCH_STRATEGY}): {best_parameters}, score: {best_score:.5f}")
+    return model_info
+
+
+def load_tuned_params():
+    """
+    USE_TUNED_PARAMSがTrueの場合、hyperparameter_searchで選んだ学習パラメータを読み込む。
+
+    Returns:
+        dict or None: 学習パラメータ。使わない場合はNone
+    """
+    if not USE_TUNED_PARAMS:
+        return None
+    path = os.path.join(output_dir, TUNED_PARAMS_FILE)
+    with open(path, encoding='utf-8') as f:
+        tuned = json.load(f)
+    print(f"using tuned parameters from {path}: {tuned['params']}")
+    return tuned['params']
 
 
 def get_parameters_conb(parameters, min_size=1, max_size=None):
@@ -90,24 +241,501 @@ def get_parameters_conb(parameters, min_size=1, max_size=None):
     return conbs
 
 
-def search_parameters_conb(parameters_conbs, data_path):
+def search_parameters_conb(parameters_conbs,
+                           data_path,
+                           n_workers=1,
+                           num_threads=None,
+                           store=None,
+                           reuse_binning=False,
+                           race_top_k=None,
+                           race_threshold=None,
+                           shap_values=False,
+                           init_keys=None,
+                           lgb_params=None,
+                           binning_parameters=None,
+                           progress=None,
+                           servers=None):
     """
     特徴量の組み合わせごとに、leave-one-out交差検証を行う。
+    n_workersが2以上の場合はプロセスプールで並列に実行する。結果の順序は逐次実行と同一。
+    storeを指定した場合は評価済みのfoldを読み飛ばし、評価が終わるたびに結果を保存する。
+    reuse_binningがTrueの場合は、foldごとに全候補特徴量のDatasetを一度だけビン分割して使い回す。
+    race_top_kまたはrace_thresholdを指定した場合は、見込みのない組み合わせのfoldを途中で打ち切る
+    (race_parameters_conbsを参照)。
+    shap_valuesがTrueの場合は、学習したモデルでテストデータのSHAP値も計算する (再学習は不要)。
+    init_keysを指定した場合は、モデルレジストリに保存したモデルから学習を続ける (evaluate_foldを参照)。
     
     Args:
         parameters_conbs (list): 特徴量の組み合わせリスト
         data_path (str): データのパス
+        n_workers (int): ワーカープロセス数
+        num_threads (int or None): 1モデルあたりのLightGBMスレッド数
+        store (ResultStore or None): 評価結果の保存先
+        reuse_binning (bool): ビン分割済みのDatasetを組み合わせ間で使い回すかどうか
+        race_top_k (int or None): 上位k番目の平均MAPE test (%) を打ち切りの閾値にする
+        race_threshold (float or None): 平均MAPE test (%) の打ち切りの閾値
+        shap_values (bool): 評価結果に特徴量ごとのSHAP値の重要度 ('SHAP Value') を含めるかどうか
+        init_keys (dict or None): (tuple(server_parameters), server) -> 学習を続けるモデルの
+            レジストリのキー。打ち切りあり (race_top_k, race_threshold) の場合は使わない
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き (load_tuned_paramsなど)
+        binning_parameters (list or None): reuse_binningの場合にビン分割する全候補の
+            サーバーに関する特徴量 (run_searchの候補特徴量など)。parameters_conbsに含まれる特徴量は
+            常に加える。Noneの場合はparameters_conbsに含まれる特徴量のみ
+        progress (SearchProgress or None): 評価の進捗 (make_progress)。段階的な探索で探索全体の
+            進捗を共有する場合に指定し、終了時のcloseは呼び出し側で行う。Noneの場合はこの呼び出しの
+            進捗を作り、終了時に表示・保存する
+        servers (list or None): Leave-one-outで除外するサーバー名のリスト (Noneの場合はSERVER_LIST)
 
     Returns:
         list: モデルの評価結果
     """
-    model_info = []
-    for server_parameters in parameters_conbs:
-        model_info.extend(loocv(const_parameters, server_parameters, data_path))  # リストを展開して追加
+    servers = list(SERVER_LIST if servers is None else servers)
+    lgb_params = dict(lgb_params or {})
+    if num_threads is not None:
+        lgb_params['num_threads'] = num_threads
+    lgb_params = lgb_params or None
+    candidate_parameters = None
+    if reuse_binning:
+        candidate_parameters = get_candidate_parameters(parameters_conbs, binning_parameters)
+    tasks = [(server_parameters, server)
+             for server_parameters in parameters_conbs
+             for server in servers]
+    racing = race_top_k is not None or race_threshold is not None
+    own_progress = progress is None
+    if own_progress:
+        progress = make_progress(n_workers, data_path, len(servers))
+    progress.add_tasks(len(tasks))
+    # 学習を続けられるfoldのみinit_keyを使う (打ち切りありの場合は使わない)
+    task_init_keys = resolve_init_keys(tasks, data_path, None if racing else init_keys,
+                                       candidate_parameters)
+
+    # 保存済みの評価結果を読み込む
+    keys = None
+    done = {}
+    if store is not None:
+        with tracing.span('store.get_many'):
+            keys = get_fold_keys(tasks, data_path, lgb_params, candidate_parameters,
+                                 task_init_keys)
+            done = store.get_many(keys)
+        if shap_values:
+            # SHAP値なしで保存された結果は再評価する
+            done = {key: result for key, result in done.items() if 'SHAP Value' in result}
+        else:
+            done = {key: strip_shap_values(result) for key, result in done.items()}
+        if done:
+            print(f"{len(done)} / {len(tasks)} folds are already evaluated.")
+
+    if racing:
+        model_info = race_parameters_conbs(parameters_conbs, data_path, n_workers, lgb_params,
+                                           candidate_parameters, store, keys, done, race_top_k,
+                                           race_threshold, shap_values, progress, servers)
+        if own_progress:
+            progress.close()
+        return model_info
+
+    model_info = [None] * len(tasks)
+    if keys is not None:
+        model_info = [done.get(key) for key in keys]
+    pending = [i for i, result in enumerate(model_info) if result is None]
+    pending_init_keys = {i: task_init_keys[i] for i in pending}
+    for result in model_info:
+        if result is not None:
+            progress.update(result, cached=True)
+
+    def on_result(i, result):
+        model_info[i] = result
+        if store is not None:
+            with tracing.span('store.put'):
+                store.put(keys[i], result)
+        progress.update(result)
+
+    if n_workers > 1:
+        from parallel_search import run_folds_parallel
+        run_folds_parallel([(i, *tasks[i], pending_init_keys[i]) for i in pending], data_path,
+                           n_workers, lgb_params, on_result, candidate_parameters, shap_values,
+                           progress)
+    else:
+        for i in pending:
+            server_parameters, server = tasks[i]
+            start = time.perf_counter()
+            result = evaluate_fold(const_parameters, server_parameters, server, data_path,
+                                   lgb_params, candidate_parameters, shap_values,
+                                   pending_init_keys[i])
+            progress.add_busy(os.getpid(), time.perf_counter() - start)
+            on_result(i, result)
+    if own_progress:
+        progress.close()
     return model_info
 
 
-def loocv(const_parameters, server_parameters, data_path):
+def get_candidate_parameters(parameters_conbs, binning_parameters=None):
+    """
+    ビン分割済みのDatasetを使い回す場合に、ビン分割する全候補特徴量を求める。
+
+    Args:
+        parameters_conbs (list): 特徴量の組み合わせリスト
+        binning_parameters (list or None): 全候補のサーバーに関する特徴量
+            (search_parameters_conbを参照)
+
+    Returns:
+        list: 定数特徴量と全候補のサーバーに関する特徴量
+    """
+    return const_parameters + list(
+        dict.fromkeys(
+            itertools.chain(binning_parameters or [],
+                            (p for conb in parameters_conbs for p in conb))))
+
+
+def make_progress(n_workers, data_path, n_folds=None):
+    """
+    (特徴量の組み合わせ, fold) の評価の進捗を作る。評価するfoldはsearch_parameters_conbが
+    呼び出しごとに加える。PROGRESS_FILEを指定した場合はoutput_dirに保存する。
+
+    Args:
+        n_workers (int): ワーカープロセス数
+        data_path (str): データのパス (表示用)
+        n_folds (int or None): 1つの組み合わせあたりのfold数 (Noneの場合はSERVER_LISTのサーバー数)
+
+    Returns:
+        SearchProgress: 進捗
+    """
+    status_path = None if PROGRESS_FILE is None else os.path.join(output_dir, PROGRESS_FILE)
+    n_folds = len(SERVER_LIST) if n_folds is None else n_folds
+    return SearchProgress(0, n_folds, n_workers, status_path,
+                          label=os.path.basename(data_path))
+
+
+def strip_shap_values(result):
+    """
+    評価結果からSHAP値の重要度を取り除く。
+
+    Args:
+        result (dict): モデル評価結果
+
+    Returns:
+        dict: 'SHAP Value' を除いたモデル評価結果
+    """
+    return {key: value for key, value in result.items() if key != 'SHAP Value'}
+
+
+def resolve_init_keys(tasks, data_path, init_keys, candidate_parameters=None):
+    """
+    (特徴量の組み合わせ, 除外サーバー) ごとに、学習を続けるモデルのキーを決める。
+    モデルレジストリにモデルがない場合、入力列数が異なる場合、candidate_parametersを指定した場合は
+    最初から学習するためNoneとする。
+
+    Args:
+        tasks (list): (server_parameters, server) のリスト
+        data_path (str): データのパス
+        init_keys (dict or None): (tuple(server_parameters), server) -> 学習を続けるモデルのキー
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+
+    Returns:
+        list: tasksの順の学習を続けるモデルのキー (最初から学習する場合はNone)
+    """
+    registry = get_model_registry()
+    if not init_keys or registry is None or candidate_parameters is not None:
+        return [None] * len(tasks)
+    dataset = load_dataset(data_path)
+    matrix = dataset.feature_matrix(target)
+    resolved = []
+    for server_parameters, server in tasks:
+        init_key = init_keys.get((tuple(server_parameters), server))
+        n_features = len(matrix.column_indices(const_parameters + server_parameters))
+        if init_key is not None and get_init_model(registry, init_key, n_features,
+                                                   dataset.train_indices[server]) is None:
+            init_key = None
+        resolved.append(init_key)
+    return resolved
+
+
+def get_fold_keys(tasks, data_path, lgb_params, candidate_parameters=None, init_keys=None):
+    """
+    (特徴量の組み合わせ, 除外サーバー) ごとに結果ストアのキーを計算する。
+
+    Args:
+        tasks (list): (server_parameters, server) のリスト
+        data_path (str): データのパス
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        init_keys (list or None): tasksの順の学習を続けるモデルのキー (resolve_init_keysを参照)
+
+    Returns:
+        list: キーのリスト
+    """
+    dataset = load_dataset(data_path)
+    init_keys = init_keys or [None] * len(tasks)
+    return [
+        fold_model_key(dataset, const_parameters + server_parameters, server, lgb_params,
+                       candidate_parameters, init_key)
+        for (server_parameters, server), init_key in zip(tasks, init_keys)
+    ]
+
+
+def fold_model_key(dataset, parameters, server, lgb_params, candidate_parameters=None,
+                   init_key=None):
+    """
+    1つのfoldの学習のキーを計算する。結果ストアとモデルレジストリで同じキーを使う。
+
+    Args:
+        dataset (LoocvDataset): データセット
+        parameters (list): 使用する特徴量のリスト
+        server (str): Leave-one-outで除外するサーバー名
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        init_key (str or None): 学習を続けたモデルのキー
+
+    Returns:
+        str: キー
+    """
+    key_params = lgb_params
+    if candidate_parameters is not None:
+        # 分岐の同点時の扱いが変わるため、候補特徴量もキーに含める
+        key_params = dict(lgb_params or {}, candidate_parameters=candidate_parameters)
+    if init_key is not None:
+        # 学習を続けたモデルは最初から学習したモデルと結果が異なるため、別のキーにする
+        key_params = dict(key_params or {}, init_model=init_key)
+    data_version = dataset.columns_version(['Server Info', target] + list(parameters))
+    return fold_key(parameters, server, key_params, data_version)
+
+
+def race_parameters_conbs(parameters_conbs, data_path, n_workers, lgb_params,
+                          candidate_parameters, store, keys, done, top_k, threshold,
+                          shap_values=False, progress=None, servers=None):
+    """
+    特徴量の組み合わせごとにfoldを順に評価し、見込みのない組み合わせを途中で打ち切る。
+    閾値は、race_thresholdと、打ち切られずに完了した組み合わせのうち上位top_k番目の
+    平均MAPE test (%) の小さい方。評価結果には打ち切りの有無を 'Truncated' 列として付ける。
+    並列実行時は、組み合わせを投入する時点の閾値を使う。
+
+    Args:
+        parameters_conbs (list): 特徴量の組み合わせリスト
+        data_path (str): データのパス
+        n_workers (int): ワーカープロセス数
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        store (ResultStore or None): 評価結果の保存先
+        keys (list or None): foldごとの結果ストアのキー
+        done (dict): 保存済みの評価結果 (キー -> 評価結果)
+        top_k (int or None): 上位k番目の平均MAPE test (%) を閾値にする
+        threshold (float or None): 平均MAPE test (%) の閾値
+        shap_values (bool): 評価結果にSHAP値の重要度を含めるかどうか
+        progress (SearchProgress or None): 評価の進捗 (評価するfoldは加えてあるもの)
+        servers (list or None): Leave-one-outで除外するサーバー名のリスト (Noneの場合はSERVER_LIST)
+
+    Returns:
+        list: モデルの評価結果 (打ち切られた組み合わせは評価したfoldのみ)
+    """
+    servers = list(SERVER_LIST if servers is None else servers)
+    n_folds = len(servers)
+    completed_mapes = []
+    results = [None] * len(parameters_conbs)
+    own_progress = progress is None
+    if own_progress:
+        progress = make_progress(n_workers, data_path, n_folds)
+        progress.add_tasks(len(parameters_conbs) * n_folds)
+
+    def current_threshold():
+        thresholds = [] if threshold is None else [threshold]
+        if top_k is not None and len(completed_mapes) >= top_k:
+            thresholds.append(sorted(completed_mapes)[top_k - 1])
+        return min(thresholds) if thresholds else None
+
+    def make_task(i):
+        known = {}
+        fold_keys = None
+        if keys is not None:
+            fold_keys = {server: keys[i * n_folds + j] for j, server in enumerate(servers)}
+            known = {server: done[key] for server, key in fold_keys.items() if key in done}
+        return parameters_conbs[i], current_threshold(), known, fold_keys
+
+    def on_result(i, model_info, truncated):
+        # 評価結果はfoldごとに評価した時点で保存済み
+        for j, result in enumerate(model_info):
+            progress.update(result, cached=keys is not None and keys[i * n_folds + j] in done)
+        if truncated:
+            progress.skip(n_folds - len(model_info))
+        else:
+            completed_mapes.append(np.mean([result['MAPE test (%)'] for result in model_info]))
+        results[i] = [dict(result, Truncated=truncated) for result in model_info]
+
+    if n_workers > 1:
+        from parallel_search import run_races_parallel
+        # ワーカーがfoldを評価するたびに結果ストアに保存する (組み合わせの途中で止まっても失わない)
+        run_races_parallel(len(parameters_conbs), make_task, data_path, n_workers, lgb_params,
+                           on_result, candidate_parameters, shap_values, progress,
+                           None if store is None else store.db_path, servers)
+    else:
+        for i in range(len(parameters_conbs)):
+            server_parameters, race_threshold, known, fold_keys = make_task(i)
+            on_fold = None
+            if store is not None:
+                on_fold = lambda server, result: store.put(fold_keys[server], result)
+            start = time.perf_counter()
+            model_info, truncated = race_loocv(const_parameters, server_parameters, data_path,
+                                               race_threshold, lgb_params, candidate_parameters,
+                                               known, shap_values, on_fold, servers)
+            progress.add_busy(os.getpid(), time.perf_counter() - start,
+                              len(model_info) - len(known))
+            on_result(i, model_info, truncated)
+    if own_progress:
+        progress.close()
+    return [result for model_info in results for result in model_info]
+
+
+def parameters_time_cost(server_parameters):
+    """
+    特徴量の組み合わせに含まれるベンチマークの実行時間の合計を計算する。
+    ベンチマーク以外の特徴量のコストは0とする。
+
+    Args:
+        server_parameters (list): サーバーに関する特徴量
+
+    Returns:
+        float: Time Cost (s)
+    """
+    return sum(weights.get(rename_list.get(p, p), 0) for p in server_parameters)
+
+
+def score_parameters_conbs(parameters_conbs, data_path, cost_weight=0.0, **search_kwargs):
+    """
+    特徴量の組み合わせごとにLOOCVを行い、探索用のスコアを計算する。
+
+    Args:
+        parameters_conbs (list): 特徴量の組み合わせリスト
+        data_path (str): データのパス
+        cost_weight (float): Time Cost (s) の重み
+        **search_kwargs: search_parameters_conbに渡す引数
+
+    Returns:
+        tuple: (scores, model_info)
+            scores: 組み合わせごとのスコア (平均MAPE test (%) + cost_weight * Time Cost (s))。
+                打ち切られた組み合わせはinf
+            model_info: モデルの評価結果
+    """
+    model_info = search_parameters_conb(parameters_conbs, data_path, **search_kwargs)
+    mape_tests = {}
+    for result in model_info:
+        if result.get('Truncated', False):
+            # 打ち切られた組み合わせは選ばれないようにする
+            mape_tests[tuple(result['Variable Parameter'])] = [float('inf')]
+        else:
+            mape_tests.setdefault(tuple(result['Variable Parameter']),
+                                  []).append(result['MAPE test (%)'])
+    mean_mape_test = np.array([np.mean(mape_tests[tuple(conb)]) for conb in parameters_conbs])
+    time_costs = np.array([parameters_time_cost(conb) for conb in parameters_conbs])
+    return (mean_mape_test + cost_weight * time_costs).tolist(), model_info
+
+
+def beam_search(parameters, data_path, cost_weight=0.0, max_size=None, width=3, **search_kwargs):
+    """
+    ビーム幅widthの前向き探索で特徴量の組み合わせを選択する。
+    各段階でビーム内の組み合わせに特徴量を1つ追加した候補をまとめて評価し、
+    スコアの良い上位width個を残す。最良スコアが改善しなくなった時点で終了する。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        cost_weight (float): Time Cost (s) の重み
+        max_size (int or None): 組み合わせの最大サイズ
+        width (int): ビーム幅
+        **search_kwargs: search_parameters_conbに渡す引数
+
+    Returns:
+        tuple: (best_parameters, best_score, model_info)
+    """
+    if max_size is None:
+        max_size = len(parameters)
+    order = {p: i for i, p in enumerate(parameters)}
+    best_parameters, best_score = None, float('inf')
+    model_info = []
+    beam = [[]]
+    while beam and len(beam[0]) < max_size:
+        # ビーム内の組み合わせに1つ特徴量を追加した候補 (重複を除き、元の並び順に揃える)
+        candidates = list(
+            dict.fromkeys(
+                tuple(sorted(conb + [p], key=order.get))
+                for conb in beam
+                for p in parameters
+                if p not in conb))
+        if not candidates:
+            break
+        candidates = [list(conb) for conb in candidates]
+        scores, results = score_parameters_conbs(candidates, data_path, cost_weight,
+                                                 **search_kwargs)
+        model_info.extend(results)
+
+        ranked = sorted(zip(scores, candidates), key=lambda x: x[0])
+        if ranked[0][0] >= best_score:
+            break
+        best_score, best_parameters = ranked[0]
+        beam = [conb for _, conb in ranked[:width]]
+    return best_parameters, best_score, model_info
+
+
+def forward_selection(parameters, data_path, cost_weight=0.0, max_size=None, **search_kwargs):
+    """
+    前向き選択で特徴量の組み合わせを選択する (ビーム幅1のbeam探索)。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        cost_weight (float): Time Cost (s) の重み
+        max_size (int or None): 組み合わせの最大サイズ
+        **search_kwargs: search_parameters_conbに渡す引数
+
+    Returns:
+        tuple: (best_parameters, best_score, model_info)
+    """
+    search_kwargs.pop('width', None)
+    return beam_search(parameters, data_path, cost_weight, max_size, width=1, **search_kwargs)
+
+
+def backward_elimination(parameters, data_path, cost_weight=0.0, max_size=None, **search_kwargs):
+    """
+    後ろ向き除去で特徴量の組み合わせを選択する。
+    全特徴量から始め、1つ除いた候補をまとめて評価し、最良スコアが改善しなくなった時点で終了する。
+    max_sizeを指定した場合は、特徴量数がmax_size以下になるまでは改善しなくても除去を続ける。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        cost_weight (float): Time Cost (s) の重み
+        max_size (int or None): 組み合わせの最大サイズ
+        **search_kwargs: search_parameters_conbに渡す引数
+
+    Returns:
+        tuple: (best_parameters, best_score, model_info)
+    """
+    search_kwargs.pop('width', None)
+    if max_size is None:
+        max_size = len(parameters)
+    best_parameters = list(parameters)
+    scores, model_info = score_parameters_conbs([best_parameters], data_path, cost_weight,
+                                                **search_kwargs)
+    best_score = scores[0]
+    while len(best_parameters) > 1:
+        candidates = [[q for q in best_parameters if q != p] for p in best_parameters]
+        scores, results = score_parameters_conbs(candidates, data_path, cost_weight,
+                                                 **search_kwargs)
+        model_info.extend(results)
+
+        score, conb = min(zip(scores, candidates), key=lambda x: x[0])
+        if score >= best_score and len(best_parameters) <= max_size:
+            break
+        best_score, best_parameters = score, conb
+    return best_parameters, best_score, model_info
+
+
+# 特徴量の組み合わせの探索方法
+SEARCH_STRATEGIES = {
+    'forward': forward_selection,
+    'backward': backward_elimination,
+    'beam': beam_search,
+}
+
+
+def loocv(const_parameters, server_parameters, data_path, lgb_params=None, shap_values=False):
     """
     Leave-One-Out交差検証を実行し、各サーバーについてモデルの評価結果を取得する。
     
@@ -115,35 +743,323 @@ def loocv(const_parameters, server_parameters, data_path):
         const_parameters (list): 定数特徴量
         server_parameters (list): サーバーに関する特徴量
         data_path (str): データのパス
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        shap_values (bool): 評価結果にSHAP値の重要度を含めるかどうか
 
     Returns:
         list: サーバーごとのモデル評価結果
     """
+    return [
+        evaluate_fold(const_parameters,
+                      server_parameters,
+                      server,
+                      data_path,
+                      lgb_params,
+                      shap_values=shap_values) for server in SERVER_LIST
+    ]
+
+
+def race_loocv(const_parameters,
+               server_parameters,
+               data_path,
+               threshold,
+               lgb_params=None,
+               candidate_parameters=None,
+               known=None,
+               shap_values=False,
+               on_fold=None,
+               servers=None):
+    """
+    serversの順にfoldを評価し、平均MAPE test (%) の下側信頼限界が閾値を超えた時点で打ち切る。
+    on_foldを指定した場合は、foldを評価するたびに呼び出す (結果ストアへの逐次保存など)。
+
+    Args:
+        const_parameters (list): 定数特徴量
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        threshold (float or None): 平均MAPE test (%) の閾値 (Noneの場合は打ち切らない)
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        known (dict or None): 評価済みのfold (サーバー名 -> 評価結果)
+        shap_values (bool): 評価結果にSHAP値の重要度を含めるかどうか
+        on_fold (callable or None): 評価したfoldごとに呼ばれる関数 (server, result)。
+            knownのfoldでは呼ばない
+        servers (list or None): Leave-one-outで除外するサーバー名のリスト (Noneの場合はSERVER_LIST)
+
+    Returns:
+        tuple: (model_info, truncated)
+            model_info: 評価したfoldのモデル評価結果
+            truncated: 途中で打ち切った場合True
+    """
+    servers = SERVER_LIST if servers is None else servers
+    known = known or {}
     model_info = []
-    for server in SERVER_LIST:
-        print(f"parameters : {server_parameters}, Leave out server: {server}")
-        train_df, test_df = format_data_loocv(server, data_path)
-        parameters = const_parameters + server_parameters
-        #lightGBM
-        #訓練データが8:2でtrain:valに分割される
-        lgb_model, loss, train_df, val_df = lgb_reg.train_lgb_model(train_df, target, parameters)
-        mape_train = lgb_reg.predict_and_evaluate(lgb_model, train_df, target, parameters)
-        mape_val = lgb_reg.predict_and_evaluate(lgb_model, val_df, target, parameters)
-        mape_test = lgb_reg.predict_and_evaluate(lgb_model, test_df, target, parameters)
-        lgb_result = {
-            'ML': 'lgb',
-            'loss': loss,
-            'Parameter Num': len(parameters),
-            'Const Parameter': const_parameters,
-            'Variable Parameter Num': len(server_parameters),
-            'Variable Parameter': server_parameters,
-            'MAPE train (%)': mape_train,
-            'MAPE val (%)': mape_val,
-            'MAPE test (%)': mape_test,
-            'Leave One': server
-        }
-        model_info.append(lgb_result)
-    return model_info
+    for server in servers:
+        result = known.get(server)
+        if result is None:
+            result = evaluate_fold(const_parameters, server_parameters, server, data_path,
+                                   lgb_params, candidate_parameters, shap_values)
+            if on_fold is not None:
+                on_fold(server, result)
+        model_info.append(result)
+
+        n = len(model_info)
+        if threshold is not None and RACE_MIN_FOLDS <= n < len(servers):
+            mapes = [r['MAPE test (%)'] for r in model_info]
+            if mape_lower_bound(mapes, len(servers)) > threshold:
+                print(f"parameters : {server_parameters}, truncated after {n} folds")
+                return model_info, True
+    return model_info, False
+
+
+def mape_lower_bound(mapes, n_folds, z=None):
+    """
+    評価済みfoldのMAPEから、全foldの平均MAPEの下側信頼限界を計算する。
+    foldは有限個なので有限母集団修正を掛ける。
+
+    Args:
+        mapes (list): 評価済みfoldのMAPE test (%)
+        n_folds (int): 全fold数
+        z (float or None): 信頼係数 (Noneの場合はRACE_Z)
+
+    Returns:
+        float: 平均MAPE test (%) の下側信頼限界
+    """
+    z = RACE_Z if z is None else z
+    n = len(mapes)
+    if n < 2:
+        return -float('inf')
+    fpc = np.sqrt((n_folds - n) / (n_folds - 1))
+    return np.mean(mapes) - z * np.std(mapes, ddof=1) / np.sqrt(n) * fpc
+
+
+@tracing.traced('evaluate_fold')
+def evaluate_fold(const_parameters,
+                  server_parameters,
+                  server,
+                  data_path,
+                  lgb_params=None,
+                  candidate_parameters=None,
+                  shap_values=False,
+                  init_key=None):
+    """
+    1つのサーバーを除外したfoldでモデルを学習し、評価結果を取得する。
+
+    Args:
+        const_parameters (list): 定数特徴量
+        server_parameters (list): サーバーに関する特徴量
+        server (str): Leave-one-outで除外するサーバー名
+        data_path (str): データのパス
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        candidate_parameters (list or None): 指定した場合、この全候補特徴量でビン分割した
+            foldのDatasetを使い回し、使わない特徴量をマスクして学習する
+        shap_values (bool): Trueの場合、学習したモデルでテストデータのSHAP値を計算し、
+            server_parametersの重要度を 'SHAP Value' として評価結果に含める
+        init_key (str or None): 指定した場合、モデルレジストリに保存したこのキーのモデルから
+            学習を続ける (サーバーを追加する前のfoldのモデルなど)。モデルがない場合、
+            入力列数が異なる場合、candidate_parametersを指定した場合は最初から学習する。
+            学習を続けたモデルはinit_keyを含めたキーで保存し、最初から学習した結果と区別する
+
+    Returns:
+        dict: モデル評価結果
+    """
+    print(f"parameters : {server_parameters}, Leave out server: {server}")
+    # 一度だけエンコードした特徴量行列から、foldの行を切り出して使う
+    with tracing.span('load_dataset'):
+        dataset = load_dataset(data_path)
+        matrix = dataset.feature_matrix(target)
+    parameters = const_parameters + server_parameters
+
+    # 同じ学習のモデルが保存されていれば、再学習せずに使う
+    registry = get_model_registry()
+    if candidate_parameters is not None:
+        init_key = None
+    if registry is not None:
+        with tracing.span('registry.get'):
+            key = fold_model_key(dataset, parameters, server, lgb_params, candidate_parameters,
+                                 init_key)
+            # SHAP値を計算しない場合は評価指標だけを使い、モデルは読み込まない
+            cached = registry.get(key, load_model=shap_values)
+        if cached is not None:
+            lgb_model, metrics = cached
+            lgb_result = fold_result(const_parameters, server_parameters, server, metrics)
+            if shap_values:
+                lgb_result['SHAP Value'] = lgb_reg.shap_importance(lgb_model, matrix,
+                                                                   dataset.test_indices[server],
+                                                                   metrics['Model Parameter'],
+                                                                   server_parameters)
+            return lgb_result
+
+    #lightGBM
+    #訓練データが8:2でtrain:valに分割される
+    if candidate_parameters is None:
+        init = get_init_model(registry, init_key, len(matrix.column_indices(parameters)),
+                              dataset.train_indices[server])
+        init_model, init_rows = init if init is not None else (None, None)
+        if init is None and init_key is not None:
+            # 学習を続けられない場合は最初から学習するため、最初から学習した場合のキーで保存する
+            key = fold_model_key(dataset, parameters, server, lgb_params)
+        # 前のモデルの学習に使った行は、前のモデルと同じtrain/valの分割にする
+        lgb_model, loss, train_rows, val_rows = lgb_reg.train_lgb_rows(
+            matrix, dataset.train_indices[server], parameters, lgb_params, init_model, init_rows)
+        model_parameters = parameters
+    else:
+        fold = get_binned_fold(dataset, server, candidate_parameters)
+        lgb_model, loss, train_rows, val_rows = lgb_reg.train_lgb_binned(
+            fold, matrix, parameters, lgb_params)
+        # マスクして学習したモデルの入力は全候補特徴量
+        model_parameters = fold.parameters
+    # 学習・検証・テストデータをまとめて一度で予測する
+    split_metrics = lgb_reg.predict_and_evaluate_splits(lgb_model, matrix, {
+        'train': train_rows,
+        'val': val_rows,
+        'test': dataset.test_indices[server],
+    }, model_parameters)
+    metrics = {
+        'loss': loss,
+        'Model Parameter': model_parameters,
+        'MAPE train (%)': round(split_metrics['train']['MAPE'] * 100, 5),
+        'MAPE val (%)': round(split_metrics['val']['MAPE'] * 100, 5),
+        'MAPE test (%)': round(split_metrics['test']['MAPE'] * 100, 5),
+        'RMSE test': round(split_metrics['test']['RMSE'], 5),
+        'MAE test': round(split_metrics['test']['MAE'], 5),
+        'Max APE test (%)': round(split_metrics['test']['Max APE'] * 100, 5),
+    }
+    if registry is not None:
+        # 予測時に同じ列構成でエンコードできるように、カテゴリ情報も保存する。
+        # 行数は、行を追記したデータでこのモデルから学習を続けるときに同じ分割を再現するために使う
+        with tracing.span('registry.put'):
+            registry.put(key, lgb_model, {
+                **metrics,
+                'Variable Parameter': server_parameters,
+                'Leave One': server,
+                'Feature Categories': matrix.categories,
+                'Data Rows': len(dataset.df),
+                'Train Rows': len(dataset.train_indices[server]),
+            })
+
+    lgb_result = fold_result(const_parameters, server_parameters, server, metrics)
+    if shap_values:
+        lgb_result['SHAP Value'] = lgb_reg.shap_importance(lgb_model, matrix,
+                                                           dataset.test_indices[server],
+                                                           model_parameters, server_parameters)
+    return lgb_result
+
+
+def fold_result(const_parameters, server_parameters, server, metrics):
+    """
+    foldの評価指標からモデル評価結果のレコードを作る。
+
+    Args:
+        const_parameters (list): 定数特徴量
+        server_parameters (list): サーバーに関する特徴量
+        server (str): Leave-one-outで除外するサーバー名
+        metrics (dict): loss, MAPE train/val/test (%) を含む評価指標
+            (RMSE test, MAE test, Max APE test (%) があれば含める)
+
+    Returns:
+        dict: モデル評価結果
+    """
+    result = {
+        'ML': 'lgb',
+        'loss': metrics['loss'],
+        'Parameter Num': len(const_parameters) + len(server_parameters),
+        'Const Parameter': const_parameters,
+        'Variable Parameter Num': len(server_parameters),
+        'Variable Parameter': server_parameters,
+        'MAPE train (%)': metrics['MAPE train (%)'],
+        'MAPE val (%)': metrics['MAPE val (%)'],
+        'MAPE test (%)': metrics['MAPE test (%)'],
+    }
+    # 以前に保存したモデルの評価指標には含まれない
+    for name in ('RMSE test', 'MAE test', 'Max APE test (%)'):
+        if name in metrics:
+            result[name] = metrics[name]
+    result['Leave One'] = server
+    return result
+
+
+def get_init_model(registry, init_key, n_features, rows):
+    """
+    学習を続けるモデルをモデルレジストリから読み込む。
+    行を追記したデータでは、モデルの学習に使った行は先頭の 'Data Rows' 行に含まれる。
+    その行数がモデルの 'Train Rows' と一致しない場合は、同じtrain/valの分割を再現できないため使わない。
+
+    Args:
+        registry (ModelRegistry or None): モデルレジストリ
+        init_key (str or None): モデルのキー
+        n_features (int): 学習する行列の列数
+        rows (np.ndarray): 学習を続けるfoldの学習に使う行位置の配列
+
+    Returns:
+        tuple or None: (モデル, モデルの学習に使った行位置の配列)。使えない場合はNone
+    """
+    if registry is None or init_key is None:
+        return None
+    cached = registry.get(init_key)
+    if cached is None:
+        return None
+    model, metrics = cached
+    if model.num_feature() != n_features or 'Data Rows' not in metrics:
+        return None
+    init_rows = rows[rows < metrics['Data Rows']]
+    if len(init_rows) != metrics['Train Rows']:
+        return None
+    return model, init_rows
+
+
+def get_model_registry():
+    """
+    MODEL_REGISTRY_DIRのモデルレジストリを返す (プロセスごとに一度だけ開く)。
+
+    Returns:
+        ModelRegistry or None: モデルレジストリ。MODEL_REGISTRY_DIRがNoneの場合はNone
+    """
+    if MODEL_REGISTRY_DIR is None:
+        return None
+    registry_dir = os.path.join(output_dir, MODEL_REGISTRY_DIR)
+    if registry_dir not in _model_registries:
+        max_bytes = None
+        if MODEL_REGISTRY_MAX_MB is not None:
+            max_bytes = int(MODEL_REGISTRY_MAX_MB * 1024**2)
+        _model_registries[registry_dir] = ModelRegistry(registry_dir, max_bytes)
+    return _model_registries[registry_dir]
+
+
+def get_result_store(db_path):
+    """
+    ワーカープロセスでfoldの評価結果を保存する結果ストアを返す (プロセスごとに一度だけ開く)。
+
+    Args:
+        db_path (str): SQLiteファイルのパス
+
+    Returns:
+        ResultStore: 結果ストア
+    """
+    if db_path not in _result_stores:
+        _result_stores[db_path] = ResultStore(db_path)
+    return _result_stores[db_path]
+
+
+def get_binned_fold(dataset, server, candidate_parameters):
+    """
+    ビン分割済みのfoldをキャッシュから取得する。未構築の場合は構築する。
+
+    Args:
+        dataset (LoocvDataset): データセット
+        server (str): Leave-one-outで除外するサーバー名
+        candidate_parameters (list): 全候補特徴量のリスト
+
+    Returns:
+        lgb_reg.BinnedFold: ビン分割済みのfold
+    """
+    key = (dataset.file_hash, server, tuple(candidate_parameters))
+    if key not in _binned_folds:
+        with tracing.span('BinnedFold'):
+            _binned_folds[key] = lgb_reg.BinnedFold(dataset.feature_matrix(target),
+                                                    dataset.train_indices[server],
+                                                    candidate_parameters)
+    return _binned_folds[key]
 
 
 def output_results_to_csv(results, output_csv):
@@ -158,8 +1074,8 @@ def output_results_to_csv(results, output_csv):
     output_path = os.path.join(output_dir, output_csv)
 
     if results:
-        df = pd.DataFrame(results)
-        df.to_csv(output_path, index=True)
+        df = add_parameter_columns(pd.DataFrame(results))
+        save_table(df, output_path, index=True)
         print(f"Model information has been written to {output_csv}")
     else:
         print("No models found.")
@@ -2,7 +2,7 @@ import os
 
 import pandas as pd
 
-from get_server_spec import get_server_spec
+from table_store import append_table, load_table, save_table
 
 # データディレクトリとファイルパスの設定
 data_dir = './data'
@@ -23,15 +23,12 @@ def create_data_benchmark_csv():
     testbench_df = pd.read_csv(testbench_csv, index_col=0)
     results_df = pd.read_csv(results_csv)
 
-    # サーバーごとにベンチマーク情報を統合
-    for server in results_df['Server Info'].unique():
-        benchmark = testbench_df.loc[server]
-        for name in benchmark.index:
-            results_df.loc[results_df['Server Info'] == server, name] = benchmark[name]
+    # サーバー名をキーにベンチマーク情報を統合
+    results_df = merge_server_table(results_df, testbench_df)
 
     # 結果をCSVに書き出し
     output_path = os.path.join(data_dir, 'data_benchmark.csv')
-    results_df.to_csv(output_path, mode='w', index=False)
+    save_table(results_df, output_path, index=False)
 
 
 def create_data_server_spec_csv():
@@ -39,15 +36,89 @@ def create_data_server_spec_csv():
     results_csv = os.path.join(data_dir, results_file)
     results_df = pd.read_csv(results_csv)
 
-    # サーバーごとにスペック情報を追加
-    for server in results_df['Server Info'].unique():
-        spec = get_server_spec(server)
-        for key, value in spec.items():
-            results_df.loc[results_df['Server Info'] == server, key] = value
+    # サーバー名をキーにスペック情報を統合
+    servers = results_df['Server Info'].unique()
+    spec_df = pd.DataFrame([get_server_spec(server) for server in servers], index=servers)
+    results_df = merge_server_table(results_df, spec_df)
 
     # 結果をCSVに書き出し
     output_path = os.path.join(data_dir, 'data_server_spec.csv')
-    results_df.to_csv(output_path, mode='w', index=False)
+    save_table(results_df, output_path, index=False)
+
+
+def update_data_benchmark_csv():
+    """
+    resultsに追加されたサーバーの行のみをベンチマーク情報と統合し、data_benchmark.csvに追記する。
+
+    Returns:
+        list: 追記したサーバー名のリスト
+    """
+    testbench_df = pd.read_csv(os.path.join(data_dir, testbench_file), index_col=0)
+    results_df = pd.read_csv(os.path.join(data_dir, results_file))
+    return append_new_servers(results_df, testbench_df, os.path.join(data_dir,
+                                                                     'data_benchmark.csv'))
+
+
+def update_data_server_spec_csv():
+    """
+    resultsに追加されたサーバーの行のみをスペック情報と統合し、data_server_spec.csvに追記する。
+
+    Returns:
+        list: 追記したサーバー名のリスト
+    """
+    results_df = pd.read_csv(os.path.join(data_dir, results_file))
+    servers = results_df['Server Info'].unique()
+    output_path = os.path.join(data_dir, 'data_server_spec.csv')
+    existing = set(load_table(output_path)['Server Info'])
+    new_servers = [server for server in servers if server not in existing]
+    spec_df = pd.DataFrame([get_server_spec(server) for server in new_servers],
+                           index=new_servers,
+                           dtype='float64')
+    return append_new_servers(results_df, spec_df, output_path)
+
+
+def append_new_servers(results_df, server_df, output_path):
+    """
+    作成済みの学習データに含まれていないサーバーの推論結果のみをサーバー情報と結合し、追記する。
+    既存の行は読み直さずにそのまま残すため、resultsの末尾にサーバーを追加した場合は
+    全体を作り直した場合と同じファイルになる。
+
+    Args:
+        results_df (pd.DataFrame): 推論結果
+        server_df (pd.DataFrame): サーバー名をインデックスとするサーバー情報
+        output_path (str): 作成済みの学習データのパス
+
+    Returns:
+        list: 追記したサーバー名のリスト
+    """
+    existing_df = load_table(output_path)
+    new_rows = results_df[~results_df['Server Info'].isin(set(existing_df['Server Info']))]
+    if new_rows.empty:
+        return []
+    new_rows = merge_server_table(new_rows, server_df)
+    if list(new_rows.columns) != list(existing_df.columns):
+        raise ValueError(f"{output_path} と追加する行の列が一致しません。作り直してください。")
+    append_table(new_rows, output_path, index=False)
+    return list(new_rows['Server Info'].unique())
+
+
+def merge_server_table(results_df, server_df):
+    """
+    推論結果にサーバーごとの情報 (ベンチマーク、スペック) を 'Server Info' をキーに結合する。
+
+    Args:
+        results_df (pd.DataFrame): 推論結果
+        server_df (pd.DataFrame): サーバー名をインデックスとするサーバー情報
+
+    Returns:
+        pd.DataFrame: サーバー情報の列を末尾に追加した推論結果 (行の順序は変わらない)
+    """
+    missing = set(results_df['Server Info'].unique()) - set(server_df.index)
+    if missing:
+        raise KeyError(f"サーバー情報が見つかりません: {sorted(missing)}")
+
+    # 統合後の列は欠損値を含み得る列と同じくfloat64で出力する
+    return results_df.join(server_df.astype('float64'), on='Server Info')
 
 
 # サーバー情報に基づき、CPUとGPUのスペックを取得する関数
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+
+class FeatureMatrix:
+    """
+    データセット全体を一度だけエンコードした特徴量行列。
+    数値列はそのまま、カテゴリ列はpd.get_dummies(drop_first=True)と同じ規則でダミー列に変換し、
+    列構成を固定したfloat32の連続配列として保持する。
+    特徴量の組み合わせ・foldごとの行列は、この配列の行・列を切り出して作る。
+
+    Attributes:
+        values (np.ndarray): 特徴量行列 (行数 × 列数, float32, C連続)
+        target (np.ndarray or None): 目的変数 (float64)
+        columns (list): 行列の列名
+        categories (dict): カテゴリ列名 -> カテゴリ値のリスト (先頭が除外されたカテゴリ)
+        parameter_columns (dict): 特徴量名 -> 行列の列位置のリスト
+    """
+
+    def __init__(self, df, parameters, target=None, categories=None):
+        """
+        Args:
+            df (pd.DataFrame): エンコードするデータ
+            parameters (list): エンコードする特徴量のリスト
+            target (str or None): 目的変数のカラム名
+            categories (dict or None): カテゴリ列のカテゴリ値。指定した場合はこの列構成でエンコードする
+        """
+        self.categories = dict(categories or {})
+        self.columns = []
+        self.parameter_columns = {}
+        blocks = []
+        for parameter in parameters:
+            series = df[parameter]
+            if parameter not in self.categories and (is_numeric_dtype(series) or
+                                                     is_bool_dtype(series)):
+                block = series.to_numpy(dtype=np.float32)[:, None]
+                names = [parameter]
+            else:
+                if parameter not in self.categories:
+                    self.categories[parameter] = sorted(series.dropna().unique().tolist())
+                codes = pd.Categorical(series, categories=self.categories[parameter]).codes
+                dummy_categories = self.categories[parameter][1:]
+                block = (codes[:, None] == np.arange(1, len(dummy_categories) + 1)).astype(
+                    np.float32)
+                names = [f"{parameter}_{category}" for category in dummy_categories]
+            start = len(self.columns)
+            self.parameter_columns[parameter] = list(range(start, start + len(names)))
+            self.columns.extend(names)
+            blocks.append(block)
+
+        if blocks:
+            self.values = np.ascontiguousarray(np.hstack(blocks), dtype=np.float32)
+        else:
+            self.values = np.empty((len(df), 0), dtype=np.float32)
+        self.target = df[target].to_numpy(dtype=np.float64) if target is not None else None
+
+    def column_indices(self, parameters):
+        """
+        特徴量の組み合わせに対応する列位置を返す。
+        pd.get_dummiesと同じく、数値列を先に並べ、ダミー列を後ろに並べる。
+
+        Args:
+            parameters (list): 使用する特徴量のリスト
+
+        Returns:
+            np.ndarray: 列位置の配列
+        """
+        numeric = [p for p in parameters if p not in self.categories]
+        categorical = [p for p in parameters if p in self.categories]
+        return np.array([i for p in numeric + categorical for i in self.parameter_columns[p]],
+                        dtype=np.intp)
+
+    def take(self, rows, parameters):
+        """
+        指定した行・特徴量の部分行列を切り出す。
+
+        Args:
+            rows (np.ndarray): 行位置の配列
+            parameters (list): 使用する特徴量のリスト
+
+        Returns:
+            np.ndarray: 部分行列 (float32, C連続)
+        """
+        return self.values[np.ix_(rows, self.column_indices(parameters))]
+
+    def column_names(self, parameters):
+        """
+        特徴量の組み合わせに対応する列名を返す。
+
+        Args:
+            parameters (list): 使用する特徴量のリスト
+
+        Returns:
+            list: 列名のリスト
+        """
+        return [self.columns[i] for i in self.column_indices(parameters)]
@@ -1,36 +1,174 @@
+import hashlib
 import os
 
+import numpy as np
 import pandas as pd
 
+from feature_matrix import FeatureMatrix
+from table_store import load_table, resolve_path
+
 data_dir = './data'
 
+# 読み込み済みデータセットのキャッシュ (絶対パス -> LoocvDataset)
+_dataset_cache = {}
+
+
+class LoocvDataset:
+    """
+    LOOCV用のデータセットを一度だけ読み込み、サーバーごとの行インデックスを保持するクラス。
+
+    Attributes:
+        data_path (str): CSVデータファイルのパス
+        df (pd.DataFrame): 読み込んだデータ
+        server_list (np.ndarray): ユニークなサーバー名 (出現順)
+        test_indices (dict): サーバー名 -> テスト行の位置インデックス
+        train_indices (dict): サーバー名 -> 訓練行の位置インデックス
+        source_path (str): 実際に読み込んだファイルのパス (CSVまたは列指向形式)
+        mtime_ns (int): 読み込み時のファイル更新時刻
+        file_hash (str): 読み込み時のファイル内容のハッシュ値
+    """
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.source_path = resolve_path(data_path)
+        self.mtime_ns = os.stat(self.source_path).st_mtime_ns
+        self.file_hash = file_digest(self.source_path)
+
+        # CSVファイル (列指向形式があればそちら) を読み込む
+        self.df = load_table(data_path, index_col=0)
+
+        # サーバーごとの行位置を事前計算
+        codes, self.server_list = pd.factorize(self.df['Server Info'])
+        self.test_indices = {}
+        self.train_indices = {}
+        for i, server in enumerate(self.server_list):
+            self.test_indices[server] = np.flatnonzero(codes == i)
+            self.train_indices[server] = np.flatnonzero(codes != i)
+
+        # 列の組み合わせ -> データバージョンのキャッシュ
+        self._columns_versions = {}
+        # 目的変数 -> 特徴量行列のキャッシュ
+        self._feature_matrices = {}
+
+    def split(self, target):
+        """
+        Leave-one-outで除外するサーバーを指定し、訓練データとテストデータに分割する。
+
+        Args:
+            target (str): Leave-one-outで除外するサーバー名
+
+        Returns:
+            tuple: (train_df, test_df)
+        """
+        return self.df.take(self.train_indices[target]), self.df.take(self.test_indices[target])
+
+    def feature_matrix(self, target):
+        """
+        目的変数とサーバー名以外の全列を一度だけエンコードした特徴量行列を返す。
+
+        Args:
+            target (str): 目的変数のカラム名
+
+        Returns:
+            FeatureMatrix: 特徴量行列
+        """
+        if target not in self._feature_matrices:
+            parameters = [c for c in self.df.columns if c not in (target, 'Server Info')]
+            self._feature_matrices[target] = FeatureMatrix(self.df, parameters, target)
+        return self._feature_matrices[target]
+
+    def columns_version(self, columns):
+        """
+        指定した列の内容から計算したデータバージョンを返す。
+        使用しない列が追加・変更されてもバージョンは変わらない。
+
+        Args:
+            columns (list): 対象の列名のリスト
+
+        Returns:
+            str: SHA-1のハッシュ値
+        """
+        key = tuple(columns)
+        if key not in self._columns_versions:
+            sha1 = hashlib.sha1(repr(key).encode('utf-8'))
+            sha1.update(pd.util.hash_pandas_object(self.df[list(key)], index=True).values.tobytes())
+            self._columns_versions[key] = sha1.hexdigest()
+        return self._columns_versions[key]
+
+    def is_stale(self):
+        """
+        ファイルが読み込み後に変更されたかを判定する。
+        更新時刻が変わった場合のみハッシュ値を比較し、内容が同じなら更新時刻だけを更新する。
+
+        Returns:
+            bool: 再読み込みが必要な場合True
+        """
+        if resolve_path(self.data_path) != self.source_path:
+            return True
+        mtime_ns = os.stat(self.source_path).st_mtime_ns
+        if mtime_ns == self.mtime_ns:
+            return False
+        if file_digest(self.source_path) != self.file_hash:
+            return True
+        self.mtime_ns = mtime_ns
+        return False
+
+
+def file_digest(data_path):
+    """
+    ファイル内容のSHA-1ハッシュ値を計算する。
+
+    Args:
+        data_path (str): ファイルのパス
+
+    Returns:
+        str: 16進数のハッシュ値
+    """
+    sha1 = hashlib.sha1()
+    with open(data_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def load_dataset(data_path):
+    """
+    データセットをキャッシュから取得する。未読み込みまたはファイルが変更されている場合は読み込み直す。
+
+    Args:
+        data_path (str): CSVデータファイルのパス
+
+    Returns:
+        LoocvDataset: データセット
+    """
+    key = os.path.abspath(data_path)
+    dataset = _dataset_cache.get(key)
+    if dataset is None or dataset.is_stale():
+        dataset = LoocvDataset(data_path)
+        _dataset_cache[key] = dataset
+    return dataset
+
 
 def format_data_loocv(target, data_path):
     """
     Leave-One-Out Cross-Validation (LOOCV) のためのデータを整形する関数。
-    
+
     Parameters:
         target (str): Leave-one-outで除外するサーバー名
         data_path (str): CSVデータファイルのパス
-    
+
     Returns:
-        tuple: (train_df, test_df) 
+        tuple: (train_df, test_df)
             train_df: 除外されたサーバー以外のデータ
             test_df: 除外されたサーバーのデータ
     """
-    # CSVファイルを読み込む
-    df = pd.read_csv(data_path, index_col=0)
-
-    # ユニークなサーバー名を取得
-    server_list = df['Server Info'].unique()
+    # キャッシュ済みのデータセットを取得
+    dataset = load_dataset(data_path)
 
     # targetサーバーが存在しない場合のエラーチェック
-    if target not in server_list:
+    if target not in dataset.test_indices:
         print(f"{target} is not in serverlist")
         return -1
 
     # サーバー名でデータを分割
-    train_df = df.query('`Server Info` != @target')  # target以外のサーバー
-    test_df = df.query('`Server Info` == @target')  # targetサーバー
-
-    return train_df, test_df
+    return dataset.split(target)
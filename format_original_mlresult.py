@@ -1,8 +1,15 @@
-import ast  # 文字列をリストに変換するために使用
 import os
+import re
 
+import numpy as np
 import pandas as pd
 
+from parameter_mask import MASK_COLUMN, add_parameter_columns, masks_cost
+from table_store import TableWriter, iter_table, load_table
+
+# 結果ファイルをチャンクに分けて処理する場合の1チャンクの行数 (Noneの場合は一度に読み込む)
+CHUNK_SIZE = None
+
 # 置き換えリスト
 rename_list = {
     "transfer_all": "T_SLT",
@@ -16,6 +23,16 @@ rename_list = {
     "matrix_add": "T_SAO"
 }
 
+# 特徴量名を置き換える列
+parameter_columns = ['Const Parameter', 'Variable Parameter']
+
+# Leave Oneのサーバー名の置き換えリスト
+server_rename_list = {
+    'corei5': 'Core i5',
+    'corei7': 'Core i7',
+    'corei9': 'Core i9'
+}
+
 # benchmarkのTime Cost(s)
 # 実行ループ回数
 M = 100
@@ -32,6 +49,47 @@ weights = {
 }
 
 
+# 置き換え元を長い順に並べた正規表現 ("matrix_convloop" を "matrix_conv" より先に照合する)
+def compile_rename_pattern(mapping):
+    return re.compile('|'.join(re.escape(old) for old in sorted(mapping, key=len, reverse=True)))
+
+
+rename_pattern = compile_rename_pattern(rename_list)
+server_rename_pattern = compile_rename_pattern(server_rename_list)
+
+
+# 列のユニークな値だけを1回の正規表現で置き換え、カテゴリのコードで全行に展開する関数
+# リストの値 (load_tableで読み込んだリスト列) は要素ごとに置き換える
+def relabel_column(series, pattern, mapping):
+    codes, uniques = pd.factorize(series.map(lambda v: tuple(v) if isinstance(v, list) else v))
+    renamed = np.empty(len(uniques), dtype=object)
+    renamed[:] = [relabel_value(value, pattern, mapping) for value in uniques]
+    # 欠損値 (コード-1) はそのまま残す
+    values = series.to_numpy(dtype=object, copy=True)
+    valid = codes >= 0
+    values[valid] = renamed[codes[valid]]
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+# 文字列、またはリストの各要素を置き換える関数 (タプルにした値はリストに戻す)
+def relabel_value(value, pattern, mapping):
+    if isinstance(value, str):
+        return pattern.sub(lambda m: mapping[m.group(0)], value)
+    if isinstance(value, tuple):
+        return [relabel_value(v, pattern, mapping) for v in value]
+    return value
+
+
+# 特徴量名とサーバー名を置き換える関数
+def relabel_columns(df):
+    df = df.copy()
+    for column in parameter_columns:
+        if column in df.columns:
+            df[column] = relabel_column(df[column], rename_pattern, rename_list)
+    df["Leave One"] = relabel_column(df["Leave One"], server_rename_pattern, server_rename_list)
+    return df
+
+
 # メイン処理をまとめる関数
 def main():
     data_dir = './ml_results'
@@ -39,41 +97,43 @@ def main():
     process_csv(data_dir,
                 'original_benchmark_parameter_loocv.csv',
                 'format_benchmark_parameter_loocv.csv',
-                calculate_time_cost=True)
+                calculate_time_cost=True,
+                chunksize=CHUNK_SIZE)
     process_csv(data_dir,
                 'original_spec_parameter_loocv.csv',
                 'format_spec_parameter_loocv.csv',
-                calculate_time_cost=False)
+                calculate_time_cost=False,
+                chunksize=CHUNK_SIZE)
 
 
 # CSVを読み込み、必要な操作を実行する関数
-def process_csv(data_dir, data_file, output_file, calculate_time_cost=True):
+# chunksizeを指定した場合は、chunksize行ずつ読み込んで変換し、出力に追記する (メモリ使用量が一定になる)
+def process_csv(data_dir, data_file, output_file, calculate_time_cost=True, chunksize=None):
     data_path = os.path.join(data_dir, data_file)
-    df = pd.read_csv(data_path, index_col=0)
+    output_path = os.path.join(data_dir, output_file)
+
+    if chunksize is None:
+        chunks = [load_table(data_path, index_col=0)]
+    else:
+        chunks = iter_table(data_path, chunksize, index_col=0)
+    with TableWriter(output_path, index=True) as writer:
+        for df in chunks:
+            writer.write(format_results(df, calculate_time_cost))
+    print(f"置き換え後のCSVを '{output_path}' に保存しました。")
 
-    # 文字列を置き換える
-    for old_string, new_string in rename_list.items():
-        df = df.replace(old_string, new_string, regex=True)
+
+# 置き換え・Time Costの計算・列の並び替えを行う関数 (行ごとに独立しているのでチャンク単位で実行できる)
+def format_results(df, calculate_time_cost=True):
+    # 特徴量名とサーバー名を置き換える
+    df = relabel_columns(df)
+
+    # 特徴量の組み合わせのビットマスクと正規形を追加
+    df = add_parameter_columns(df)
 
     # Time Cost (s)を計算して新しい列を追加（必要な場合）
     if calculate_time_cost:
-
-        # コスト計算関数
-        def calculate_time_cost(inputs):
-            # 文字列をリストに変換
-            input_list = ast.literal_eval(inputs)
-            cost = sum(weights.get(parameter, 0) for parameter in input_list)
-            # 小数点以下5桁に丸める
-            return round(cost, 5)
-
-        df["Time Cost (s)"] = df['Variable Parameter'].apply(calculate_time_cost)
-        # "Leave One" 列の値を修正（正規表現を使用）
-    df["Leave One"] = df["Leave One"].replace(
-        {
-            r'corei5': 'Core i5',
-            r'corei7': 'Core i7',
-            r'corei9': 'Core i9'
-        }, regex=True)
+        # ビットマスクから組み合わせごとのコストを計算し、小数点以下5桁に丸める
+        df["Time Cost (s)"] = masks_cost(df[MASK_COLUMN].to_numpy(), weights).round(5)
 
     # 列の並び替え
     columns = df.columns.tolist()  # 現在の列順を取得
@@ -84,12 +144,7 @@ def process_csv(data_dir, data_file, output_file, calculate_time_cost=True):
     columns.remove("Leave One")  # 一旦 "Leave One" を除去
     columns.insert(columns.index("MAPE train (%)"),
                    "Leave One")  # "MAPE train(%)" の直前に "Leave One" を挿入
-    df = df[columns]  # 列の順序を再設定
-
-    # 結果を保存
-    output_path = os.path.join(data_dir, output_file)
-    df.to_csv(output_path)
-    print(f"置き換え後のCSVを '{output_path}' に保存しました。")
+    return df[columns]  # 列の順序を再設定
 
 
 # スクリプトが直接実行された場合に実行される処理
@@ -0,0 +1,321 @@
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import const_model
+from format_mldata import load_dataset
+from result_store import ResultStore, trial_key
+from table_store import save_table
+
+# 探索する学習パラメータの範囲 (パラメータ名 -> (分布, 下限, 上限))
+#   'log': 対数一様分布, 'int': 整数の一様分布, 'float': 一様分布
+# ビン分割済みのDatasetを使い回すため、max_binなどDatasetの構築に関わるパラメータは含めない
+SEARCH_SPACE = {
+    'learning_rate': ('log', 0.01, 0.3),
+    'num_leaves': ('int', 7, 127),
+    'min_data_in_leaf': ('int', 5, 100),
+    'feature_fraction': ('float', 0.5, 1.0),
+    'lambda_l2': ('log', 1e-3, 10.0),
+}
+
+# 探索方法 ('random', 'halving')
+STRATEGY = 'halving'
+# 試行数 (halvingの場合は最初の段の試行数)。最初の試行はLightGBMの既定値
+N_TRIALS = 27
+# successive halvingで次の段に残す割合の逆数
+HALVING_ETA = 3
+# successive halvingの最初の段で評価するfold数
+HALVING_MIN_FOLDS = 3
+# 乱数シード
+SEED = 0
+
+# 学習パラメータを選ぶときに使うサーバーに関する特徴量
+TUNE_PARAMETERS = const_model.benchmark_parameters
+
+# 全試行の評価結果の出力先 (const_model.output_dir内)
+trials_csv = 'hyperparameter_trials.csv'
+
+
+def main():
+    """
+    メイン処理: leave-one-server-outの平均MAPE test (%) で学習パラメータを探索し、
+    最良のパラメータをconst_model.TUNED_PARAMS_FILEに保存する。
+    """
+    parser = argparse.ArgumentParser(description='LightGBMの学習パラメータを探索する')
+    parser.add_argument('--strategy', choices=['random', 'halving'], default=STRATEGY)
+    parser.add_argument('--trials', type=int, default=N_TRIALS)
+    parser.add_argument('--parameters', nargs='+', default=TUNE_PARAMETERS,
+                        help='サーバーに関する特徴量')
+    parser.add_argument('--data',
+                        default=os.path.join(const_model.data_dir,
+                                             const_model.benchmark_data_file))
+    parser.add_argument('--workers', type=int, default=const_model.N_WORKERS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    os.makedirs(const_model.output_dir, exist_ok=True)
+    store = ResultStore(os.path.join(const_model.output_dir, const_model.RESULT_STORE_FILE))
+    search = random_search if args.strategy == 'random' else successive_halving
+    best, trials = search(args.parameters, args.data, n_trials=args.trials, seed=args.seed,
+                          n_workers=args.workers, num_threads=const_model.LGB_NUM_THREADS,
+                          store=store)
+    store.close()
+
+    output_path = os.path.join(const_model.output_dir, trials_csv)
+    save_table(pd.DataFrame(trials), output_path, index=False)
+    print(f"Trials have been written to {output_path}")
+    save_best_params(best, os.path.join(const_model.output_dir, const_model.TUNED_PARAMS_FILE))
+
+
+def sample_params(rng, space=None):
+    """
+    探索範囲から学習パラメータを1つ無作為に選ぶ。
+
+    Args:
+        rng (np.random.Generator): 乱数生成器
+        space (dict or None): 探索範囲 (Noneの場合はSEARCH_SPACE)
+
+    Returns:
+        dict: 学習パラメータ
+    """
+    params = {}
+    for name, (distribution, low, high) in (space or SEARCH_SPACE).items():
+        if distribution == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        elif distribution == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif distribution == 'float':
+            params[name] = float(rng.uniform(low, high))
+        else:
+            raise ValueError(f"Unknown distribution: {distribution}")
+    return params
+
+
+def sample_trials(n_trials, seed):
+    """
+    試行する学習パラメータのリストを作る。最初の試行はLightGBMの既定値 (上書きなし) とする。
+
+    Args:
+        n_trials (int): 試行数
+        seed (int): 乱数シード
+
+    Returns:
+        list: 学習パラメータのリスト
+    """
+    rng = np.random.default_rng(seed)
+    return [{}] + [sample_params(rng) for _ in range(n_trials - 1)]
+
+
+def shuffle_servers(servers, seed):
+    """
+    foldに使うサーバーの順序を乱数シードで並べ替える。
+
+    Args:
+        servers (list): サーバー名のリスト
+        seed (int): 乱数シード
+
+    Returns:
+        list: 並べ替えたサーバー名のリスト
+    """
+    rng = np.random.default_rng(seed)
+    return [servers[i] for i in rng.permutation(len(servers))]
+
+
+def evaluate_trials(trials, server_parameters, data_path, servers, n_workers=1, num_threads=None,
+                    store=None):
+    """
+    学習パラメータの試行ごとに、指定したサーバーを除外するfoldを評価する。
+    全候補特徴量のDatasetはfoldごとに一度だけビン分割し、試行間で使い回す。
+    評価済みのfoldと試行の結果はstoreに保存し、再実行時は読み飛ばす。
+
+    Args:
+        trials (list): 学習パラメータのリスト
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        servers (list): 評価するfoldの除外サーバー名のリスト
+        n_workers (int): ワーカープロセス数
+        num_threads (int or None): 1モデルあたりのLightGBMスレッド数
+        store (ResultStore or None): 評価結果の保存先
+
+    Returns:
+        list: 試行ごとの平均MAPE test (%)
+    """
+    dataset = load_dataset(data_path)
+    parameters = const_model.const_parameters + list(server_parameters)
+    candidate_parameters = parameters
+    trial_params = [dict(trial, num_threads=num_threads) if num_threads is not None else trial
+                    for trial in trials]
+    tasks = [(t, server) for t in range(len(trials)) for server in servers]
+
+    keys = None
+    results = [None] * len(tasks)
+    if store is not None:
+        keys = [
+            const_model.fold_model_key(dataset, parameters, server, trial_params[t],
+                                       candidate_parameters) for t, server in tasks
+        ]
+        done = store.get_many(keys)
+        results = [done.get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    print(f"evaluating {len(trials)} trials on {len(servers)} folds "
+          f"({len(tasks) - len(pending)} folds are already evaluated)")
+
+    def on_result(i, result):
+        results[i] = result
+        if store is not None:
+            store.put(keys[i], result)
+
+    if n_workers > 1:
+        from parallel_search import run_trials_parallel
+        run_trials_parallel([(i, list(server_parameters), tasks[i][1], trial_params[tasks[i][0]])
+                             for i in pending], data_path, n_workers, on_result,
+                            candidate_parameters)
+    else:
+        for i in pending:
+            t, server = tasks[i]
+            on_result(
+                i, const_model.evaluate_fold(const_model.const_parameters, list(server_parameters),
+                                             server, data_path, trial_params[t],
+                                             candidate_parameters))
+
+    mapes = np.array([result['MAPE test (%)'] for result in results]).reshape(len(trials), -1)
+    return mapes.mean(axis=1).tolist()
+
+
+def record_trials(trials, mapes, server_parameters, data_path, servers, strategy, rung, store):
+    """
+    試行の結果を記録用のレコードにし、storeに保存する。
+
+    Args:
+        trials (list): 学習パラメータのリスト
+        mapes (list): 試行ごとの平均MAPE test (%)
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        servers (list): 評価したfoldの除外サーバー名のリスト
+        strategy (str): 探索方法
+        rung (int): successive halvingの段 (random searchでは0)
+        store (ResultStore or None): 評価結果の保存先
+
+    Returns:
+        list: 試行のレコード
+    """
+    dataset = load_dataset(data_path)
+    parameters = const_model.const_parameters + list(server_parameters)
+    data_version = dataset.columns_version(['Server Info', const_model.target] + parameters)
+    records = []
+    for trial, mape in zip(trials, mapes):
+        record = {
+            'Strategy': strategy,
+            'Rung': rung,
+            'Params': trial,
+            'Variable Parameter': list(server_parameters),
+            'Fold Num': len(servers),
+            'average MAPE test (%)': round(mape, 5),
+        }
+        if store is not None:
+            store.put(trial_key(parameters, servers, trial, data_version), record)
+        records.append(record)
+    return records
+
+
+def random_search(server_parameters, data_path, n_trials=N_TRIALS, seed=SEED, **evaluate_kwargs):
+    """
+    無作為に選んだ学習パラメータをすべてのfoldで評価し、平均MAPE test (%) が最小のものを選ぶ。
+
+    Args:
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        n_trials (int): 試行数
+        seed (int): 乱数シード
+        **evaluate_kwargs: evaluate_trialsに渡す引数 (n_workers, num_threads, store)
+
+    Returns:
+        tuple: (best, records)
+            best: 最良の試行のレコード
+            records: 全試行のレコード
+    """
+    trials = sample_trials(n_trials, seed)
+    servers = const_model.SERVER_LIST
+    mapes = evaluate_trials(trials, server_parameters, data_path, servers, **evaluate_kwargs)
+    records = record_trials(trials, mapes, server_parameters, data_path, servers, 'random', 0,
+                            evaluate_kwargs.get('store'))
+    return records[int(np.argmin(mapes))], records
+
+
+def successive_halving(server_parameters,
+                       data_path,
+                       n_trials=N_TRIALS,
+                       seed=SEED,
+                       eta=HALVING_ETA,
+                       min_folds=HALVING_MIN_FOLDS,
+                       **evaluate_kwargs):
+    """
+    successive halvingで学習パラメータを選ぶ。最初の段では全試行をmin_folds個のfoldで評価し、
+    平均MAPE test (%) の上位1/etaの試行だけを、eta倍のfold数 (最後はすべてのfold) で評価し直す。
+    foldの順序はseedで一度だけ並べ替え (SERVER_LISTの先頭のサーバーに偏らないように)、
+    各段ではその先頭から使うため、前の段で評価したfoldの結果は結果ストアから読み込まれる。
+
+    Args:
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        n_trials (int): 最初の段の試行数
+        seed (int): 乱数シード (試行の学習パラメータとfoldの順序に使う)
+        eta (int): 次の段に残す割合の逆数
+        min_folds (int): 最初の段のfold数
+        **evaluate_kwargs: evaluate_trialsに渡す引数 (n_workers, num_threads, store)
+
+    Returns:
+        tuple: (best, records)
+            best: 最後の段で最良の試行のレコード
+            records: 全段の試行のレコード
+    """
+    trials = sample_trials(n_trials, seed)
+    fold_order = shuffle_servers(const_model.SERVER_LIST, seed)
+    n_folds = len(fold_order)
+    fold_num = min(min_folds, n_folds)
+    records = []
+    rung = 0
+    while True:
+        servers = fold_order[:fold_num]
+        mapes = evaluate_trials(trials, server_parameters, data_path, servers, **evaluate_kwargs)
+        rung_records = record_trials(trials, mapes, server_parameters, data_path, servers,
+                                     'halving', rung, evaluate_kwargs.get('store'))
+        records.extend(rung_records)
+        order = np.argsort(mapes, kind='stable')
+        if fold_num == n_folds or len(trials) == 1:
+            return rung_records[int(order[0])], records
+        keep = max(1, math.ceil(len(trials) / eta))
+        trials = [trials[i] for i in order[:keep]]
+        fold_num = min(fold_num * eta, n_folds)
+        rung += 1
+
+
+def save_best_params(best, output_path):
+    """
+    最良の学習パラメータをJSONファイルに保存する (const_model.load_tuned_paramsで読み込む)。
+
+    Args:
+        best (dict): 最良の試行のレコード
+        output_path (str): 出力するJSONファイルのパス
+    """
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'params': best['Params'],
+            'Variable Parameter': best['Variable Parameter'],
+            'Fold Num': best['Fold Num'],
+            'average MAPE test (%)': best['average MAPE test (%)'],
+        },
+                  f,
+                  ensure_ascii=False,
+                  indent=2)
+    print(f"best parameters: {best['Params']}, "
+          f"average MAPE test (%): {best['average MAPE test (%)']}")
+    print(f"Best parameters have been written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
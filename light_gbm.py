@@ -1,8 +1,14 @@
 import lightgbm as lgb
 import numpy as np
-import pandas as pd
 from sklearn.model_selection import train_test_split
 
+import metrics
+import tracing
+from feature_matrix import FeatureMatrix
+
+# SHAP値の計算方法 ('native': LightGBMのpred_contrib, 'shap': shapのTreeExplainer)
+ATTRIBUTION_BACKEND = 'native'
+
 
 def calculate_mape(predictions, actuals, alpha=1):
     """
@@ -16,11 +22,10 @@ def calculate_mape(predictions, actuals, alpha=1):
     Returns:
         float: MAPEの計算結果
     """
-    deltas = [(actual - alpha * pred) / actual for pred, actual in zip(predictions, actuals)]
-    return np.average(np.abs(deltas))
+    return metrics.calculate_mape(predictions, actuals, alpha)
 
 
-def train_lgb_model(train_df, target, parameters):
+def train_lgb_model(train_df, target, parameters, lgb_params=None):
     """
     LightGBMモデルを学習し、学習済みモデルを返す関数
 
@@ -28,6 +33,7 @@ def train_lgb_model(train_df, target, parameters):
         train_df (DataFrame): 学習データ
         target (str): 目的変数のカラム名
         parameters (list): 使用する特徴量のリスト
+        lgb_params (dict or None): 学習パラメータの上書き (例: {'num_threads': 1})
 
     Returns:
         model: 学習済みLightGBMモデル
@@ -35,22 +41,176 @@ def train_lgb_model(train_df, target, parameters):
         df: trainデータ
         df: validationデータ
     """
+    # train/valで列構成が一致するように、分割前にまとめてエンコードする
+    matrix = FeatureMatrix(train_df, parameters, target)
+    model, loss, train_rows, val_rows = train_lgb_rows(matrix, np.arange(len(train_df)),
+                                                       parameters, lgb_params)
+    # 予測時に同じ列構成でエンコードするため、カテゴリ情報をモデルに保持する
+    model.feature_categories = matrix.categories
+
+    return model, loss, train_df.iloc[train_rows], train_df.iloc[val_rows]
+
+
+def split_rows(rows, seed=42, init_rows=None):
+    """
+    学習に使う行を8:2でtrain:valに分割する関数
+
+    Args:
+        rows (np.ndarray): 学習に使う行位置の配列
+        seed (int): 乱数シード
+        init_rows (np.ndarray or None): 学習を続けるモデルの学習に使った行位置の配列 (rowsに含まれる)。
+            指定した場合、これらの行はそのモデルと同じ分割にし、残りの行を別に分割して加える。
+            前のモデルのtrainデータがvalに入ると、early stoppingの評価が甘くなるため
+
+    Returns:
+        np.ndarray: trainデータの行位置
+        np.ndarray: validationデータの行位置
+    """
+    if init_rows is None:
+        return train_test_split(rows, train_size=0.8, random_state=seed)
+    new_rows = np.setdiff1d(rows, init_rows)
+    if len(new_rows) + len(init_rows) != len(rows):
+        raise ValueError("init_rows must be a subset of rows")
+    init_train, init_val = train_test_split(init_rows, train_size=0.8, random_state=seed)
+    if len(new_rows) < 2:
+        return np.concatenate([init_train, new_rows]), init_val
+    new_train, new_val = train_test_split(new_rows, train_size=0.8, random_state=seed)
+    return np.concatenate([init_train, new_train]), np.concatenate([init_val, new_val])
+
+
+def train_lgb_rows(matrix, rows, parameters, lgb_params=None, init_model=None, init_rows=None):
+    """
+    エンコード済みの特徴量行列から指定した行を学習データとしてLightGBMモデルを学習する関数
+
+    Args:
+        matrix (FeatureMatrix): 特徴量行列
+        rows (np.ndarray): 学習に使う行位置の配列
+        parameters (list): 使用する特徴量のリスト
+        lgb_params (dict or None): 学習パラメータの上書き (例: {'num_threads': 1})
+        init_model (lgb.Booster or None): 指定した場合、このモデルの予測を初期値として学習を続ける
+        init_rows (np.ndarray or None): init_modelの学習に使った行位置の配列 (split_rowsを参照)
+
+    Returns:
+        model: 学習済みLightGBMモデル
+        loss: 用いたloss関数
+        np.ndarray: trainデータの行位置
+        np.ndarray: validationデータの行位置
+    """
     seed = 42  # 乱数シード
 
     # 学習データと検証データに分割
-    train_df, val_df = train_test_split(train_df, train_size=0.8, random_state=seed)
+    with tracing.span('train_test_split'):
+        train_rows, val_rows = split_rows(rows, seed, init_rows)
 
-    # 学習データの準備
-    X_train = pd.get_dummies(train_df[parameters], drop_first=True)
-    y_train = train_df[target].reset_index(drop=True)
+    # 学習データ・検証データの準備
+    with tracing.span('matrix.take'):
+        feature_name = [name.replace(' ', '_') for name in matrix.column_names(parameters)]
+        train_data = lgb.Dataset(matrix.take(train_rows, parameters),
+                                 matrix.target[train_rows],
+                                 feature_name=feature_name)
+        val_data = lgb.Dataset(matrix.take(val_rows, parameters),
+                               matrix.target[val_rows],
+                               feature_name=feature_name)
 
-    # 検証データの準備
-    X_val = pd.get_dummies(val_df[parameters], drop_first=True)
-    y_val = val_df[target].reset_index(drop=True)
+    # 学習パラメータ
+    loss = 'rmse'
+    params = {
+        'objective': 'regression',  # 最小化させるべき損失関数
+        'metric': loss,  # 評価指標
+        'random_state': seed,  # 乱数シード
+        'boosting_type': 'gbdt',
+        'verbose': -1,  # エラー対応
+    }
+    if lgb_params:
+        params.update(lgb_params)
 
-    # Datasetオブジェクトとしてデータを定義
-    train_data = lgb.Dataset(X_train, y_train)
-    val_data = lgb.Dataset(X_val, y_val)
+    # モデルの学習 (計測が有効な場合はDatasetの構築と学習の時間を記録する)
+    callbacks = [lgb.early_stopping(stopping_rounds=10)]
+    phases = tracing.lgb_phases()
+    if phases is not None:
+        callbacks.append(phases)
+    model = lgb.train(
+        params,
+        train_data,
+        valid_sets=[val_data],  # early_stoppingの評価用データ
+        valid_names=['valid'],
+        num_boost_round=10000,
+        init_model=init_model,
+        callbacks=callbacks,
+    )
+    if phases is not None:
+        phases.finish()
+
+    return model, loss, train_rows, val_rows
+
+
+class BinnedFold:
+    """
+    1つのfoldについて、全候補特徴量を含むビン分割済みのDatasetを保持するクラス。
+    特徴量の組み合わせごとの学習では、使わない特徴量をfeature_penaltyで0にして分岐に使わせない。
+
+    Attributes:
+        parameters (list): 全候補特徴量のリスト
+        train_rows (np.ndarray): trainデータの行位置
+        val_rows (np.ndarray): validationデータの行位置
+        train_data (lgb.Dataset): 構築済みの学習用Dataset
+        val_data (lgb.Dataset): 構築済みの検証用Dataset
+    """
+
+    def __init__(self, matrix, rows, parameters, seed=42):
+        self.parameters = list(parameters)
+        self.columns = matrix.column_indices(self.parameters)
+
+        # train_lgb_rowsと同じ分割
+        self.train_rows, self.val_rows = train_test_split(rows, train_size=0.8, random_state=seed)
+
+        feature_name = [name.replace(' ', '_') for name in matrix.column_names(self.parameters)]
+        # 組み合わせごとにmin_data_in_leafなどを変えても使えるように事前フィルタは無効にする
+        dataset_params = {'feature_pre_filter': False, 'verbose': -1}
+        self.train_data = lgb.Dataset(matrix.take(self.train_rows, self.parameters),
+                                      matrix.target[self.train_rows],
+                                      feature_name=feature_name,
+                                      params=dataset_params,
+                                      free_raw_data=False).construct()
+        self.val_data = lgb.Dataset(matrix.take(self.val_rows, self.parameters),
+                                    matrix.target[self.val_rows],
+                                    reference=self.train_data,
+                                    params=dataset_params,
+                                    free_raw_data=False).construct()
+
+    def feature_penalty(self, matrix, parameters):
+        """
+        使用する特徴量の列を1、それ以外を0としたfeature_penaltyを返す。
+
+        Args:
+            matrix (FeatureMatrix): 特徴量行列
+            parameters (list): 使用する特徴量のリスト
+
+        Returns:
+            list: 全候補特徴量の列ごとの係数
+        """
+        used = np.isin(self.columns, matrix.column_indices(parameters))
+        return used.astype(float).tolist()
+
+
+def train_lgb_binned(fold, matrix, parameters, lgb_params=None):
+    """
+    ビン分割済みのfoldのDatasetを使い、特徴量の組み合わせでLightGBMモデルを学習する関数。
+    学習したモデルの入力はfold.parametersの全候補特徴量になる。
+
+    Args:
+        fold (BinnedFold): ビン分割済みのfold
+        matrix (FeatureMatrix): 特徴量行列
+        parameters (list): 使用する特徴量のリスト
+        lgb_params (dict or None): 学習パラメータの上書き (例: {'num_threads': 1})
+
+    Returns:
+        model: 学習済みLightGBMモデル
+        loss: 用いたloss関数
+        np.ndarray: trainデータの行位置
+        np.ndarray: validationデータの行位置
+    """
+    seed = 42  # 乱数シード
 
     # 学習パラメータ
     loss = 'rmse'
@@ -60,19 +220,28 @@ def train_lgb_model(train_df, target, parameters):
         'random_state': seed,  # 乱数シード
         'boosting_type': 'gbdt',
         'verbose': -1,  # エラー対応
+        'feature_penalty': fold.feature_penalty(matrix, parameters),
     }
+    if lgb_params:
+        params.update(lgb_params)
 
     # モデルの学習
+    callbacks = [lgb.early_stopping(stopping_rounds=10)]
+    phases = tracing.lgb_phases()
+    if phases is not None:
+        callbacks.append(phases)
     model = lgb.train(
         params,
-        train_data,
-        valid_sets=[val_data],  # early_stoppingの評価用データ
+        fold.train_data,
+        valid_sets=[fold.val_data],  # early_stoppingの評価用データ
         valid_names=['valid'],
         num_boost_round=10000,
-        callbacks=[lgb.early_stopping(stopping_rounds=10)],
+        callbacks=callbacks,
     )
+    if phases is not None:
+        phases.finish()
 
-    return model, loss, train_df, val_df
+    return model, loss, fold.train_rows, fold.val_rows
 
 
 def predict_and_evaluate(model, dataset, target, parameters):
@@ -88,14 +257,172 @@ def predict_and_evaluate(model, dataset, target, parameters):
     Returns:
         float: MAPEの計算結果(%)
     """
-    # テストデータの準備
-    X = pd.get_dummies(dataset[parameters], drop_first=True)
-    y = dataset[target].reset_index(drop=True)
+    # テストデータの準備 (学習時と同じ列構成でエンコード)
+    matrix = FeatureMatrix(dataset, parameters, target,
+                           getattr(model, 'feature_categories', None))
+
+    return predict_and_evaluate_rows(model, matrix, np.arange(len(dataset)), parameters)
 
+
+def predict_and_evaluate_rows(model, matrix, rows, parameters):
+    """
+    エンコード済みの特徴量行列の指定した行を予測し、MAPEを計算する関数
+
+    Args:
+        model: 学習済みモデル
+        matrix (FeatureMatrix): 特徴量行列
+        rows (np.ndarray): 予測する行位置の配列
+        parameters (list): 使用する特徴量のリスト
+
+    Returns:
+        float: MAPEの計算結果(%)
+    """
     # 予測
-    predictions = model.predict(X)
+    with tracing.span('predict'):
+        predictions = model.predict(matrix.take(rows, parameters))
 
     # MAPEの計算
-    mape = calculate_mape(predictions, y)
+    with tracing.span('metrics'):
+        mape = metrics.calculate_metrics(predictions, matrix.target[rows])['MAPE']
 
     return round(mape * 100, 5)
+
+
+def predict_and_evaluate_splits(model, matrix, splits, parameters):
+    """
+    エンコード済みの特徴量行列の複数の行集合 (学習・検証・テストデータなど) をまとめて一度で予測し、
+    行集合ごとの評価指標を計算する関数
+
+    Args:
+        model: 学習済みモデル
+        matrix (FeatureMatrix): 特徴量行列
+        splits (dict): 行集合の名前 -> 行位置の配列
+        parameters (list): 使用する特徴量のリスト
+
+    Returns:
+        dict: 行集合の名前 -> 評価指標 ('MAPE', 'RMSE', 'MAE', 'Max APE'。
+            RMSEとMAEは目的変数の単位、MAPEとMax APEは割合)
+    """
+    names = list(splits)
+    rows = np.concatenate([splits[name] for name in names])
+
+    # 予測
+    with tracing.span('predict'):
+        predictions = model.predict(matrix.take(rows, parameters))
+
+    # 評価指標の計算 (行集合の番号をグループとして一度に集計する)
+    with tracing.span('metrics'):
+        codes = np.repeat(np.arange(len(names)), [len(splits[name]) for name in names])
+        results = metrics.calculate_metrics(predictions, matrix.target[rows], groups=codes)
+
+    positions = {code: i for i, code in enumerate(results['Groups'])}
+    nan = float('nan')
+    return {
+        name: {
+            metric: float(results[f'Group {metric}'][positions[code]])
+                    if code in positions else nan
+            for metric in ('MAPE', 'RMSE', 'MAE', 'Max APE')
+        } for code, name in enumerate(names)
+    }
+
+
+def get_shap_explainer(model):
+    """
+    モデルのSHAP TreeExplainerを返す。モデルごとに一度だけ構築して使い回す。
+
+    Args:
+        model: 学習済みモデル
+
+    Returns:
+        shap.TreeExplainer: SHAP値の計算に使うExplainer
+    """
+    explainer = getattr(model, 'shap_explainer', None)
+    if explainer is None:
+        # shapは'shap'バックエンドを使う場合のみ必要なため、ここでimportする
+        import shap
+        explainer = shap.TreeExplainer(model)
+        model.shap_explainer = explainer
+    return explainer
+
+
+def feature_contributions(model, X, backend=None):
+    """
+    各行の予測に対する入力列ごとの寄与 (SHAP値) を計算する関数。
+    'native' はLightGBMのpred_contrib (TreeSHAP) を使い、'shap' はshapのTreeExplainerを使う。
+
+    Args:
+        model: 学習済みモデル
+        X (np.ndarray): 入力行列 (行数 × 列数)
+        backend (str or None): 'native' または 'shap' (Noneの場合はATTRIBUTION_BACKEND)
+
+    Returns:
+        np.ndarray: 寄与の行列 (行数 × 列数)。バイアス項は含まない
+    """
+    backend = ATTRIBUTION_BACKEND if backend is None else backend
+    if backend == 'native':
+        # 最後の列はバイアス項 (期待値)
+        return model.predict(X, pred_contrib=True)[:, :-1]
+    if backend == 'shap':
+        return get_shap_explainer(model).shap_values(X)
+    raise ValueError(f"Unknown attribution backend: {backend}")
+
+
+def compare_attribution_backends(model, X):
+    """
+    'native' と 'shap' の両バックエンドで寄与を計算し、差の最大値を返す関数。
+    バックエンドを切り替える前の数値の一致確認に使う。
+
+    Args:
+        model: 学習済みモデル
+        X (np.ndarray): 入力行列 (行数 × 列数)
+
+    Returns:
+        dict: 'Max Abs Diff' (差の絶対値の最大), 'Max Rel Diff' (寄与の絶対値の最大に対する比)
+    """
+    native = feature_contributions(model, X, 'native')
+    reference = feature_contributions(model, X, 'shap')
+    max_abs_diff = float(np.abs(native - reference).max(initial=0.0))
+    scale = float(np.abs(reference).max(initial=0.0))
+    return {
+        'Max Abs Diff': max_abs_diff,
+        'Max Rel Diff': max_abs_diff / scale if scale > 0 else 0.0,
+    }
+
+
+def shap_importance(model, matrix, rows, model_parameters, target_parameters, backend=None):
+    """
+    指定した行のSHAP値から、特徴量ごとの平均・合計絶対SHAP値を計算する関数。
+    カテゴリ特徴量はダミー列のSHAP値の合計をその特徴量のSHAP値とする。
+
+    Args:
+        model: 学習済みモデル
+        matrix (FeatureMatrix): 特徴量行列
+        rows (np.ndarray): SHAP値を計算する行位置の配列
+        model_parameters (list): モデルの入力特徴量のリスト
+        target_parameters (list): 重要度を計算する特徴量のリスト
+        backend (str or None): 'native' または 'shap' (Noneの場合はATTRIBUTION_BACKEND)
+
+    Returns:
+        list of dict: 特徴量ごとの重要度
+            Keys: ["Parameter", "Mean Absolute SHAP Value", "Sum Absolute SHAP Value"]
+    """
+    with tracing.span('shap_values'):
+        shap_values = feature_contributions(model, matrix.take(rows, model_parameters), backend)
+
+    # モデルの入力列 -> 対象特徴量の対応行列を作り、特徴量ごとのSHAP値を一度の行列積で求める
+    positions = {column: i for i, column in enumerate(matrix.column_indices(model_parameters))}
+    selector = np.zeros((len(positions), len(target_parameters)))
+    for j, parameter in enumerate(target_parameters):
+        for column in matrix.parameter_columns[parameter]:
+            if column not in positions:
+                raise ValueError(f"Variable '{parameter}' is not found in model features.")
+            selector[positions[column], j] = 1
+    abs_shap_values = np.abs(shap_values @ selector)
+
+    means = abs_shap_values.mean(axis=0)
+    sums = abs_shap_values.sum(axis=0)
+    return [{
+        'Parameter': parameter,
+        'Mean Absolute SHAP Value': float(mean),
+        'Sum Absolute SHAP Value': float(total)
+    } for parameter, mean, total in zip(target_parameters, means, sums)]
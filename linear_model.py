@@ -0,0 +1,186 @@
+import os
+import time
+
+import numpy as np
+
+import const_model
+from format_mldata import load_dataset
+
+# リッジ回帰の正則化係数 (標準化した特徴量の係数に掛ける。0の場合は最小二乗法)
+RIDGE_ALPHA = 1.0
+
+
+def main():
+    """
+    メイン処理: ベンチマーク特徴量のすべての組み合わせをリッジ回帰のleave-one-server-outで評価し、
+    結果をCSVに保存する。LightGBMで評価する組み合わせを絞り込む前の一次評価に使う。
+    """
+    data_path = os.path.join(const_model.data_dir, const_model.benchmark_data_file)
+    parameters_conbs = const_model.get_parameters_conb(const_model.benchmark_parameters)
+
+    start = time.perf_counter()
+    model_info = linear_loocv(const_model.const_parameters, parameters_conbs, data_path,
+                              const_model.SERVER_LIST, const_model.target)
+    print(f"{len(parameters_conbs)} combinations x {len(const_model.SERVER_LIST)} folds: "
+          f"{time.perf_counter() - start:.3f} s")
+
+    const_model.output_results_to_csv(model_info, "linear_benchmark_parameter_loocv.csv")
+
+
+def fold_grams(design, target, test_indices, servers):
+    """
+    サーバーごとの行ブロックのグラム行列 ZᵀZ と Zᵀy を計算する (Zは先頭に定数列を加えた行列)。
+    サーバーを除外したfoldの学習データの値は、全体からそのサーバーのブロックを引けば求まる。
+
+    Args:
+        design (np.ndarray): 特徴量行列 (行数 × 列数, float64)
+        target (np.ndarray): 目的変数 (行数,)
+        test_indices (dict): サーバー名 -> 行位置の配列
+        servers (list): 除外するサーバー名のリスト (foldの順)
+
+    Returns:
+        tuple: (grams, moments)
+            grams: foldの学習データの ZᵀZ (fold数 × (列数 + 1) × (列数 + 1))
+            moments: foldの学習データの Zᵀy (fold数 × (列数 + 1))
+    """
+    Z = np.hstack([np.ones((len(design), 1)), design])
+    total_gram = Z.T @ Z
+    total_moment = Z.T @ target
+    grams = np.empty((len(servers), ) + total_gram.shape)
+    moments = np.empty((len(servers), ) + total_moment.shape)
+    for f, server in enumerate(servers):
+        rows = test_indices[server]
+        grams[f] = total_gram - Z[rows].T @ Z[rows]
+        moments[f] = total_moment - Z[rows].T @ target[rows]
+    return grams, moments
+
+
+def solve_subsets(grams, moments, subsets, alpha):
+    """
+    foldごとのグラム行列から、列の組み合わせごとのリッジ回帰を解く。
+    特徴量はfoldの学習データで標準化し、定数項には正則化を掛けない。
+    同じ列数の組み合わせは、全foldをまとめて1回のnp.linalg.solveで解く。
+
+    Args:
+        grams (np.ndarray): foldの学習データの ZᵀZ (fold数 × (列数 + 1) × (列数 + 1))
+        moments (np.ndarray): foldの学習データの Zᵀy (fold数 × (列数 + 1))
+        subsets (list): 組み合わせごとの列位置 (定数列を除いた位置) のリスト
+        alpha (float): 正則化係数
+
+    Returns:
+        tuple: (coefs, intercepts)
+            coefs: 係数 (fold数 × 列数 × 組み合わせ数)。使わない列の係数は0
+            intercepts: 定数項 (fold数 × 組み合わせ数)
+    """
+    n = grams[:, 0, 0]
+    means = grams[:, 0, 1:] / n[:, None]
+    y_mean = moments[:, 0] / n
+    # 平均を引いた行列の積和
+    centered = grams[:, 1:, 1:] - n[:, None, None] * means[:, :, None] * means[:, None, :]
+    centered_moment = moments[:, 1:] - n[:, None] * means * y_mean[:, None]
+    scales = np.sqrt(np.clip(np.diagonal(centered, axis1=1, axis2=2), 0, None) / n[:, None])
+    # foldの学習データで値が一定の列は標準化しない
+    scales[scales == 0] = 1.0
+    standardized = centered / (scales[:, :, None] * scales[:, None, :])
+    standardized_moment = centered_moment / scales
+
+    n_folds, n_columns = means.shape
+    coefs = np.zeros((n_folds, n_columns, len(subsets)))
+    by_size = {}
+    for j, subset in enumerate(subsets):
+        by_size.setdefault(len(subset), []).append(j)
+    for size, members in by_size.items():
+        if size == 0:
+            continue
+        index = np.array([subsets[j] for j in members])  # (組み合わせ数, size)
+        A = standardized[:, index[:, :, None], index[:, None, :]] + alpha * np.eye(size)
+        b = standardized_moment[:, index]
+        w = np.linalg.solve(A, b[..., None])[..., 0]  # (fold数, 組み合わせ数, size)
+        folds = np.arange(n_folds)[:, None, None]
+        coefs[folds, index[None], np.array(members)[None, :, None]] = w / scales[:, index]
+    intercepts = y_mean[:, None] - np.einsum('fc,fcm->fm', means, coefs)
+    return coefs, intercepts
+
+
+def linear_loocv(const_parameters, parameters_conbs, data_path, servers, target, alpha=None):
+    """
+    特徴量の組み合わせごとに、リッジ回帰のleave-one-server-out交差検証を行う。
+    グラム行列はサーバーごとに一度だけ計算し、組み合わせ × foldの学習は部分行列の求解で行う。
+
+    Args:
+        const_parameters (list): 定数特徴量
+        parameters_conbs (list): サーバーに関する特徴量の組み合わせリスト
+        data_path (str): データのパス
+        servers (list): 除外するサーバー名のリスト
+        target (str): 目的変数のカラム名
+        alpha (float or None): 正則化係数 (Noneの場合はRIDGE_ALPHA)
+
+    Returns:
+        list: モデルの評価結果 (組み合わせ順、各組み合わせ内はserversの順)。
+            検証データは使わないため 'MAPE val (%)' は含まない
+    """
+    alpha = RIDGE_ALPHA if alpha is None else alpha
+    dataset = load_dataset(data_path)
+    matrix = dataset.feature_matrix(target)
+    candidates = const_parameters + list(
+        dict.fromkeys(p for conb in parameters_conbs for p in conb))
+    columns = matrix.column_indices(candidates)
+    position = {column: i for i, column in enumerate(columns)}
+    subsets = [[position[c] for c in matrix.column_indices(const_parameters + list(conb))]
+               for conb in parameters_conbs]
+
+    # 平均を引いてからグラム行列を作り、大きな値 (Paramsなど) の積和での桁落ちを避ける
+    design = matrix.values[:, columns].astype(np.float64)
+    design -= design.mean(axis=0)
+    y = matrix.target
+    grams, moments = fold_grams(design, y, dataset.test_indices, servers)
+    coefs, intercepts = solve_subsets(grams, moments, subsets, alpha)
+
+    mape_train = np.empty((len(servers), len(parameters_conbs)))
+    mape_test = np.empty((len(servers), len(parameters_conbs)))
+    for f, server in enumerate(servers):
+        for mapes, rows in ((mape_train, dataset.train_indices[server]),
+                            (mape_test, dataset.test_indices[server])):
+            predictions = design[rows] @ coefs[f] + intercepts[f]
+            mapes[f] = np.abs((y[rows, None] - predictions) / y[rows, None]).mean(axis=0)
+
+    return [{
+        'ML': 'linear',
+        'loss': 'rmse',
+        'Parameter Num': len(const_parameters) + len(conb),
+        'Const Parameter': const_parameters,
+        'Variable Parameter Num': len(conb),
+        'Variable Parameter': list(conb),
+        'MAPE train (%)': round(float(mape_train[f, j]) * 100, 5),
+        'MAPE test (%)': round(float(mape_test[f, j]) * 100, 5),
+        'Leave One': server
+    } for j, conb in enumerate(parameters_conbs) for f, server in enumerate(servers)]
+
+
+def screen_parameters_conbs(const_parameters, parameters_conbs, data_path, servers, target,
+                            top_k, alpha=None):
+    """
+    リッジ回帰の平均MAPE test (%) で特徴量の組み合わせを順位付けし、上位top_k個を返す。
+
+    Args:
+        const_parameters (list): 定数特徴量
+        parameters_conbs (list): サーバーに関する特徴量の組み合わせリスト
+        data_path (str): データのパス
+        servers (list): 除外するサーバー名のリスト
+        target (str): 目的変数のカラム名
+        top_k (int): 残す組み合わせ数
+        alpha (float or None): 正則化係数 (Noneの場合はRIDGE_ALPHA)
+
+    Returns:
+        list: 平均MAPE test (%) の小さい順に並べた上位top_k個の組み合わせ
+    """
+    model_info = linear_loocv(const_parameters, parameters_conbs, data_path, servers, target,
+                              alpha)
+    mean_mape_test = np.array([r['MAPE test (%)'] for r in model_info]).reshape(
+        len(parameters_conbs), len(servers)).mean(axis=1)
+    order = np.argsort(mean_mape_test, kind='stable')[:top_k]
+    return [parameters_conbs[i] for i in order]
+
+
+if __name__ == "__main__":
+    main()
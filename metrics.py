@@ -0,0 +1,81 @@
+import numpy as np
+
+
+def absolute_percentage_errors(predictions, actuals, alpha=1):
+    """
+    絶対誤差率 |actual - alpha * pred| / |actual| を計算する。
+
+    Args:
+        predictions (array): 予測値。(行数,) または (モデル数, 行数)
+        actuals (array): 実際の値 (行数,)
+        alpha (float): 補正用パラメータ（デフォルトは1）
+
+    Returns:
+        np.ndarray: predictionsと同じ形状の絶対誤差率
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    actuals = np.asarray(actuals, dtype=np.float64)
+    return np.abs((actuals - alpha * predictions) / actuals)
+
+
+def calculate_mape(predictions, actuals, alpha=1):
+    """
+    平均絶対誤差率(MAPE)を計算する。
+
+    Args:
+        predictions (array): 予測値。(行数,) または (モデル数, 行数)
+        actuals (array): 実際の値 (行数,)
+        alpha (float): 補正用パラメータ（デフォルトは1）
+
+    Returns:
+        float or np.ndarray: MAPE。predictionsが2次元の場合はモデルごとの配列
+    """
+    return absolute_percentage_errors(predictions, actuals, alpha).mean(axis=-1)
+
+
+def calculate_metrics(predictions, actuals, groups=None, alpha=1):
+    """
+    MAPE, RMSE, MAE, 最大絶対誤差率をまとめて計算する。
+    groupsを指定した場合は、グループ (サーバー、学習・検証・テストデータなど) ごとの各指標も計算する。
+
+    Args:
+        predictions (array): 予測値 (行数,)
+        actuals (array): 実際の値 (行数,)
+        groups (array or None): 各行のグループ名 (行数,)
+        alpha (float): 補正用パラメータ（デフォルトは1）
+
+    Returns:
+        dict: 各指標 (RMSEとMAEは目的変数の単位、MAPEとMax APEは割合)
+            - 'MAPE', 'RMSE', 'MAE', 'Max APE': 全行の値
+            - 'Groups': グループ名の配列 (groups指定時のみ。昇順)
+            - 'Group MAPE', 'Group RMSE', 'Group MAE', 'Group Max APE': (グループ数,) の配列
+              (groups指定時のみ)
+    """
+    predictions = np.asarray(predictions, dtype=np.float64)
+    actuals = np.asarray(actuals, dtype=np.float64)
+    errors = actuals - alpha * predictions
+    abs_errors = np.abs(errors)
+    ape = abs_errors / np.abs(actuals)
+
+    metrics = {
+        'MAPE': ape.mean(),
+        'RMSE': np.sqrt(np.square(errors).mean()),
+        'MAE': abs_errors.mean(),
+        'Max APE': ape.max(initial=0.0),
+    }
+
+    if groups is not None:
+        labels, codes = np.unique(np.asarray(groups), return_inverse=True)
+        n_groups = len(labels)
+        counts = np.bincount(codes, minlength=n_groups)
+        # グループごとの合計と最大を、行のループなしで一度に集計する
+        max_ape = np.zeros(n_groups)
+        np.maximum.at(max_ape, codes, ape)
+        metrics['Groups'] = labels
+        metrics['Group MAPE'] = np.bincount(codes, weights=ape, minlength=n_groups) / counts
+        metrics['Group RMSE'] = np.sqrt(
+            np.bincount(codes, weights=np.square(errors), minlength=n_groups) / counts)
+        metrics['Group MAE'] = np.bincount(codes, weights=abs_errors, minlength=n_groups) / counts
+        metrics['Group Max APE'] = max_ape
+
+    return metrics
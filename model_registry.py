@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import lightgbm as lgb
+
+# 索引のSQLiteファイル名 (レジストリのディレクトリ内)
+INDEX_FILE = 'index.sqlite'
+
+
+class ModelRegistry:
+    """
+    学習済みのLightGBMモデルを、学習を一意に識別するキー (result_store.fold_key) で保存する
+    ディスク上のレジストリ。モデルは <キー>.txt に、評価指標などは索引のSQLiteに保存する。
+    合計サイズがmax_bytesを超えた場合は、最後に使われた時刻が古いものから削除する。
+
+    Attributes:
+        registry_dir (str): モデルを保存するディレクトリ
+        max_bytes (int or None): モデルファイルの合計サイズの上限 (Noneの場合は無制限)
+    """
+
+    def __init__(self, registry_dir, max_bytes=None):
+        """
+        Args:
+            registry_dir (str): モデルを保存するディレクトリ
+            max_bytes (int or None): モデルファイルの合計サイズの上限 (Noneの場合は無制限)
+        """
+        self.registry_dir = registry_dir
+        self.max_bytes = max_bytes
+        os.makedirs(registry_dir, exist_ok=True)
+        # 並列実行時は複数のワーカープロセスが同じ索引に書き込むため、ロック待ちを長めにする
+        self.conn = sqlite3.connect(os.path.join(registry_dir, INDEX_FILE), timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS models ('
+                          'key TEXT PRIMARY KEY, '
+                          'size INTEGER NOT NULL, '
+                          'created REAL NOT NULL, '
+                          'last_access REAL NOT NULL, '
+                          'metrics TEXT NOT NULL)')
+        self.conn.commit()
+
+    def model_path(self, key):
+        """
+        キーに対応するモデルファイルのパスを返す。
+
+        Args:
+            key (str): キー
+
+        Returns:
+            str: モデルファイルのパス
+        """
+        return os.path.join(self.registry_dir, key + '.txt')
+
+    def get(self, key, load_model=True):
+        """
+        保存済みのモデルと評価指標を取得し、最終使用時刻を更新する。
+
+        Args:
+            key (str): キー
+            load_model (bool): Falseの場合はモデルを読み込まず、評価指標のみ返す
+
+        Returns:
+            tuple or None: (model, metrics)。保存されていない場合はNone。
+                load_modelがFalseの場合、modelはNone
+        """
+        row = self.conn.execute('SELECT metrics FROM models WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        model = None
+        try:
+            if load_model:
+                with open(self.model_path(key), encoding='utf-8') as f:
+                    model = lgb.Booster(model_str=f.read())
+            elif not os.path.exists(self.model_path(key)):
+                raise FileNotFoundError(self.model_path(key))
+        except (OSError, lgb.basic.LightGBMError):
+            # 他のプロセスが削除した、または書き込みが壊れている場合は未保存として扱う
+            self.remove(key)
+            return None
+        self.conn.execute('UPDATE models SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return model, json.loads(row[0])
+
+    def put(self, key, model, metrics):
+        """
+        モデルと評価指標を保存する。合計サイズが上限を超えた場合は古いものから削除する。
+
+        Args:
+            key (str): キー
+            model (lgb.Booster): 学習済みモデル
+            metrics (dict): 評価指標など、モデルと一緒に保存する値 (JSONに変換できるもの)
+        """
+        path = self.model_path(key)
+        # 読み込み中のプロセスが書きかけのファイルを読まないように、一時ファイルから置き換える
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(model.model_to_string())
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO models (key, size, created, last_access, metrics) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, os.path.getsize(path), now, now, json.dumps(metrics, ensure_ascii=False)))
+        self.conn.commit()
+        if self.max_bytes is not None:
+            self.prune(self.max_bytes)
+
+    def remove(self, key):
+        """
+        モデルを削除する。
+
+        Args:
+            key (str): キー
+        """
+        self.conn.execute('DELETE FROM models WHERE key = ?', (key,))
+        self.conn.commit()
+        try:
+            os.remove(self.model_path(key))
+        except FileNotFoundError:
+            pass
+
+    def total_bytes(self):
+        """
+        保存しているモデルファイルの合計サイズを返す。
+
+        Returns:
+            int: 合計サイズ (バイト)
+        """
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM models').fetchone()[0]
+
+    def entries(self):
+        """
+        保存しているモデルの一覧を、最後に使われた時刻が新しい順に返す。
+
+        Returns:
+            list: {'key', 'size', 'created', 'last_access', 'metrics'} のリスト
+        """
+        rows = self.conn.execute('SELECT key, size, created, last_access, metrics FROM models '
+                                 'ORDER BY last_access DESC')
+        return [{
+            'key': key,
+            'size': size,
+            'created': created,
+            'last_access': last_access,
+            'metrics': json.loads(metrics),
+        } for key, size, created, last_access, metrics in rows]
+
+    def prune(self, max_bytes=None, max_age_s=None):
+        """
+        合計サイズがmax_bytes以下になるまで、最後に使われた時刻が古いものから削除する。
+        max_age_sを指定した場合は、それより長く使われていないものも削除する。
+
+        Args:
+            max_bytes (int or None): 合計サイズの上限
+            max_age_s (float or None): 最後に使われてからの経過時間の上限 (秒)
+
+        Returns:
+            int: 削除したモデル数
+        """
+        removed = 0
+        if max_age_s is not None:
+            rows = self.conn.execute('SELECT key FROM models WHERE last_access < ?',
+                                     (time.time() - max_age_s,)).fetchall()
+            for (key,) in rows:
+                self.remove(key)
+                removed += 1
+        if max_bytes is not None:
+            total = self.total_bytes()
+            if total > max_bytes:
+                rows = self.conn.execute(
+                    'SELECT key, size FROM models ORDER BY last_access').fetchall()
+                for key, size in rows:
+                    if total <= max_bytes:
+                        break
+                    self.remove(key)
+                    total -= size
+                    removed += 1
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    """
+    メイン処理: レジストリに保存したモデルの一覧表示・削除を行う。
+    """
+    import const_model
+
+    parser = argparse.ArgumentParser(description='学習済みモデルのレジストリを管理する')
+    parser.add_argument('--dir',
+                        default=os.path.join(const_model.output_dir,
+                                             const_model.MODEL_REGISTRY_DIR or 'models'),
+                        help='レジストリのディレクトリ')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help='保存しているモデルを一覧表示する')
+    list_parser.add_argument('--limit', type=int, default=None, help='表示する件数')
+    prune_parser = subparsers.add_parser('prune', help='古いモデルを削除する')
+    prune_parser.add_argument('--max-mb', type=float, default=None, help='合計サイズの上限 (MB)')
+    prune_parser.add_argument('--max-age-days', type=float, default=None,
+                              help='最後に使われてからの日数の上限')
+    prune_parser.add_argument('--all', action='store_true', help='すべて削除する')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.dir)
+    if args.command == 'list':
+        entries = registry.entries()
+        for entry in entries[:args.limit]:
+            metrics = entry['metrics']
+            last_access = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_access']))
+            print(f"{entry['key']}  {entry['size'] / 1024:8.1f} KB  {last_access}  "
+                  f"{metrics.get('Leave One')}  {metrics.get('Variable Parameter')}  "
+                  f"MAPE test (%): {metrics.get('MAPE test (%)')}")
+        print(f"{len(entries)} models, {registry.total_bytes() / 1024 ** 2:.1f} MB")
+    else:
+        max_bytes = None
+        if args.all:
+            max_bytes = 0
+        elif args.max_mb is not None:
+            max_bytes = int(args.max_mb * 1024 ** 2)
+        max_age_s = None
+        if args.max_age_days is not None:
+            max_age_s = args.max_age_days * 24 * 3600
+        removed = registry.prune(max_bytes, max_age_s)
+        print(f"{removed} models removed, {registry.total_bytes() / 1024 ** 2:.1f} MB remaining")
+    registry.close()
+
+
+if __name__ == "__main__":
+    main()
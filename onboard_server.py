@@ -0,0 +1,91 @@
+import os
+
+import const_model
+import create_data_for_mlmodel as create_data
+from format_mldata import load_dataset
+from result_store import ResultStore
+
+# const_model.MODEL_REGISTRY_DIRがNoneの場合に使うモデルレジストリのディレクトリ (output_dir内)。
+# ここに保存したモデルから、次にサーバーを追加したときに学習を続ける
+ONBOARD_MODEL_REGISTRY_DIR = 'models'
+
+
+def main():
+    """
+    メイン処理: results_all.csvとtestbench_all.csvに追加されたサーバーの行のみを学習データに追記し、
+    const_model.mainと同じ探索をやり直す。サーバーの追加で学習データが変わったfoldは、
+    追加前のfoldのモデル (モデルレジストリに保存したもの) から学習を続ける。
+    """
+    os.makedirs(const_model.output_dir, exist_ok=True)
+    if const_model.MODEL_REGISTRY_DIR is None:
+        const_model.MODEL_REGISTRY_DIR = ONBOARD_MODEL_REGISTRY_DIR
+    store = ResultStore(os.path.join(const_model.output_dir, const_model.RESULT_STORE_FILE))
+
+    #specの特徴量組み合わせ
+    data_path = os.path.join(const_model.data_dir, const_model.server_spec_data_file)
+    model_info = onboard_servers(const_model.server_spec_parameters, data_path,
+                                 create_data.update_data_server_spec_csv, store, max_size=1)
+    const_model.output_results_to_csv(model_info, "original_one_spec_parameter_loocv.csv")
+
+    # ベンチマークデータの特徴量組み合わせ
+    data_path = os.path.join(const_model.data_dir, const_model.benchmark_data_file)
+    model_info = onboard_servers(const_model.benchmark_parameters, data_path,
+                                 create_data.update_data_benchmark_csv, store, max_size=1)
+    const_model.output_results_to_csv(model_info, "original_one_benchmark_parameter_loocv.csv")
+    store.close()
+
+
+def onboard_servers(parameters, data_path, update_data, store, max_size=None):
+    """
+    学習データに新しいサーバーの行を追記し、特徴量の組み合わせを探索し直す。
+    既存のサーバーを除外するfoldは、学習データに新しいサーバーが加わるため評価し直す。
+    このとき、追記前のデータで学習したモデルがレジストリにあれば、そこから学習を続ける。
+    新しいサーバーを除外するfoldは、追記前の全データで最初から学習する。
+    探索するサーバーはデータセットから求め、const_model.SERVER_LISTの順に新しいサーバーを加えて
+    run_searchに渡す (const_model.SERVER_LISTは変更しない)。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        update_data (callable): 新しいサーバーの行を追記し、追記したサーバー名のリストを返す関数
+        store (ResultStore or None): 評価結果の保存先
+        max_size (int or None): 組み合わせの最大サイズ
+
+    Returns:
+        list: 評価したすべての組み合わせのモデルの評価結果
+    """
+    # 追記前のデータでのfoldのキー (run_searchと同じ学習パラメータと候補特徴量で計算する)
+    parameters_conbs = const_model.get_parameters_conb(parameters, max_size=max_size)
+    old_tasks = [(server_parameters, server)
+                 for server_parameters in parameters_conbs
+                 for server in load_dataset(data_path).server_list]
+    candidate_parameters = None
+    if const_model.REUSE_BINNING:
+        candidate_parameters = const_model.get_candidate_parameters(parameters_conbs, parameters)
+    old_keys = const_model.get_fold_keys(old_tasks, data_path, const_model.load_tuned_params(),
+                                         candidate_parameters)
+
+    new_servers = update_data()
+    if new_servers:
+        print(f"{data_path}: added servers {new_servers}")
+    else:
+        print(f"{data_path}: no new servers")
+
+    data_servers = list(load_dataset(data_path).server_list)
+    servers = ([s for s in const_model.SERVER_LIST if s in data_servers] +
+               [s for s in data_servers if s not in const_model.SERVER_LIST])
+
+    init_keys = {}
+    registry = const_model.get_model_registry()
+    if registry is not None and new_servers:
+        for (server_parameters, server), key in zip(old_tasks, old_keys):
+            # 評価指標のみ取得して、存在の確認と最終使用時刻の更新を行う
+            if registry.get(key, load_model=False) is not None:
+                init_keys[(tuple(server_parameters), server)] = key
+        print(f"{len(init_keys)} / {len(old_tasks)} folds are warm-started from saved models.")
+
+    return const_model.run_search(parameters, data_path, store, max_size, init_keys, servers)
+
+
+if __name__ == "__main__":
+    main()
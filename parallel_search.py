@@ -0,0 +1,193 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+import const_model
+import format_mldata
+import tracing
+
+
+def run_folds_parallel(tasks, data_path, n_workers, lgb_params, on_result,
+                       candidate_parameters=None, shap_values=False, progress=None):
+    """
+    特徴量の組み合わせ × 除外サーバーのfoldをプロセスプールで並列に学習・評価する。
+    データセットは親プロセスで一度だけ読み込み、各ワーカーの起動時に一度だけ渡す。
+
+    Args:
+        tasks (list): (index, server_parameters, server, init_key) のリスト
+        data_path (str): データのパス
+        n_workers (int): ワーカープロセス数
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き。
+            num_threadsが未指定の場合はCPUコア数をワーカー数で割った値を使う。
+        on_result (callable): foldの評価が終わるたびに親プロセスで呼ばれる関数 (index, result)。
+            呼び出し順は完了順だが、indexを使えば逐次実行と同じ順序に並べられる。
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        shap_values (bool): 評価結果にSHAP値の重要度を含めるかどうか
+        progress (SearchProgress or None): ワーカーごとの学習時間を記録する進捗
+    """
+    lgb_params = dict(lgb_params or {})
+    lgb_params.setdefault('num_threads', max(1, (os.cpu_count() or 1) // n_workers))
+
+    dataset = format_mldata.load_dataset(data_path)
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=init_worker,
+                             initargs=(dataset, tracing.is_enabled(),
+                                       const_model.MODEL_REGISTRY_DIR)) as executor:
+        futures = {
+            executor.submit(run_fold, (server_parameters, server, data_path, lgb_params,
+                                       candidate_parameters, shap_values, init_key)): index
+            for index, server_parameters, server, init_key in tasks
+        }
+        for future in as_completed(futures):
+            result, events, busy = future.result()
+            tracing.merge(events)
+            if progress is not None:
+                progress.add_busy(*busy)
+            on_result(futures[future], result)
+
+
+def run_trials_parallel(tasks, data_path, n_workers, on_result, candidate_parameters=None):
+    """
+    学習パラメータの試行 × 除外サーバーのfoldをプロセスプールで並列に学習・評価する。
+    run_folds_parallelと異なり、学習パラメータをタスクごとに指定する。
+    candidate_parametersを指定すると、各ワーカーはビン分割済みのfoldを試行間で使い回す。
+
+    Args:
+        tasks (list): (index, server_parameters, server, lgb_params) のリスト
+        data_path (str): データのパス
+        n_workers (int): ワーカープロセス数
+        on_result (callable): foldの評価が終わるたびに親プロセスで呼ばれる関数 (index, result)
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    dataset = format_mldata.load_dataset(data_path)
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=init_worker,
+                             initargs=(dataset, tracing.is_enabled(),
+                                       const_model.MODEL_REGISTRY_DIR)) as executor:
+        futures = {
+            executor.submit(run_fold, (server_parameters, server, data_path,
+                                       dict({'num_threads': num_threads}, **(lgb_params or {})),
+                                       candidate_parameters, False, None)): index
+            for index, server_parameters, server, lgb_params in tasks
+        }
+        for future in as_completed(futures):
+            result, events, _ = future.result()
+            tracing.merge(events)
+            on_result(futures[future], result)
+
+
+def run_races_parallel(n_conbs, make_task, data_path, n_workers, lgb_params, on_result,
+                       candidate_parameters=None, shap_values=False, progress=None,
+                       store_path=None, servers=None):
+    """
+    特徴量の組み合わせごとのfoldの打ち切り評価 (const_model.race_loocv) を並列に実行する。
+    閾値が完了した組み合わせの結果で更新されるように、同時に投入する組み合わせはn_workers個までとし、
+    1つ完了するたびに次の組み合わせをその時点の閾値で投入する。
+    store_pathを指定した場合、ワーカーはfoldを評価するたびにその結果ストアへ保存する。
+
+    Args:
+        n_conbs (int): 特徴量の組み合わせ数
+        make_task (callable): index -> (server_parameters, threshold, known, fold_keys) を返す関数。
+            fold_keysはサーバー名 -> 結果ストアのキー (store_pathを指定しない場合はNoneでよい)
+        data_path (str): データのパス
+        n_workers (int): ワーカープロセス数
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        on_result (callable): 組み合わせの評価が終わるたびに呼ばれる関数 (index, model_info, truncated)
+        candidate_parameters (list or None): ビン分割済みのDatasetを使い回す場合の全候補特徴量
+        shap_values (bool): 評価結果にSHAP値の重要度を含めるかどうか
+        progress (SearchProgress or None): ワーカーごとの学習時間を記録する進捗
+        store_path (str or None): foldの評価結果を保存する結果ストアのSQLiteファイルのパス
+        servers (list or None): Leave-one-outで除外するサーバー名のリスト
+            (Noneの場合はconst_model.SERVER_LIST)
+    """
+    lgb_params = dict(lgb_params or {})
+    lgb_params.setdefault('num_threads', max(1, (os.cpu_count() or 1) // n_workers))
+
+    dataset = format_mldata.load_dataset(data_path)
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=init_worker,
+                             initargs=(dataset, tracing.is_enabled(),
+                                       const_model.MODEL_REGISTRY_DIR)) as executor:
+        running = {}
+        next_index = 0
+        while next_index < n_conbs or running:
+            while next_index < n_conbs and len(running) < n_workers:
+                task = (*make_task(next_index), data_path, lgb_params, candidate_parameters,
+                        shap_values, store_path, servers)
+                running[executor.submit(run_race, task)] = next_index
+                next_index += 1
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                model_info, truncated, events, busy = future.result()
+                tracing.merge(events)
+                if progress is not None:
+                    progress.add_busy(*busy)
+                on_result(running.pop(future), model_info, truncated)
+
+
+def init_worker(dataset, trace=False, registry_dir=None):
+    """
+    ワーカープロセスの初期化処理。受け取ったデータセットをキャッシュに登録する。
+
+    Args:
+        dataset (format_mldata.LoocvDataset): 親プロセスで読み込んだデータセット
+        trace (bool): 計測 (tracing) を有効にするかどうか
+        registry_dir (str or None): 親プロセスのconst_model.MODEL_REGISTRY_DIR
+            (onboard_serverなどで実行時に有効にした場合も、ワーカーで同じレジストリを使う)
+    """
+    format_mldata._dataset_cache[os.path.abspath(dataset.data_path)] = dataset
+    const_model.MODEL_REGISTRY_DIR = registry_dir
+    tracing.enable(trace)
+    # fork時に親プロセスの記録を引き継がないようにする
+    tracing.clear()
+
+
+def run_fold(task):
+    """
+    ワーカープロセスで1つのfoldを学習・評価する。
+
+    Args:
+        task (tuple): (server_parameters, server, data_path, lgb_params, candidate_parameters,
+            shap_values, init_key)
+
+    Returns:
+        tuple: (result, events, busy)
+            result: モデル評価結果
+            events: このfoldで記録した計測区間 (計測が無効の場合は空)
+            busy: (ワーカーのpid, 学習・評価にかかった時間 (s), 学習したfold数)
+    """
+    (server_parameters, server, data_path, lgb_params, candidate_parameters, shap_values,
+     init_key) = task
+    start = time.perf_counter()
+    result = const_model.evaluate_fold(const_model.const_parameters, server_parameters, server,
+                                       data_path, lgb_params, candidate_parameters, shap_values,
+                                       init_key)
+    return result, tracing.drain(), (os.getpid(), time.perf_counter() - start, 1)
+
+
+def run_race(task):
+    """
+    ワーカープロセスで1つの特徴量の組み合わせのfoldを打ち切りありで評価する。
+
+    Args:
+        task (tuple): (server_parameters, threshold, known, fold_keys, data_path, lgb_params,
+            candidate_parameters, shap_values, store_path, servers)
+
+    Returns:
+        tuple: (model_info, truncated, events, busy)
+    """
+    (server_parameters, threshold, known, fold_keys, data_path, lgb_params, candidate_parameters,
+     shap_values, store_path, servers) = task
+    on_fold = None
+    if store_path is not None:
+        store = const_model.get_result_store(store_path)
+        on_fold = lambda server, result: store.put(fold_keys[server], result)
+    start = time.perf_counter()
+    model_info, truncated = const_model.race_loocv(const_model.const_parameters,
+                                                   server_parameters, data_path, threshold,
+                                                   lgb_params, candidate_parameters, known,
+                                                   shap_values, on_fold, servers)
+    busy = (os.getpid(), time.perf_counter() - start, len(model_info) - len(known or {}))
+    return model_info, truncated, tracing.drain(), busy
@@ -0,0 +1,188 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+# ビットを割り当てる特徴量 (順序を変えるとマスクの値が変わるため、追加は末尾に行う)
+PARAMETER_BITS = [
+    'transfer_all', 'transfer_continuous', 'transfer_roundtrip', 'matrix_conv', 'matrix_convloop',
+    'matrix_dot', 'matrix_dotloop', 'matrix_add', 'matrix_addloop', 'cpu_core',
+    'cpu_boost_clock(GHz)', 'cpu_thread', 'cpu_cache(MB)', 'gpu_architecture', 'gpu_core',
+    'gpu_boost_clock(GHz)', 'VRAM(GB)'
+]
+
+# 結果のスキーマに追加する列
+MASK_COLUMN = 'Variable Parameter Mask'
+KEY_COLUMN = 'Variable Parameter Key'
+
+# int64の列に収まるビット数
+MAX_BITS = 63
+
+# 特徴量名 -> ビット位置 (bit_indexで初期化する)
+_bit_index = {}
+
+
+def bit_index():
+    """
+    特徴量名 -> ビット位置の辞書を返す。
+    format_original_mlresult.rename_listで置き換えた後の名前 ("T_SLT" など) も
+    置き換える前と同じビットを使う。
+
+    Returns:
+        dict: 特徴量名 -> ビット位置
+    """
+    if not _bit_index:
+        # format_original_mlresultがこのモジュールをimportするため、ここでimportする
+        from format_original_mlresult import rename_list
+        _bit_index.update({name: i for i, name in enumerate(PARAMETER_BITS)})
+        _bit_index.update({new: _bit_index[old] for old, new in rename_list.items()})
+    return _bit_index
+
+
+def parameter_bit(parameter):
+    """
+    特徴量のビット位置を返す。PARAMETER_BITSにない特徴量には空いているビットを順に割り当てる。
+
+    Args:
+        parameter (str): 特徴量名
+
+    Returns:
+        int: ビット位置
+    """
+    index = bit_index()
+    if parameter not in index:
+        bit = max(index.values()) + 1
+        if bit >= MAX_BITS:
+            raise ValueError(f"特徴量が多すぎてビットマスクに割り当てられません: {parameter}")
+        index[parameter] = bit
+    return index[parameter]
+
+
+def parameter_mask(parameters):
+    """
+    特徴量の組み合わせをビットマスクに変換する。
+
+    Args:
+        parameters (iterable): 特徴量名のリスト
+
+    Returns:
+        int: ビットマスク
+    """
+    mask = 0
+    for parameter in parameters:
+        mask |= 1 << parameter_bit(parameter)
+    return mask
+
+
+def canonical_parameters(parameters):
+    """
+    特徴量の組み合わせを順序に依存しない正規形 (名前順のタプル) に変換する。
+
+    Args:
+        parameters (iterable): 特徴量名のリスト
+
+    Returns:
+        tuple: 名前順に並べた特徴量名のタプル
+    """
+    return tuple(sorted(set(parameters)))
+
+
+def parse_parameters(value):
+    """
+    Variable Parameterの値 (リスト、またはその文字列表現) をリストに変換する。
+
+    Args:
+        value (list or str): Variable Parameterの値
+
+    Returns:
+        list: 特徴量名のリスト
+    """
+    return ast.literal_eval(value) if isinstance(value, str) else list(value)
+
+
+def add_parameter_columns(df, column='Variable Parameter'):
+    """
+    Variable Parameter列の右隣にビットマスク列と正規形の列を追加する (既にある場合は計算し直す)。
+    文字列の解析はユニークな値ごとに一度だけ行う。
+
+    Args:
+        df (pd.DataFrame): 入力データフレーム
+        column (str): 特徴量の組み合わせの列名
+
+    Returns:
+        pd.DataFrame: 列を追加したデータフレーム
+    """
+    df = df.drop(columns=[MASK_COLUMN, KEY_COLUMN], errors='ignore')
+    codes, uniques = pd.factorize(df[column].map(lambda v: v if isinstance(v, str) else tuple(v)))
+    parsed = [parse_parameters(value) for value in uniques]
+    masks = np.array([parameter_mask(p) for p in parsed], dtype=np.int64)
+    keys = np.empty(len(parsed), dtype=object)
+    keys[:] = [canonical_parameters(p) for p in parsed]
+
+    position = df.columns.get_loc(column) + 1
+    df.insert(position, MASK_COLUMN, masks[codes])
+    df.insert(position + 1, KEY_COLUMN, keys[codes])
+    return df
+
+
+def parameter_masks(df, column='Variable Parameter'):
+    """
+    データフレームの各行のビットマスクを返す。ビットマスク列がない古い結果では計算する。
+
+    Args:
+        df (pd.DataFrame): 入力データフレーム
+        column (str): 特徴量の組み合わせの列名
+
+    Returns:
+        np.ndarray: ビットマスクの配列 (int64)
+    """
+    if MASK_COLUMN in df.columns:
+        return df[MASK_COLUMN].to_numpy(dtype=np.int64)
+    return add_parameter_columns(df[[column]], column)[MASK_COLUMN].to_numpy()
+
+
+def contains_any(masks, parameters):
+    """
+    指定した特徴量のいずれかを含む行を判定する。
+
+    Args:
+        masks (np.ndarray): ビットマスクの配列
+        parameters (list): 特徴量名のリスト
+
+    Returns:
+        np.ndarray: 判定結果 (bool)
+    """
+    return (masks & parameter_mask(parameters)) != 0
+
+
+def matches_any(masks, parameter_lists):
+    """
+    指定した組み合わせのいずれかと順不同で完全一致する行を判定する。
+
+    Args:
+        masks (np.ndarray): ビットマスクの配列
+        parameter_lists (list): 特徴量名のリストのリスト
+
+    Returns:
+        np.ndarray: 判定結果 (bool)
+    """
+    return np.isin(masks, [parameter_mask(p) for p in parameter_lists])
+
+
+def masks_cost(masks, weights):
+    """
+    ビットマスクの組み合わせごとに、特徴量の重み (Time Costなど) の合計を計算する。
+    weightsにない特徴量の重みは0とする。
+
+    Args:
+        masks (np.ndarray): ビットマスクの配列
+        weights (dict): 特徴量名 -> 重み
+
+    Returns:
+        np.ndarray: 重みの合計 (float64)
+    """
+    bit_weights = np.zeros(MAX_BITS)
+    for parameter, weight in weights.items():
+        bit_weights[parameter_bit(parameter)] = weight
+    bits = (np.asarray(masks, dtype=np.int64)[:, None] >> np.arange(MAX_BITS)) & 1
+    return bits @ bit_weights
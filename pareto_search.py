@@ -0,0 +1,160 @@
+import itertools
+import os
+
+import pandas as pd
+
+import const_model
+from result_store import ResultStore
+
+
+def main():
+    """
+    メイン処理: ベンチマーク特徴量の組み合わせを (Time Cost, 平均MAPE) のパレートフロントを
+    更新しながら探索し、フロントと評価結果をCSVに保存する。
+    """
+    os.makedirs(const_model.output_dir, exist_ok=True)
+    store = ResultStore(os.path.join(const_model.output_dir, const_model.RESULT_STORE_FILE))
+
+    data_path = os.path.join(const_model.data_dir, const_model.benchmark_data_file)
+    front, model_info = pareto_search(const_model.benchmark_parameters,
+                                      data_path,
+                                      n_workers=const_model.N_WORKERS,
+                                      num_threads=const_model.LGB_NUM_THREADS,
+                                      store=store,
+                                      reuse_binning=const_model.REUSE_BINNING,
+                                      lgb_params=const_model.load_tuned_params())
+    store.close()
+
+    const_model.output_results_to_csv(model_info, 'original_pareto_benchmark_parameter_loocv.csv')
+    output_path = os.path.join(const_model.output_dir, 'pareto_front_benchmark_parameter.csv')
+    front.to_csv(output_path, index=False)
+    print(f"Pareto front has been written to {output_path}")
+
+
+def dominates(a, b):
+    """
+    点aが点bを支配するか判定する (コスト・MAPEともに以下で、少なくとも一方が小さい)。
+
+    Args:
+        a (tuple): (time_cost, mape)
+        b (tuple): (time_cost, mape)
+
+    Returns:
+        bool: aがbを支配する場合True
+    """
+    return a[0] <= b[0] and a[1] <= b[1] and (a[0] < b[0] or a[1] < b[1])
+
+
+def update_front(front, point):
+    """
+    パレートフロントに点を追加し、支配された点を取り除く。
+
+    Args:
+        front (dict): 組み合わせ (tuple) -> (time_cost, mape)
+        point (tuple): (組み合わせ, (time_cost, mape))
+    """
+    conb, value = point
+    if any(dominates(other, value) for other in front.values()):
+        return
+    for other in [c for c, v in front.items() if dominates(value, v)]:
+        del front[other]
+    front[conb] = value
+
+
+def is_pruned(conb, evaluated, pruned, front, time_cost):
+    """
+    組み合わせの評価を省略するか判定する。
+    1つ少ない部分集合のいずれかが省略済み、またはフロント上の点Pに支配されていて、
+    この組み合わせのコストがPのコストを超える場合に省略する。
+
+    Args:
+        conb (tuple): 判定する組み合わせ
+        evaluated (dict): 評価済みの組み合わせ -> (time_cost, mape)
+        pruned (set): 省略した組み合わせ
+        front (dict): パレートフロント
+        time_cost (float): この組み合わせのTime Cost (s)
+
+    Returns:
+        bool: 省略する場合True
+    """
+    for subset in itertools.combinations(conb, len(conb) - 1):
+        if subset in pruned:
+            return True
+        value = evaluated.get(subset)
+        if value is None:
+            continue
+        if any(dominates(p, value) and time_cost > p[0] for p in front.values()):
+            return True
+    return False
+
+
+def pareto_search(parameters, data_path, max_size=None, max_cost=None, **search_kwargs):
+    """
+    特徴量の組み合わせをサイズの小さい順に評価し、(Time Cost (s), 平均MAPE test (%)) の
+    パレートフロントを逐次更新する。支配された組み合わせの上位集合のうち、
+    支配している点よりコストが高いものは評価を省略する。
+
+    Args:
+        parameters (list): 候補特徴量のリスト
+        data_path (str): データのパス
+        max_size (int or None): 組み合わせの最大サイズ
+        max_cost (float or None): 評価するTime Cost (s) の上限
+        **search_kwargs: search_parameters_conbに渡す引数
+
+    Returns:
+        tuple: (front_df, model_info)
+            front_df: パレートフロントの組み合わせ (Time Cost (s) の昇順)
+            model_info: 評価したすべての組み合わせのモデルの評価結果
+    """
+    if max_size is None:
+        max_size = len(parameters)
+    # サイズごとに評価する組み合わせが変わっても、同じDatasetとキーを使うように全候補でビン分割する
+    search_kwargs.setdefault('binning_parameters', list(parameters))
+    # サイズごとの評価の進捗を1つにまとめて表示・保存する
+    own_progress = search_kwargs.get('progress') is None
+    if own_progress:
+        servers = search_kwargs.get('servers') or const_model.SERVER_LIST
+        search_kwargs['progress'] = const_model.make_progress(search_kwargs.get('n_workers', 1),
+                                                              data_path, len(servers))
+    evaluated = {}
+    pruned = set()
+    front = {}
+    model_info = []
+
+    # 定数特徴量のみ (ベンチマークなし) のモデルから始める
+    for size in range(0, max_size + 1):
+        candidates = []
+        for conb in itertools.combinations(parameters, size):
+            time_cost = const_model.parameters_time_cost(conb)
+            if ((max_cost is not None and time_cost > max_cost) or
+                (size > 0 and is_pruned(conb, evaluated, pruned, front, time_cost))):
+                pruned.add(conb)
+            else:
+                candidates.append(conb)
+        if not candidates:
+            break
+        print(f"size {size}: evaluating {len(candidates)} combinations, "
+              f"pruned {sum(len(c) == size for c in pruned)}")
+
+        mapes, results = const_model.score_parameters_conbs([list(c) for c in candidates],
+                                                            data_path, **search_kwargs)
+        model_info.extend(results)
+        for conb, mape in zip(candidates, mapes):
+            evaluated[conb] = (const_model.parameters_time_cost(conb), mape)
+            update_front(front, (conb, evaluated[conb]))
+    if own_progress:
+        search_kwargs['progress'].close()
+
+    front_df = pd.DataFrame([{
+        'Variable Parameter Num': len(conb),
+        'Variable Parameter': list(conb),
+        'Time Cost (s)': round(time_cost, 5),
+        'average MAPE test (%)': round(mape, 5),
+    } for conb, (time_cost, mape) in front.items()])
+    if not front_df.empty:
+        front_df = front_df.sort_values(by='Time Cost (s)', ignore_index=True)
+    return front_df, model_info
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+import const_model
+import light_gbm as lgb_reg
+from feature_matrix import FeatureMatrix
+from format_mldata import load_dataset
+
+# 配備用モデルの保存先
+model_dir = './ml_results/service'
+model_name = 'inference_time'
+
+# 配備用モデルで使うサーバーに関する特徴量 (定数特徴量は常に使う)
+SERVICE_PARAMETERS = ['transfer_all', 'matrix_dot']
+
+# HTTPサーバーの待ち受けアドレス
+HOST = '127.0.0.1'
+PORT = 8080
+# 1リクエストで受け付ける最大のバイト数
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+def main():
+    """
+    メイン処理: 配備用モデルを学習して保存する (train)、または保存したモデルで予測サーバーを起動する (serve)。
+    """
+    parser = argparse.ArgumentParser(description='推論時間の予測サービス')
+    parser.add_argument('--model', default=os.path.join(model_dir, model_name),
+                        help='モデルのパス (拡張子なし。.txtと.jsonを使う)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help='全サーバーのデータでモデルを学習して保存する')
+    train_parser.add_argument('--data',
+                              default=os.path.join(const_model.data_dir,
+                                                   const_model.benchmark_data_file))
+    train_parser.add_argument('--parameters', nargs='+', default=SERVICE_PARAMETERS,
+                              help='サーバーに関する特徴量')
+    serve_parser = subparsers.add_parser('serve', help='HTTPで予測を提供する')
+    serve_parser.add_argument('--host', default=HOST)
+    serve_parser.add_argument('--port', type=int, default=PORT)
+    serve_parser.add_argument('--unix-socket', default=None,
+                              help='指定した場合はTCPの代わりにUnixドメインソケットで待ち受ける')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        service = train_service(args.parameters, args.data)
+        service.save(args.model)
+        print(f"Model has been written to {args.model}.txt ({service.parameters})")
+    else:
+        serve(PredictionService.load(args.model), args.host, args.port, args.unix_socket)
+
+
+class PredictionService:
+    """
+    学習済みモデルと入力の特徴量 (スキーマ) を一度だけ読み込み、推論時間を予測するクラス。
+    数値の配列をスキーマの順に渡すと、エンコードせずにそのままモデルに渡す。
+
+    Attributes:
+        model (lgb.Booster): 学習済みモデル
+        parameters (list): 入力の特徴量 (この順で値を受け付ける)
+        categories (dict): カテゴリ列名 -> カテゴリ値のリスト (学習時のエンコード)
+    """
+
+    def __init__(self, model, parameters, categories=None):
+        """
+        Args:
+            model (lgb.Booster): 学習済みモデル
+            parameters (list): 学習に使った特徴量のリスト
+            categories (dict or None): 学習時のカテゴリ列のカテゴリ値
+        """
+        self.model = model
+        self.parameters = list(parameters)
+        self.categories = dict(categories or {})
+        n_features = model.num_feature()
+        if not self.categories and n_features != len(self.parameters):
+            raise ValueError(f"モデルの入力列数 ({n_features}) と特徴量の数 "
+                             f"({len(self.parameters)}) が一致しません。")
+        # LightGBMのBoosterは同時に予測するとスレッド安全でないため、予測は1つずつ行う
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """
+        saveで保存したモデルとスキーマを読み込む。
+
+        Args:
+            path (str): モデルのパス (拡張子なし)
+
+        Returns:
+            PredictionService: 予測サービス
+        """
+        with open(path + '.json', encoding='utf-8') as f:
+            schema = json.load(f)
+        return cls(lgb.Booster(model_file=path + '.txt'), schema['parameters'],
+                   schema['categories'])
+
+    @classmethod
+    def from_registry(cls, registry, key):
+        """
+        モデルレジストリに保存したfoldのモデルを読み込む。
+
+        Args:
+            registry (model_registry.ModelRegistry): モデルレジストリ
+            key (str): キー
+
+        Returns:
+            PredictionService: 予測サービス
+        """
+        cached = registry.get(key)
+        if cached is None:
+            raise KeyError(f"モデルが保存されていません: {key}")
+        model, metrics = cached
+        return cls(model, metrics['Model Parameter'], metrics.get('Feature Categories'))
+
+    def save(self, path):
+        """
+        モデルを <path>.txt に、スキーマを <path>.json に保存する。
+
+        Args:
+            path (str): モデルのパス (拡張子なし)
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.model.save_model(path + '.txt')
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'parameters': self.parameters, 'categories': self.categories},
+                      f,
+                      ensure_ascii=False,
+                      indent=2)
+
+    def predict(self, rows):
+        """
+        推論時間 (s) を予測する。
+
+        Args:
+            rows (np.ndarray, list or pd.DataFrame): 予測する行。
+                配列の場合は (行数 × 特徴量数) でparametersの順、list of dictまたは
+                DataFrameの場合は特徴量名の列を持つ
+
+        Returns:
+            np.ndarray: 予測値 (行数,)
+        """
+        X = self.encode(rows)
+        if len(X) == 0:
+            return np.empty(0)
+        with self._lock:
+            return self.model.predict(X)
+
+    def predict_one(self, features):
+        """
+        1行の推論時間 (s) を予測する。
+
+        Args:
+            features (dict): 特徴量名 -> 値
+
+        Returns:
+            float: 予測値
+        """
+        return float(self.predict([features])[0])
+
+    def encode(self, rows):
+        """
+        予測する行をモデルの入力行列に変換する。
+
+        Args:
+            rows (np.ndarray, list or pd.DataFrame): 予測する行 (predictを参照)
+
+        Returns:
+            np.ndarray: 入力行列 (float64, C連続)
+        """
+        if isinstance(rows, list) and rows and isinstance(rows[0], dict):
+            if self.categories:
+                rows = pd.DataFrame(rows)
+            else:
+                # 数値列のみの場合はDataFrameを作らずに、スキーマの順に値を並べる
+                try:
+                    rows = [[row[p] for p in self.parameters] for row in rows]
+                except KeyError as e:
+                    raise ValueError(f"特徴量が不足しています: {e.args[0]}") from None
+        if isinstance(rows, pd.DataFrame):
+            missing = [p for p in self.parameters if p not in rows.columns]
+            if missing:
+                raise ValueError(f"特徴量が不足しています: {missing}")
+            if not self.categories:
+                rows = rows[self.parameters].to_numpy(dtype=np.float64)
+            else:
+                # 学習時と同じ列構成 (数値列が先、ダミー列が後) でエンコードする
+                matrix = FeatureMatrix(rows, self.parameters, categories=self.categories)
+                return np.ascontiguousarray(matrix.take(np.arange(len(rows)), self.parameters),
+                                            dtype=np.float64)
+        elif self.categories:
+            raise ValueError("カテゴリ特徴量を含むモデルには、特徴量名付きの行を渡してください。")
+
+        X = np.asarray(rows, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1) if X.size else X.reshape(0, len(self.parameters))
+        if X.ndim != 2:
+            raise ValueError(f"行は (行数 × 特徴量数) の2次元配列で渡してください: 次元数 {X.ndim}")
+        if X.shape[1] != len(self.parameters):
+            raise ValueError(f"列数が特徴量の数 ({len(self.parameters)}) と一致しません: {X.shape[1]}")
+        return np.ascontiguousarray(X)
+
+
+def train_service(server_parameters, data_path, lgb_params=None):
+    """
+    全サーバーのデータで配備用モデルを学習する。検証データ (2割) はearly stoppingに使う。
+
+    Args:
+        server_parameters (list): サーバーに関する特徴量
+        data_path (str): データのパス
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+
+    Returns:
+        PredictionService: 予測サービス
+    """
+    dataset = load_dataset(data_path)
+    matrix = dataset.feature_matrix(const_model.target)
+    parameters = const_model.const_parameters + list(server_parameters)
+    model, _, _, _ = lgb_reg.train_lgb_rows(matrix, np.arange(len(dataset.df)), parameters,
+                                            lgb_params)
+    categories = {p: matrix.categories[p] for p in parameters if p in matrix.categories}
+    return PredictionService(model, parameters, categories)
+
+
+def make_handler(service):
+    """
+    予測サービスを提供するHTTPリクエストハンドラのクラスを作る。
+
+    GET /schema: {"parameters": [...]} を返す
+    POST /predict: {"rows": [{特徴量名: 値, ...}, ...]} または {"data": [[値, ...], ...]}
+        (parametersの順) を受け取り、{"predictions": [...]} を返す
+
+    Args:
+        service (PredictionService): 予測サービス
+
+    Returns:
+        type: BaseHTTPRequestHandlerのサブクラス
+    """
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        # 接続を使い回して、リクエストごとの接続のコストを省く
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/schema':
+                self.send_json(200, {'parameters': service.parameters})
+            elif self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            else:
+                self.send_json(404, {'error': f'not found: {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_json(404, {'error': f'not found: {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                self.send_json(400, {'error': 'invalid Content-Length'})
+                return
+            if length < 0:
+                self.send_json(400, {'error': 'invalid Content-Length'})
+                return
+            if length > MAX_REQUEST_BYTES:
+                self.send_json(413, {'error': 'request too large'})
+                return
+            # 入力の誤りはすべて400で返す (例外で接続を切らない)
+            try:
+                request = json.loads(self.rfile.read(length))
+                if not isinstance(request, dict):
+                    raise ValueError('request body must be a JSON object')
+                if 'rows' in request:
+                    rows = request['rows']
+                elif 'data' in request:
+                    rows = request['data']
+                else:
+                    raise ValueError('request body must contain "rows" or "data"')
+                predictions = service.predict(rows)
+            except (KeyError, TypeError, ValueError, IndexError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            self.send_json(200, {'predictions': predictions.tolist()})
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def address_string(self):
+            # Unixドメインソケットではclient_addressがホスト名とポートの組ではない
+            if isinstance(self.client_address, tuple):
+                return super().address_string()
+            return 'unix'
+
+        def log_message(self, format, *args):
+            # リクエストごとのログ出力は遅延になるため出力しない
+            pass
+
+    return PredictionHandler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unixドメインソケットで待ち受けるHTTPサーバー。"""
+    daemon_threads = True
+
+
+def serve(service, host=HOST, port=PORT, unix_socket=None):
+    """
+    予測サービスをHTTPで提供する (Ctrl+Cで停止する)。
+
+    Args:
+        service (PredictionService): 予測サービス
+        host (str): 待ち受けるホスト
+        port (int): 待ち受けるポート
+        unix_socket (str or None): 指定した場合はこのパスのUnixドメインソケットで待ち受ける
+    """
+    handler = make_handler(service)
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, handler)
+        print(f"Serving predictions on unix:{unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print(f"Serving predictions on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+
+# 学習結果に影響しないためキーから除外する学習パラメータ
+NON_MODEL_PARAMS = ('num_threads', 'verbose')
+
+
+def fold_key(parameters, server, lgb_params, data_version):
+    """
+    1つのfoldの学習を一意に識別するキーを計算する。
+
+    Args:
+        parameters (list): 使用する特徴量のリスト
+        server (str): Leave-one-outで除外するサーバー名
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        data_version (str): 学習に使うデータのバージョン (ハッシュ値)
+
+    Returns:
+        str: SHA-1のキー
+    """
+    model_params = {
+        k: v
+        for k, v in (lgb_params or {}).items() if k not in NON_MODEL_PARAMS
+    }
+    payload = json.dumps(
+        {
+            'parameters': list(parameters),
+            'server': server,
+            'lgb_params': model_params,
+            'data_version': data_version,
+        },
+        sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def trial_key(parameters, servers, lgb_params, data_version):
+    """
+    学習パラメータの試行 (複数のfoldの評価) を一意に識別するキーを計算する。
+
+    Args:
+        parameters (list): 使用する特徴量のリスト
+        servers (list): 評価したfoldの除外サーバー名のリスト
+        lgb_params (dict or None): LightGBMの学習パラメータの上書き
+        data_version (str): 学習に使うデータのバージョン (ハッシュ値)
+
+    Returns:
+        str: SHA-1のキー
+    """
+    return fold_key(parameters, {'trial': list(servers)}, lgb_params, data_version)
+
+
+class ResultStore:
+    """
+    foldごとの評価結果を逐次保存するSQLiteストア。
+    探索が途中で止まっても、再実行時に保存済みのキーを読み飛ばせる。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                          'key TEXT PRIMARY KEY, '
+                          'record TEXT NOT NULL)')
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        保存済みの評価結果をまとめて取得する。
+
+        Args:
+            keys (list): キーのリスト
+
+        Returns:
+            dict: キー -> 評価結果 (保存済みのキーのみ)
+        """
+        records = {}
+        keys = list(keys)
+        # SQLiteのプレースホルダ数の上限を超えないように分割して問い合わせる
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, record FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk)
+            records.update((key, json.loads(record)) for key, record in rows)
+        return records
+
+    def put(self, key, record):
+        """
+        評価結果を保存する。
+
+        Args:
+            key (str): キー
+            record (dict): 評価結果
+        """
+        self.conn.execute('INSERT OR REPLACE INTO results (key, record) VALUES (?, ?)',
+                          (key, json.dumps(record, ensure_ascii=False)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
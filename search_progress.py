@@ -0,0 +1,204 @@
+import datetime
+import json
+import os
+import time
+
+# 進捗を表示・保存する間隔 (s)
+REPORT_INTERVAL = 10.0
+
+
+class SearchProgress:
+    """
+    (特徴量の組み合わせ, fold) の評価の進捗を集計し、一定間隔で端末に表示してJSONファイルに保存するクラス。
+    評価が終わるたびの処理は数値の更新のみで、表示と保存はREPORT_INTERVALごとに行う。
+    段階的な探索 (beam, pareto探索など) では、1つの進捗に段階ごとの評価をadd_tasksで加えていく。
+
+    Attributes:
+        total (int): 評価するfoldの総数 (保存済みのfoldを含む。段階的な探索では投入済みの段階の合計)
+        batches (int): add_tasksで加えた段階の数
+        completed (int): 評価が終わったfoldの数 (保存済みのfoldを含む)
+        cached (int): 結果ストアから読み込んだfoldの数
+        skipped (int): 打ち切りにより評価しなかったfoldの数
+        best (tuple or None): (平均MAPE test (%), 特徴量の組み合わせ)。すべてのfoldを評価した
+            組み合わせのうち最良のもの
+    """
+
+    def __init__(self, total, n_folds, n_workers=1, status_path=None, label='', interval=None):
+        """
+        Args:
+            total (int): 評価するfoldの総数 (後からadd_tasksで加える場合は0)
+            n_folds (int): 1つの組み合わせあたりのfold数
+            n_workers (int): ワーカープロセス数 (稼働率の計算に使う)
+            status_path (str or None): 進捗を保存するJSONファイルのパス (Noneの場合は保存しない)
+            label (str): 表示と保存に付ける名前 (データファイル名など)
+            interval (float or None): 表示と保存の間隔 (s)。Noneの場合はREPORT_INTERVAL
+        """
+        self.total = total
+        self.batches = 0
+        self.n_folds = n_folds
+        self.n_workers = n_workers
+        self.status_path = status_path
+        self.label = label
+        self.interval = REPORT_INTERVAL if interval is None else interval
+        self.completed = 0
+        self.cached = 0
+        self.skipped = 0
+        self.best = None
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._last_report = self._start
+        # 組み合わせ -> 評価済みのfoldのMAPE test (%) のリスト (すべてのfoldがそろうまで)
+        self._fold_mapes = {}
+        self._n_combinations = 0
+        # ワーカーのpid -> [学習したfold数, 学習にかかった時間の合計 (s)]
+        self._workers = {}
+
+    def add_tasks(self, n):
+        """
+        評価するfoldを加える (探索の段階ごとに呼ぶ)。
+
+        Args:
+            n (int): 加えるfold数
+        """
+        self.total += n
+        self.batches += 1
+
+    def update(self, result, cached=False):
+        """
+        評価が終わったfoldを記録する。前回の表示からintervalが経過していれば進捗を表示・保存する。
+
+        Args:
+            result (dict): モデル評価結果
+            cached (bool): 結果ストアから読み込んだfoldの場合True (学習速度には含めない)
+        """
+        self.completed += 1
+        if cached:
+            self.cached += 1
+        conb = tuple(result['Variable Parameter'])
+        mapes = self._fold_mapes.setdefault(conb, [])
+        mapes.append(result['MAPE test (%)'])
+        if len(mapes) == self.n_folds:
+            del self._fold_mapes[conb]
+            self._n_combinations += 1
+            mean_mape = sum(mapes) / len(mapes)
+            if self.best is None or mean_mape < self.best[0]:
+                self.best = (mean_mape, list(conb))
+        self._maybe_report()
+
+    def skip(self, n):
+        """
+        打ち切りにより評価しないfoldを記録する。
+
+        Args:
+            n (int): 評価しないfold数
+        """
+        self.skipped += n
+        self._maybe_report()
+
+    def add_busy(self, worker, seconds, n=1):
+        """
+        ワーカーが学習にかかった時間を記録する (稼働率の計算に使う)。
+
+        Args:
+            worker (int): ワーカーのpid
+            seconds (float): 学習にかかった時間 (s)
+            n (int): 学習したfold数
+        """
+        stats = self._workers.setdefault(worker, [0, 0.0])
+        stats[0] += n
+        stats[1] += seconds
+
+    def close(self):
+        """最終的な進捗を表示・保存する。"""
+        self.report(finished=True)
+
+    def _maybe_report(self):
+        if time.perf_counter() - self._last_report >= self.interval:
+            self.report()
+
+    def status(self, finished=False):
+        """
+        現在の進捗を集計する。
+
+        Args:
+            finished (bool): 評価がすべて終わった場合True
+
+        Returns:
+            dict: 進捗 (JSONに変換できる値)
+        """
+        elapsed = time.perf_counter() - self._start
+        fitted = self.completed - self.cached
+        remaining = self.total - self.completed - self.skipped
+        rate = fitted / elapsed if elapsed > 0 else 0.0
+        if remaining == 0:
+            eta = 0.0
+        else:
+            eta = remaining / rate if rate > 0 else None
+        workers = {
+            str(pid): {
+                'folds': n,
+                'busy (s)': round(busy, 3),
+                'utilization (%)': round(busy / elapsed * 100, 1) if elapsed > 0 else 0.0,
+            } for pid, (n, busy) in sorted(self._workers.items())
+        }
+        busy_total = sum(busy for _, busy in self._workers.values())
+        return {
+            'label': self.label,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+            'finished': finished,
+            'batches': self.batches,
+            'elapsed (s)': round(elapsed, 3),
+            'total folds': self.total,
+            'completed folds': self.completed,
+            'cached folds': self.cached,
+            'skipped folds': self.skipped,
+            'remaining folds': remaining,
+            'completed combinations': self._n_combinations,
+            'total combinations': self.total // self.n_folds if self.n_folds else 0,
+            'fits/s': round(rate, 4),
+            'ETA (s)': None if eta is None else round(eta, 1),
+            'utilization (%)': round(busy_total / (elapsed * self.n_workers) * 100, 1)
+                               if elapsed > 0 else 0.0,
+            'workers': workers,
+            'best average MAPE test (%)': None if self.best is None else round(self.best[0], 5),
+            'best Variable Parameter': None if self.best is None else self.best[1],
+        }
+
+    def report(self, finished=False):
+        """
+        進捗を1行で表示し、status_pathに保存する。
+
+        Args:
+            finished (bool): 評価がすべて終わった場合True
+        """
+        self._last_report = time.perf_counter()
+        status = self.status(finished)
+        eta = '-' if status['ETA (s)'] is None else str(
+            datetime.timedelta(seconds=round(status['ETA (s)'])))
+        best = '-' if self.best is None else (f"{status['best average MAPE test (%)']:.3f}% "
+                                              f"{status['best Variable Parameter']}")
+        prefix = f"[progress {self.label}]" if self.label else "[progress]"
+        print(f"{prefix} {status['completed folds']}/{self.total} folds "
+              f"({status['cached folds']} cached, {status['skipped folds']} skipped), "
+              f"{status['fits/s']:.2f} fits/s, ETA {eta}, "
+              f"utilization {status['utilization (%)']:.0f}% of {self.n_workers} workers, "
+              f"best {best}")
+        if self.status_path is not None:
+            write_status(status, self.status_path)
+
+
+def write_status(status, path):
+    """
+    進捗をJSONファイルに保存する。読み込み中のプロセスが書きかけのファイルを読まないように、
+    一時ファイルに書いてから置き換える。
+
+    Args:
+        status (dict): 進捗
+        path (str): JSONファイルのパス
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,323 @@
+import ast
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrowがない環境ではCSVのみを使う
+    pa = None
+
+# CSVに加えて出力する列指向形式 ('parquet', 'feather')。CSVは互換性のため常に出力する
+STORAGE_FORMATS = []
+
+# リストを文字列 ("['T_SLT']" など) で保存している列
+LIST_COLUMNS = [
+    'Const Parameter', 'Variable Parameter', 'Variable Parameter Key', 'Low Mape Server',
+    'High Mape Server'
+]
+# リスト列のうち、タプルとして扱う列
+TUPLE_COLUMNS = ['Variable Parameter Key']
+
+# 名前のないインデックスを列指向形式で保存するときの列名
+INDEX_COLUMN = '__index__'
+
+
+def columnar_paths(csv_path):
+    """
+    CSVファイルに対応する列指向形式のファイルパスを返す。
+
+    Args:
+        csv_path (str): CSVファイルのパス
+
+    Returns:
+        dict: 形式名 -> ファイルパス
+    """
+    base = os.path.splitext(csv_path)[0]
+    return {'parquet': base + '.parquet', 'feather': base + '.feather'}
+
+
+def resolve_path(csv_path):
+    """
+    読み込むファイルを決める。CSV以降に書き出された列指向形式のファイルがあればそれを優先する。
+
+    Args:
+        csv_path (str): CSVファイルのパス
+
+    Returns:
+        str: 読み込むファイルのパス
+    """
+    if pa is None:
+        return csv_path
+    csv_mtime = os.stat(csv_path).st_mtime_ns if os.path.exists(csv_path) else None
+    for path in columnar_paths(csv_path).values():
+        if os.path.exists(path) and (csv_mtime is None or os.stat(path).st_mtime_ns >= csv_mtime):
+            return path
+    return csv_path
+
+
+def save_table(df, csv_path, index=False, formats=None):
+    """
+    データフレームをCSVと、STORAGE_FORMATSで指定した列指向形式で保存する。
+    列指向形式ではリスト列を文字列ではなくリスト型として保存する。
+
+    Args:
+        df (pd.DataFrame): 保存するデータフレーム
+        csv_path (str): CSVファイルのパス
+        index (bool): インデックスを保存するかどうか
+        formats (list or None): 列指向形式のリスト (Noneの場合はSTORAGE_FORMATS)
+    """
+    with TableWriter(csv_path, index=index, formats=formats) as writer:
+        writer.write(df)
+
+
+def append_table(df, csv_path, index=False, formats=None):
+    """
+    既存のテーブルに行を追記する。CSVは末尾に追記し、列指向形式は既存の行と合わせて書き直す
+    (ParquetとFeatherは追記できないため)。列の順序と型は既存のテーブルに合わせること。
+
+    Args:
+        df (pd.DataFrame): 追記するデータフレーム
+        csv_path (str): CSVファイルのパス
+        index (bool): インデックスを保存するかどうか
+        formats (list or None): 列指向形式のリスト (Noneの場合はSTORAGE_FORMATS)
+    """
+    formats = list(STORAGE_FORMATS if formats is None else formats)
+    df.to_csv(csv_path, index=index, mode='a', header=False)
+    if not formats:
+        return
+    if pa is None:
+        raise ImportError("列指向形式で保存するにはpyarrowが必要です。")
+
+    paths = columnar_paths(csv_path)
+    for storage_format in formats:
+        path = paths[storage_format]
+        if storage_format == 'parquet':
+            existing = pq.read_table(path)
+        else:
+            existing = feather.read_table(path)
+        table = pa.concat_tables([existing, frame_to_table(df, index).cast(existing.schema)])
+        if storage_format == 'parquet':
+            pq.write_table(table, path)
+        else:
+            feather.write_feather(table, path, compression='uncompressed')
+
+
+class TableWriter:
+    """
+    データフレームをチャンクごとにCSVと列指向形式のファイルへ追記する。
+    列指向形式の列の型は最初のチャンクに合わせる。
+
+    Attributes:
+        csv_path (str): CSVファイルのパス
+        index (bool): インデックスを保存するかどうか
+        formats (list): 列指向形式のリスト
+    """
+
+    def __init__(self, csv_path, index=False, formats=None):
+        """
+        Args:
+            csv_path (str): CSVファイルのパス
+            index (bool): インデックスを保存するかどうか
+            formats (list or None): 列指向形式のリスト (Noneの場合はSTORAGE_FORMATS)
+        """
+        self.csv_path = csv_path
+        self.index = index
+        self.formats = list(STORAGE_FORMATS if formats is None else formats)
+        if self.formats and pa is None:
+            raise ImportError("列指向形式で保存するにはpyarrowが必要です。")
+        for storage_format in self.formats:
+            if storage_format not in ('parquet', 'feather'):
+                raise ValueError(f"未対応の保存形式です: {storage_format}")
+        self._header = True
+        self._schema = None
+        self._writers = []
+
+    def write(self, df):
+        """
+        チャンクを追記する。
+
+        Args:
+            df (pd.DataFrame): 追記するデータフレーム
+        """
+        df.to_csv(self.csv_path,
+                  index=self.index,
+                  mode='w' if self._header else 'a',
+                  header=self._header)
+        self._header = False
+        if not self.formats:
+            return
+
+        table = frame_to_table(df, self.index)
+        if self._schema is None:
+            self._schema = table.schema
+            paths = columnar_paths(self.csv_path)
+            for storage_format in self.formats:
+                if storage_format == 'parquet':
+                    self._writers.append(pq.ParquetWriter(paths['parquet'], self._schema))
+                else:
+                    # Feather (V2) はArrow IPCファイル。メモリマップで読めるように非圧縮で保存する
+                    self._writers.append(pa.ipc.new_file(paths['feather'], self._schema))
+        else:
+            table = table.cast(self._schema)
+        for writer in self._writers:
+            writer.write_table(table)
+
+    def close(self):
+        """列指向形式のファイルを閉じる。"""
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def frame_to_table(df, index=False):
+    """
+    データフレームを、リスト列をリスト型にしたArrowのテーブルに変換する。
+
+    Args:
+        df (pd.DataFrame): 変換するデータフレーム
+        index (bool): インデックスを列として含めるかどうか
+
+    Returns:
+        pa.Table: 変換したテーブル
+    """
+    if index:
+        table_df = df.reset_index(names=df.index.name or INDEX_COLUMN)
+    else:
+        table_df = df.reset_index(drop=True)
+    for column in LIST_COLUMNS:
+        if column in table_df.columns:
+            table_df[column] = parse_list_column(table_df[column])
+    return pa.Table.from_pandas(table_df, preserve_index=False)
+
+
+def load_table(csv_path, index_col=None, list_columns=None):
+    """
+    CSVまたは列指向形式のファイルからデータフレームを読み込む。
+    列指向形式はメモリマップで読み込む。
+    リスト列は、どちらの形式から読み込んでもPythonのリスト (TUPLE_COLUMNSはタプル) で返す。
+    list_columnsを指定した場合、それ以外のリスト列はCSVと同じ文字列表現で返す。
+
+    Args:
+        csv_path (str): CSVファイルのパス
+        index_col (int or None): インデックスにする列の位置 (pd.read_csvと同じ)
+        list_columns (list or None): Pythonのリストとして返す列。
+            Noneの場合はLIST_COLUMNSのうちファイルにある列
+
+    Returns:
+        pd.DataFrame: 読み込んだデータフレーム
+    """
+    path = resolve_path(csv_path)
+    if path == csv_path:
+        df = pd.read_csv(csv_path, index_col=index_col)
+        return parse_list_columns(df, list_columns)
+
+    if path.endswith('.parquet'):
+        table = pq.read_table(path, memory_map=True)
+    else:
+        table = feather.read_table(path, memory_map=True)
+    return table_to_frame(table, index_col, list_columns)
+
+
+def iter_table(csv_path, chunksize, index_col=None, list_columns=None):
+    """
+    CSVまたは列指向形式のファイルをchunksize行ずつ読み込む。
+    ファイル全体をメモリに載せずに処理するために使う。
+
+    Args:
+        csv_path (str): CSVファイルのパス
+        chunksize (int): 1チャンクの行数
+        index_col (int or None): インデックスにする列の位置 (pd.read_csvと同じ)
+        list_columns (list or None): Pythonのリストとして返す列 (load_tableを参照)
+
+    Yields:
+        pd.DataFrame: チャンク
+    """
+    path = resolve_path(csv_path)
+    if path == csv_path:
+        with pd.read_csv(csv_path, index_col=index_col, chunksize=chunksize) as reader:
+            for df in reader:
+                yield parse_list_columns(df, list_columns)
+        return
+
+    if path.endswith('.parquet'):
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize)
+    else:
+        batches = feather.read_table(path, memory_map=True).to_batches(max_chunksize=chunksize)
+    for batch in batches:
+        yield table_to_frame(pa.Table.from_batches([batch]), index_col, list_columns)
+
+
+def table_to_frame(table, index_col=None, list_columns=None):
+    """
+    Arrowのテーブルをデータフレームに変換する。
+    リスト列はlist_columnsで指定した列のみPythonのリストで返し、それ以外はCSVと同じ文字列表現にする。
+
+    Args:
+        table (pa.Table): 変換するテーブル
+        index_col (int or None): インデックスにする列の位置
+        list_columns (list or None): Pythonのリストとして返す列。Noneの場合はすべてのリスト列
+
+    Returns:
+        pd.DataFrame: 変換したデータフレーム
+    """
+    list_columns = LIST_COLUMNS if list_columns is None else list_columns
+    names = table.column_names
+    converted = {}
+    for column in LIST_COLUMNS:
+        if column in names and pa.types.is_list(table.schema.field(column).type):
+            values = table.column(column).to_pylist()
+            if column in TUPLE_COLUMNS:
+                values = [tuple(v) for v in values]
+            converted[column] = values if column in list_columns else [str(v) for v in values]
+    df = table.drop_columns(list(converted)).to_pandas()
+    for column, values in converted.items():
+        df[column] = values
+    df = df[names]
+
+    if index_col is not None:
+        df = df.set_index(df.columns[index_col])
+        if df.index.name == INDEX_COLUMN:
+            df.index.name = None
+    return df
+
+
+def parse_list_columns(df, list_columns=None):
+    """
+    CSVから読み込んだデータフレームのリスト列を、文字列表現からPythonのリストに変換する。
+
+    Args:
+        df (pd.DataFrame): 読み込んだデータフレーム
+        list_columns (list or None): 変換する列。Noneの場合はLIST_COLUMNSのうちdfにある列
+
+    Returns:
+        pd.DataFrame: 変換したデータフレーム
+    """
+    if list_columns is None:
+        list_columns = [column for column in LIST_COLUMNS if column in df.columns]
+    for column in list_columns:
+        df[column] = parse_list_column(df[column])
+    return df
+
+
+def parse_list_column(series):
+    """
+    リストの文字列表現の列をPythonのリストの列に変換する (文字列以外の値はそのまま)。
+    ast.literal_evalはユニークな値ごとに一度だけ呼ぶ。
+
+    Args:
+        series (pd.Series): 変換する列
+
+    Returns:
+        pd.Series: リストの列
+    """
+    parsed = {value: ast.literal_eval(value) for value in set(series[series.map(type) == str])}
+    return series.map(lambda value: parsed.get(value, value) if isinstance(value, str) else value)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール (const_model, light_gbm など) をimportできるようにする
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
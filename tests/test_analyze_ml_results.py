@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analyze_ml_results
+from table_store import load_table, save_table
+
+ML_RESULTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'ml_results')
+
+
+def reference_stats(df, has_time_cost=True):
+    """
+    組み合わせごとに行を抽出して統計量を計算する、以前の実装と同じ計算。
+    """
+    results = []
+    for input_value in df['Variable Parameter'].unique():
+        filtered_df = df[df['Variable Parameter'] == input_value]
+        first = filtered_df.iloc[0]
+        result = {
+            column: first[column]
+            for column in ['ML', 'loss', 'Parameter Num', 'Const Parameter',
+                           'Variable Parameter Num', 'Variable Parameter']
+        }
+        if has_time_cost:
+            result["Time Cost (s)"] = round(first["Time Cost (s)"], 5)
+        mape = filtered_df["MAPE test (%)"]
+        result.update({
+            "average MAPE test (%)": round(mape.mean(), 5),
+            "min MAPE test (%)": mape.min(),
+            "max MAPE test (%)": mape.max(),
+            "Low Mape Server": filtered_df[mape <= 10]["Leave One"].tolist(),
+            "High Mape Server": filtered_df[mape >= 20]["Leave One"].tolist(),
+        })
+        results.append(result)
+    return pd.DataFrame(results).sort_values(by="average MAPE test (%)", ascending=True)
+
+
+@pytest.mark.parametrize('data_file, has_time_cost', [
+    ('format_benchmark_parameter_loocv.csv', True),
+    ('format_spec_parameter_loocv.csv', False),
+])
+def test_stats_match_previous_output(tmp_path, data_file, has_time_cost):
+    # リスト列は以前と同じ文字列表現のまま比較する
+    df = load_table(os.path.join(ML_RESULTS_DIR, data_file), index_col=0, list_columns=[])
+    expected = reference_stats(df, has_time_cost)
+
+    actual = analyze_ml_results.calculate_stats(df, has_time_cost, extra_stats=[])
+    assert list(actual['Variable Parameter']) == list(expected['Variable Parameter'])
+    pd.testing.assert_frame_equal(actual[expected.columns].reset_index(drop=True),
+                                  expected.reset_index(drop=True), check_dtype=False)
+
+    # チャンクに分けて集計しても同じ結果になる
+    save_table(df, str(tmp_path / data_file), index=True)
+    chunked = analyze_ml_results.calculate_stats_chunked(str(tmp_path), data_file, 1000,
+                                                         has_time_cost, extra_stats=[])
+    assert [str(v) for v in chunked['Variable Parameter']] == list(expected['Variable Parameter'])
+    for column in ["average MAPE test (%)", "min MAPE test (%)", "max MAPE test (%)"]:
+        assert np.array_equal(chunked[column].to_numpy(), expected[column].to_numpy())
+
+
+def test_extra_stats_match_pandas():
+    df = load_table(os.path.join(ML_RESULTS_DIR, 'format_benchmark_parameter_loocv.csv'),
+                    index_col=0, list_columns=[])
+    actual = analyze_ml_results.calculate_stats(df, extra_stats=['median', 'std', 'p90', 'p25'])
+    actual = actual.set_index('Variable Parameter')
+    mape = df.groupby('Variable Parameter', sort=False)["MAPE test (%)"]
+    expected = {
+        "average MAPE test (%)": pd.Series({key: group.mean() for key, group in mape}),
+        "median MAPE test (%)": mape.median(),
+        "std MAPE test (%)": mape.std(),
+        "p90 MAPE test (%)": mape.quantile(0.9),
+        "p25 MAPE test (%)": mape.quantile(0.25),
+        "min MAPE test (%)": mape.min(),
+        "max MAPE test (%)": mape.max(),
+    }
+    for column, values in expected.items():
+        values = values.reindex(actual.index).round(5)
+        assert np.array_equal(actual[column].round(5).to_numpy(), values.to_numpy()), column
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+
+import const_model
+import light_gbm as lgb_reg
+from format_mldata import load_dataset
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+def train_fold(data_file, server_parameters, server):
+    """
+    同梱のデータで1つのfoldのモデルを学習し、モデルとテストデータの入力行列を返す。
+    """
+    dataset = load_dataset(os.path.join(DATA_DIR, data_file))
+    matrix = dataset.feature_matrix(const_model.target)
+    parameters = const_model.const_parameters + server_parameters
+    model, _, _, _ = lgb_reg.train_lgb_rows(matrix, dataset.train_indices[server], parameters,
+                                            {'num_threads': 1})
+    return model, matrix, matrix.take(dataset.test_indices[server], parameters)
+
+
+# 同梱のスペックデータのgpu_architectureは数値に変換済みのため、
+# カテゴリ列 (ダミー列にエンコードされる列) として Model Name を加える
+@pytest.mark.parametrize('data_file, server_parameters, categorical', [
+    (const_model.benchmark_data_file, ['transfer_all', 'matrix_dot'], None),
+    (const_model.server_spec_data_file, ['gpu_architecture', 'gpu_core', 'Model Name'],
+     'Model Name'),
+])
+def test_native_contributions_match_shap(data_file, server_parameters, categorical):
+    pytest.importorskip('shap')
+    model, matrix, X = train_fold(data_file, server_parameters, const_model.SERVER_LIST[0])
+    if categorical is not None:
+        # カテゴリ特徴量はダミー列としてモデルに入る
+        assert categorical in matrix.categories
+
+    native = lgb_reg.feature_contributions(model, X, 'native')
+    reference = lgb_reg.feature_contributions(model, X, 'shap')
+
+    assert native.shape == X.shape
+    assert np.allclose(native, reference)
+    assert lgb_reg.compare_attribution_backends(model, X)['Max Rel Diff'] < 1e-6
+
+
+def test_unknown_backend():
+    model, _, X = train_fold(const_model.benchmark_data_file, ['transfer_all'],
+                             const_model.SERVER_LIST[0])
+    with pytest.raises(ValueError):
+        lgb_reg.feature_contributions(model, X, 'unknown')
@@ -0,0 +1,34 @@
+import const_model
+import hyperparameter_search
+
+
+def test_shuffle_servers_is_seeded_permutation():
+    servers = const_model.SERVER_LIST
+    order = hyperparameter_search.shuffle_servers(servers, 0)
+
+    assert sorted(order) == sorted(servers)
+    assert order == hyperparameter_search.shuffle_servers(servers, 0)
+    assert order != hyperparameter_search.shuffle_servers(servers, 1)
+
+
+def test_successive_halving_reuses_fold_prefix(monkeypatch):
+    rungs = []
+
+    def evaluate_trials(trials, server_parameters, data_path, servers, **kwargs):
+        rungs.append(list(servers))
+        return [float(i) for i in range(len(trials))]
+
+    def record_trials(trials, mapes, server_parameters, data_path, servers, strategy, rung, store):
+        return [{'Params': trial, 'Fold Num': len(servers)} for trial in trials]
+
+    monkeypatch.setattr(hyperparameter_search, 'evaluate_trials', evaluate_trials)
+    monkeypatch.setattr(hyperparameter_search, 'record_trials', record_trials)
+    best, _ = hyperparameter_search.successive_halving(['transfer_all'], 'data.csv', n_trials=9,
+                                                       seed=0, eta=3, min_folds=3)
+
+    assert [len(servers) for servers in rungs] == [3, 9, len(const_model.SERVER_LIST)]
+    assert rungs[-1] == hyperparameter_search.shuffle_servers(const_model.SERVER_LIST, 0)
+    for short, long in zip(rungs, rungs[1:]):
+        assert long[:len(short)] == short
+    assert rungs[0] != const_model.SERVER_LIST[:3]
+    assert best['Fold Num'] == len(const_model.SERVER_LIST)
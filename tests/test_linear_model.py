@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+import const_model
+import linear_model
+from format_mldata import load_dataset
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', const_model.benchmark_data_file)
+
+PARAMETERS_CONBS = [[], ['transfer_all'], ['matrix_dot'], ['transfer_all', 'matrix_dot'],
+                    ['matrix_conv', 'matrix_dot']]
+SERVERS = const_model.SERVER_LIST[:4]
+
+
+def reference_ridge(X, y, alpha):
+    """
+    学習データで標準化した特徴量のリッジ回帰 (定数項は正則化しない) を、
+    np.linalg.lstsqで拡大した最小二乗問題として解く。
+    """
+    means = X.mean(axis=0)
+    scales = X.std(axis=0)
+    scales[scales == 0] = 1.0
+    standardized = (X - means) / scales
+    A = np.vstack([standardized, np.sqrt(alpha) * np.eye(X.shape[1])])
+    b = np.concatenate([y - y.mean(), np.zeros(X.shape[1])])
+    w = np.linalg.lstsq(A, b, rcond=None)[0] / scales
+    return w, y.mean() - means @ w
+
+
+@pytest.mark.parametrize('alpha', [linear_model.RIDGE_ALPHA, 1e-3])
+def test_linear_loocv_matches_lstsq(alpha):
+    results = linear_model.linear_loocv(const_model.const_parameters, PARAMETERS_CONBS, DATA_PATH,
+                                        SERVERS, const_model.target, alpha)
+    dataset = load_dataset(DATA_PATH)
+    matrix = dataset.feature_matrix(const_model.target)
+    y = matrix.target
+
+    expected = []
+    for conb in PARAMETERS_CONBS:
+        X = matrix.values[:, matrix.column_indices(const_model.const_parameters + conb)].astype(
+            np.float64)
+        for server in SERVERS:
+            train_rows = dataset.train_indices[server]
+            test_rows = dataset.test_indices[server]
+            w, intercept = reference_ridge(X[train_rows], y[train_rows], alpha)
+            mapes = [
+                np.abs((y[rows] - (X[rows] @ w + intercept)) / y[rows]).mean() * 100
+                for rows in (train_rows, test_rows)
+            ]
+            expected.append((conb, server, *mapes))
+
+    assert [(r['Variable Parameter'], r['Leave One']) for r in results] == [
+        (conb, server) for conb, server, _, _ in expected]
+    assert [r['MAPE train (%)'] for r in results] == pytest.approx(
+        [mape_train for _, _, mape_train, _ in expected], rel=1e-6, abs=1e-4)
+    assert [r['MAPE test (%)'] for r in results] == pytest.approx(
+        [mape_test for _, _, _, mape_test in expected], rel=1e-6, abs=1e-4)
@@ -0,0 +1,111 @@
+import os
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pytest
+
+import const_model
+import model_registry
+from format_mldata import load_dataset
+from model_registry import ModelRegistry
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', const_model.benchmark_data_file)
+
+SERVER_PARAMETERS = ['transfer_all', 'matrix_dot']
+
+
+class FakeClock:
+    """呼ばれるたびに1秒進む時計 (最終使用時刻の順序を確定させる)。"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'time', FakeClock())
+    registry = ModelRegistry(str(tmp_path / 'models'))
+    yield registry
+    registry.close()
+
+
+def train_model(seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(200, 3))
+    y = X @ np.array([1.0, -2.0, 0.5]) + rng.normal(scale=0.1, size=200)
+    return lgb.train({'verbose': -1, 'num_threads': 1}, lgb.Dataset(X, y), num_boost_round=10)
+
+
+def test_registry_round_trip(registry):
+    model = train_model(0)
+    registry.put('a', model, {'MAPE test (%)': 1.5})
+    loaded, metrics = registry.get('a')
+    assert metrics == {'MAPE test (%)': 1.5}
+    X = np.random.default_rng(1).normal(size=(5, 3))
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X))
+    assert registry.get('a', load_model=False) == (None, metrics)
+    assert registry.get('missing') is None
+
+
+def test_registry_prunes_least_recently_used(registry):
+    for i, key in enumerate(['a', 'b', 'c']):
+        registry.put(key, train_model(i), {'index': i})
+    sizes = {entry['key']: entry['size'] for entry in registry.entries()}
+
+    # 'a' を使うと、最後に使われた時刻が最も古いのは 'b' になる
+    assert registry.get('a') is not None
+    registry.max_bytes = sizes['a'] + sizes['c'] + sizes['b'] // 2
+    registry.put('c', train_model(2), {'index': 2})
+
+    assert [entry['key'] for entry in registry.entries()] == ['c', 'a']
+    assert registry.get('b') is None
+    assert not os.path.exists(registry.model_path('b'))
+    assert registry.total_bytes() <= registry.max_bytes
+
+
+def test_registry_drops_missing_model_file(registry):
+    registry.put('a', train_model(0), {})
+    os.remove(registry.model_path('a'))
+    assert registry.get('a') is None
+    assert registry.entries() == []
+
+
+def test_fold_model_key_invalidation(tmp_path):
+    df = pd.read_csv(DATA_PATH, index_col=0)
+    data_path = str(tmp_path / 'data.csv')
+    df.to_csv(data_path)
+    dataset = load_dataset(data_path)
+    parameters = const_model.const_parameters + SERVER_PARAMETERS
+    server = const_model.SERVER_LIST[0]
+    key = const_model.fold_model_key(dataset, parameters, server, {'num_threads': 1})
+
+    # 学習結果に影響しない引数ではキーは変わらない
+    assert key == const_model.fold_model_key(dataset, parameters, server, {'num_threads': 4})
+    assert key == const_model.fold_model_key(dataset, parameters, server, None)
+    # 学習結果に影響する引数ではキーが変わる
+    other_keys = [
+        const_model.fold_model_key(dataset, parameters[:-1], server, None),
+        const_model.fold_model_key(dataset, parameters, const_model.SERVER_LIST[1], None),
+        const_model.fold_model_key(dataset, parameters, server, {'num_leaves': 7}),
+        const_model.fold_model_key(dataset, parameters, server, None, parameters),
+        const_model.fold_model_key(dataset, parameters, server, None, init_key=key),
+    ]
+    assert len(set(other_keys + [key])) == len(other_keys) + 1
+
+    # 使用しない列を変更してもキーは変わらないが、使用する列を変更すると変わる
+    unused = next(c for c in df.columns
+                  if c not in parameters + ['Server Info', const_model.target])
+    df[unused] = 0
+    df.to_csv(data_path)
+    os.utime(data_path, ns=(0, 0))
+    assert key == const_model.fold_model_key(load_dataset(data_path), parameters, server, None)
+
+    df.loc[df.index[0], SERVER_PARAMETERS[0]] += 1
+    df.to_csv(data_path)
+    os.utime(data_path, ns=(1, 1))
+    assert key != const_model.fold_model_key(load_dataset(data_path), parameters, server, None)
@@ -0,0 +1,101 @@
+import http.client
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import const_model
+import prediction_service
+from prediction_service import make_handler, train_service
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+@pytest.fixture(scope='module')
+def service():
+    return train_service(['transfer_all', 'matrix_dot'],
+                         os.path.join(DATA_DIR, const_model.benchmark_data_file),
+                         {'num_threads': 1})
+
+
+@pytest.fixture(scope='module')
+def server(service):
+    """
+    予測サービスを空いているポートで起動し、(ホスト, ポート) を返す。
+    """
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(server, body, path='/predict', headers=None):
+    """
+    リクエストを送り、(ステータスコード, レスポンスのJSON) を返す。
+    """
+    conn = http.client.HTTPConnection(*server, timeout=10)
+    try:
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        conn.request('POST', path, payload, headers or {})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_predict(server, service):
+    n = len(service.parameters)
+    status, body = post(server, {'data': [[1.0] * n, [2.0] * n]})
+    assert status == 200
+    assert len(body['predictions']) == 2
+
+    row = {p: 1.0 for p in service.parameters}
+    status, body = post(server, {'rows': [row]})
+    assert status == 200
+    assert body['predictions'][0] == pytest.approx(service.predict_one(row))
+
+
+@pytest.mark.parametrize('body', [
+    {'data': 5},
+    {'data': [[[1.0, 2.0]]]},
+    {'data': [1.0, 2.0]},
+    {'data': [[1.0], [1.0, 2.0]]},
+    {'data': 'abc'},
+    {'data': None},
+    {'rows': [{'transfer_all': 1.0}]},
+    {'rows': [{}, 5]},
+    {'values': [[1.0]]},
+    [[1.0, 2.0]],
+    5,
+    'abc',
+    None,
+    b'{not json',
+    b'\xff\xfe',
+])
+def test_bad_payload(server, body):
+    status, response = post(server, body)
+    assert status == 400
+    assert 'error' in response
+
+
+def test_bad_content_length(server):
+    status, _ = post(server, b'', headers={'Content-Length': 'abc'})
+    assert status == 400
+
+
+def test_request_too_large(server, monkeypatch):
+    monkeypatch.setattr(prediction_service, 'MAX_REQUEST_BYTES', 4)
+    status, _ = post(server, {'data': [[1.0]]})
+    assert status == 413
+
+
+def test_unknown_path(server):
+    status, _ = post(server, {'data': [[1.0]]}, path='/unknown')
+    assert status == 404
+    # エラーの後も同じサーバーで予測できる
+    status, _ = post(server, {'data': 5})
+    assert status == 400
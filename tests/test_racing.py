@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+import const_model
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', const_model.benchmark_data_file)
+
+# 平均MAPE test (%) が大きく異なる組み合わせ (良い方を先に評価する)
+PARAMETERS_CONBS = [['matrix_conv'], ['transfer_all']]
+SERVERS = const_model.SERVER_LIST[:6]
+LGB_PARAMS = {'num_threads': 1}
+
+
+def fold_mapes(results, server_parameters):
+    return [r['MAPE test (%)'] for r in results if r['Variable Parameter'] == server_parameters]
+
+
+def test_mape_lower_bound():
+    mapes = [10.0, 12.0, 14.0]
+    assert const_model.mape_lower_bound(mapes[:1], 6) == -float('inf')
+    assert const_model.mape_lower_bound(mapes, 6) < np.mean(mapes)
+    # すべてのfoldを評価した場合は平均そのもの
+    assert const_model.mape_lower_bound(mapes, 3) == pytest.approx(np.mean(mapes))
+
+
+def test_race_matches_exhaustive_search():
+    exhaustive = const_model.search_parameters_conb(PARAMETERS_CONBS, DATA_PATH,
+                                                    lgb_params=LGB_PARAMS, servers=SERVERS)
+    good, bad = [fold_mapes(exhaustive, conb) for conb in PARAMETERS_CONBS]
+    assert np.mean(good) < np.mean(bad)
+    threshold = (np.mean(good) + np.mean(bad)) / 2
+
+    raced = const_model.search_parameters_conb(PARAMETERS_CONBS, DATA_PATH,
+                                               lgb_params=LGB_PARAMS, servers=SERVERS,
+                                               race_threshold=threshold)
+    truncated = {tuple(r['Variable Parameter']): r['Truncated'] for r in raced}
+    assert truncated == {tuple(PARAMETERS_CONBS[0]): False, tuple(PARAMETERS_CONBS[1]): True}
+
+    # 打ち切られなかった組み合わせは全探索と同じ結果
+    assert fold_mapes(raced, PARAMETERS_CONBS[0]) == pytest.approx(good)
+    # 打ち切られた組み合わせは全探索の先頭のfoldのみで、下側信頼限界が閾値を超えている
+    raced_bad = fold_mapes(raced, PARAMETERS_CONBS[1])
+    assert const_model.RACE_MIN_FOLDS <= len(raced_bad) < len(SERVERS)
+    assert raced_bad == pytest.approx(bad[:len(raced_bad)])
+    assert const_model.mape_lower_bound(raced_bad, len(SERVERS)) > threshold
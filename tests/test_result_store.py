@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import const_model
+from format_mldata import load_dataset
+from result_store import ResultStore, fold_key
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', const_model.benchmark_data_file)
+
+PARAMETERS_CONBS = [['transfer_all'], ['matrix_dot']]
+SERVERS = const_model.SERVER_LIST[:3]
+LGB_PARAMS = {'num_threads': 1}
+
+
+@pytest.fixture
+def fold_calls(monkeypatch):
+    """
+    const_model.evaluate_foldで学習したfoldの (特徴量の組み合わせ, サーバー名) を記録するリストを返す。
+    """
+    calls = []
+    evaluate_fold = const_model.evaluate_fold
+
+    def counting_evaluate_fold(const_parameters, server_parameters, server, *args, **kwargs):
+        calls.append((tuple(server_parameters), server))
+        return evaluate_fold(const_parameters, server_parameters, server, *args, **kwargs)
+
+    monkeypatch.setattr(const_model, 'evaluate_fold', counting_evaluate_fold)
+    return calls
+
+
+def search(store):
+    return const_model.search_parameters_conb(PARAMETERS_CONBS, DATA_PATH, store=store,
+                                              lgb_params=LGB_PARAMS, servers=SERVERS)
+
+
+def test_store_round_trip(tmp_path):
+    db_path = str(tmp_path / 'results.sqlite')
+    store = ResultStore(db_path)
+    keys = [f'key{i}' for i in range(1200)]
+    for i, key in enumerate(keys):
+        store.put(key, {'MAPE test (%)': float(i)})
+    store.put('key0', {'MAPE test (%)': -1.0})
+    store.close()
+
+    # 開き直しても保存済みの結果を読み込める (プレースホルダ数の上限を超える数のキーも含む)
+    store = ResultStore(db_path)
+    done = store.get_many(keys + ['missing'])
+    store.close()
+    assert len(done) == len(keys)
+    assert done['key0'] == {'MAPE test (%)': -1.0}
+    assert done['key1199'] == {'MAPE test (%)': 1199.0}
+
+
+def test_fold_key_ignores_num_threads():
+    key = fold_key(['a', 'b'], 'server', {'num_threads': 1}, 'v1')
+    assert key == fold_key(['a', 'b'], 'server', {'num_threads': 8, 'verbose': -1}, 'v1')
+    assert key != fold_key(['a', 'b'], 'server', {'num_threads': 1, 'num_leaves': 7}, 'v1')
+    assert key != fold_key(['a', 'b'], 'other', {'num_threads': 1}, 'v1')
+    assert key != fold_key(['a', 'b'], 'server', {'num_threads': 1}, 'v2')
+
+
+def test_search_resumes_from_store(tmp_path, fold_calls):
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    first = search(store)
+    assert len(fold_calls) == len(PARAMETERS_CONBS) * len(SERVERS)
+
+    # 保存済みのfoldはすべて読み飛ばし、同じ結果を返す
+    fold_calls.clear()
+    second = search(store)
+    assert fold_calls == []
+    assert [r['MAPE test (%)'] for r in second] == [r['MAPE test (%)'] for r in first]
+
+    # 途中で止まった場合に相当する、保存されていないfoldだけを評価し直す
+    dataset = load_dataset(DATA_PATH)
+    parameters = const_model.const_parameters + PARAMETERS_CONBS[1]
+    missing = SERVERS[-1]
+    key = const_model.fold_model_key(dataset, parameters, missing, LGB_PARAMS)
+    store.conn.execute('DELETE FROM results WHERE key = ?', (key,))
+    store.conn.commit()
+    fold_calls.clear()
+    third = search(store)
+    store.close()
+    assert fold_calls == [(tuple(PARAMETERS_CONBS[1]), missing)]
+    assert [r['MAPE test (%)'] for r in third] == pytest.approx(
+        [r['MAPE test (%)'] for r in first])
@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import table_store
+
+
+@pytest.mark.parametrize('formats', [[], ['parquet'], ['feather']])
+def test_load_table_returns_lists(tmp_path, formats):
+    if formats:
+        pytest.importorskip('pyarrow')
+    df = pd.DataFrame({
+        'Variable Parameter': [['T_SLT'], ['T_SLT', 'T_SMO']],
+        'Variable Parameter Key': [('T_SLT',), ('T_SLT', 'T_SMO')],
+        'MAPE test (%)': [1.5, 2.5],
+    })
+    csv_path = str(tmp_path / 'results.csv')
+    table_store.save_table(df, csv_path, formats=formats)
+
+    loaded = table_store.load_table(csv_path)
+    assert loaded['Variable Parameter'].tolist() == [['T_SLT'], ['T_SLT', 'T_SMO']]
+    assert loaded['Variable Parameter Key'].tolist() == [('T_SLT',), ('T_SLT', 'T_SMO')]
+    assert loaded['MAPE test (%)'].tolist() == [1.5, 2.5]
+
+    # 列を指定した場合、それ以外のリスト列はCSVと同じ文字列表現で返す
+    loaded = table_store.load_table(csv_path, list_columns=['Variable Parameter'])
+    assert loaded['Variable Parameter'].tolist() == [['T_SLT'], ['T_SLT', 'T_SMO']]
+    assert loaded['Variable Parameter Key'].tolist() == ["('T_SLT',)", "('T_SLT', 'T_SMO')"]
+
+    chunks = list(table_store.iter_table(csv_path, 1))
+    assert [chunk['Variable Parameter'].iloc[0] for chunk in chunks] == [['T_SLT'],
+                                                                          ['T_SLT', 'T_SMO']]
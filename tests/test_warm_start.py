@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import const_model
+import light_gbm as lgb_reg
+from format_mldata import load_dataset
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+SERVER_PARAMETERS = ['transfer_all', 'matrix_dot']
+
+
+def test_split_rows_keeps_init_split():
+    rows = np.arange(100)
+    init_rows = np.arange(0, 100, 2)
+    init_train, init_val = lgb_reg.split_rows(init_rows)
+    train_rows, val_rows = lgb_reg.split_rows(rows, init_rows=init_rows)
+
+    assert set(init_train) <= set(train_rows)
+    assert set(init_val) <= set(val_rows)
+    assert sorted(np.concatenate([train_rows, val_rows])) == list(rows)
+    with pytest.raises(ValueError):
+        lgb_reg.split_rows(init_rows, init_rows=rows)
+
+
+@pytest.fixture
+def onboarding(tmp_path, monkeypatch):
+    """
+    同梱のデータから最後のサーバーを除いたデータを作り、そのサーバーの行を追記する関数を返す。
+    """
+    monkeypatch.setattr(const_model, 'output_dir', str(tmp_path))
+    monkeypatch.setattr(const_model, 'MODEL_REGISTRY_DIR', 'models')
+    monkeypatch.setattr(const_model, '_model_registries', {})
+    df = pd.read_csv(os.path.join(DATA_DIR, const_model.benchmark_data_file), index_col=0)
+    new_server = const_model.SERVER_LIST[-1]
+    data_path = str(tmp_path / 'data.csv')
+    df[df['Server Info'] != new_server].to_csv(data_path)
+
+    def update_data():
+        df[df['Server Info'] == new_server].to_csv(data_path, mode='a', header=False)
+        # 書き込みが同じ時刻に収まっても読み込み直すように、更新時刻を変える
+        os.utime(data_path, ns=(0, 0))
+
+    return data_path, update_data
+
+
+def test_warm_start_keeps_old_training_rows(onboarding):
+    data_path, update_data = onboarding
+    server = const_model.SERVER_LIST[0]
+    lgb_params = {'num_threads': 1}
+    parameters = const_model.const_parameters + SERVER_PARAMETERS
+
+    const_model.evaluate_fold(const_model.const_parameters, SERVER_PARAMETERS, server, data_path,
+                              lgb_params)
+    old_dataset = load_dataset(data_path)
+    init_key = const_model.fold_model_key(old_dataset, parameters, server, lgb_params)
+    old_train, old_val = lgb_reg.split_rows(old_dataset.train_indices[server])
+
+    update_data()
+    dataset = load_dataset(data_path)
+    assert len(dataset.df) > len(old_dataset.df)
+    registry = const_model.get_model_registry()
+    matrix = dataset.feature_matrix(const_model.target)
+    init = const_model.get_init_model(registry, init_key, len(matrix.column_indices(parameters)),
+                                      dataset.train_indices[server])
+    assert init is not None
+    init_model, init_rows = init
+    assert np.array_equal(init_rows, old_dataset.train_indices[server])
+
+    train_rows, val_rows = lgb_reg.split_rows(dataset.train_indices[server], init_rows=init_rows)
+    # 前のモデルの学習データは検証データに入らない
+    assert set(old_train) <= set(train_rows)
+    assert not set(old_train) & set(val_rows)
+    assert set(old_val) <= set(val_rows)
+
+    warm = const_model.evaluate_fold(const_model.const_parameters, SERVER_PARAMETERS, server,
+                                     data_path, lgb_params, init_key=init_key)
+    scratch = const_model.evaluate_fold(const_model.const_parameters, SERVER_PARAMETERS, server,
+                                        data_path, lgb_params)
+    for name in ('MAPE train (%)', 'MAPE val (%)', 'MAPE test (%)'):
+        assert np.isfinite(warm[name])
+        assert np.isfinite(scratch[name])
+    # 学習を続けたモデルは、最初から学習したモデルと同程度の精度になる
+    assert warm['MAPE test (%)'] == pytest.approx(scratch['MAPE test (%)'], rel=0.1)
+    # 学習を続けたモデルは、最初から学習したモデルとは別のキーで保存される
+    warm_key = const_model.fold_model_key(dataset, parameters, server, lgb_params,
+                                          init_key=init_key)
+    scratch_key = const_model.fold_model_key(dataset, parameters, server, lgb_params)
+    assert registry.get(warm_key, load_model=False) is not None
+    assert registry.get(scratch_key, load_model=False) is not None
+
+
+def test_warm_start_requires_reproducible_split(onboarding):
+    data_path, update_data = onboarding
+    server = const_model.SERVER_LIST[0]
+    lgb_params = {'num_threads': 1}
+    parameters = const_model.const_parameters + SERVER_PARAMETERS
+
+    const_model.evaluate_fold(const_model.const_parameters, SERVER_PARAMETERS, server, data_path,
+                              lgb_params)
+    old_dataset = load_dataset(data_path)
+    init_key = const_model.fold_model_key(old_dataset, parameters, server, lgb_params)
+    update_data()
+    dataset = load_dataset(data_path)
+    registry = const_model.get_model_registry()
+    n_features = len(dataset.feature_matrix(const_model.target).column_indices(parameters))
+
+    # 前のモデルの学習データが先頭の行に含まれない場合は学習を続けない
+    rows = dataset.train_indices[server][1:]
+    assert const_model.get_init_model(registry, init_key, n_features, rows) is None
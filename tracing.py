@@ -0,0 +1,258 @@
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+# 計測を有効にするかどうか (enableで切り替える。無効の場合、spanは何もしない)
+_enabled = False
+# このプロセスで記録した区間 (name, start_ns, duration_ns, pid, tid, depth, args)
+_events = []
+# 開いている区間の入れ子の深さ
+_depth = [0]
+
+
+class _Span:
+    """計測区間。with文の開始から終了までの時間を記録する。"""
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        _depth[0] += 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter_ns() - self.start
+        _depth[0] -= 1
+        _events.append((self.name, self.start, duration, os.getpid(), threading.get_native_id(),
+                        _depth[0], self.args))
+        return False
+
+
+class _NullSpan:
+    """計測が無効の場合の区間。何も記録しない。"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(enabled=True):
+    """
+    計測を有効 (または無効) にする。
+
+    Args:
+        enabled (bool): 有効にする場合True
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    """
+    Returns:
+        bool: 計測が有効な場合True
+    """
+    return _enabled
+
+
+def span(name, **args):
+    """
+    with文で囲んだ区間の時間を記録する。計測が無効の場合は何もしない区間を返す。
+
+    Args:
+        name (str): 区間の名前 (フェーズ名)
+        **args: Chromeのトレースに付ける情報 (サーバー名など)
+
+    Returns:
+        コンテキストマネージャ
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def traced(name):
+    """
+    関数の呼び出しを区間として記録するデコレータ。計測が無効の場合はそのまま呼び出す。
+
+    Args:
+        name (str): 区間の名前
+
+    Returns:
+        callable: デコレータ
+    """
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name, start_ns, end_ns, **args):
+    """
+    開始・終了時刻 (time.perf_counter_ns) を指定して区間を記録する。
+
+    Args:
+        name (str): 区間の名前
+        start_ns (int): 開始時刻
+        end_ns (int): 終了時刻
+        **args: Chromeのトレースに付ける情報
+    """
+    if _enabled:
+        _events.append((name, start_ns, end_ns - start_ns, os.getpid(),
+                        threading.get_native_id(), _depth[0], args))
+
+
+class LgbPhases:
+    """
+    lgb.trainの開始から最初のイテレーションまで (Datasetの構築) と、それ以降 (学習) を
+    別の区間として記録するLightGBMのコールバック。lgb.trainの直前に作り、直後にfinishを呼ぶ。
+    """
+    before_iteration = True
+    order = 0
+
+    def __init__(self, name_prefix='lgb'):
+        """
+        Args:
+            name_prefix (str): 区間の名前の接頭辞
+        """
+        self.name_prefix = name_prefix
+        self.start = time.perf_counter_ns()
+        self.boost_start = None
+
+    def __call__(self, env):
+        if self.boost_start is None:
+            self.boost_start = time.perf_counter_ns()
+            record(f'{self.name_prefix}.Dataset', self.start, self.boost_start)
+
+    def finish(self):
+        """学習の区間を記録する。"""
+        record(f'{self.name_prefix}.boost', self.boost_start or self.start, time.perf_counter_ns())
+
+
+def lgb_phases():
+    """
+    計測が有効な場合、lgb.trainのフェーズを記録するコールバックを返す。
+
+    Returns:
+        LgbPhases or None: コールバック。計測が無効の場合はNone
+    """
+    if not _enabled:
+        return None
+    return LgbPhases()
+
+
+def drain():
+    """
+    このプロセスで記録した区間を取り出して消去する (ワーカーから親プロセスに送るため)。
+
+    Returns:
+        list: 区間のリスト
+    """
+    events = list(_events)
+    del _events[:len(events)]
+    return events
+
+
+def merge(events):
+    """
+    ワーカープロセスで記録した区間をこのプロセスの記録に加える。
+
+    Args:
+        events (list): drainで取り出した区間のリスト
+    """
+    _events.extend(events)
+
+
+def clear():
+    """記録した区間を消去する。"""
+    del _events[:]
+
+
+def export_chrome_trace(output_path):
+    """
+    記録した区間をChromeのトレース形式 (chrome://tracing, Perfettoで表示できるJSON) で保存する。
+
+    Args:
+        output_path (str): 出力するJSONファイルのパス
+    """
+    origin = min((event[1] for event in _events), default=0)
+    trace_events = [{
+        'name': name,
+        'ph': 'X',
+        'ts': (start - origin) / 1000,
+        'dur': duration / 1000,
+        'pid': pid,
+        'tid': tid,
+        'args': args,
+    } for name, start, duration, pid, tid, _, args in _events]
+    for pid in sorted({event[3] for event in _events}):
+        label = 'main' if pid == os.getpid() else f'worker {pid}'
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                             'args': {'name': label}})
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+    print(f"Trace has been written to {output_path}")
+
+
+def summary():
+    """
+    フェーズごとの回数と時間の集計表を作る (全プロセスの合計)。
+
+    Returns:
+        pd.DataFrame: Phase, Count, Total (s), Mean (ms), Max (ms), Share (%) の表 (合計時間の降順)。
+            Share (%) は最上位 (入れ子でない) の区間の合計時間に対する割合
+    """
+    columns = ['Phase', 'Count', 'Total (s)', 'Mean (ms)', 'Max (ms)', 'Share (%)']
+    if not _events:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame([(event[0], event[2], event[5]) for event in _events],
+                      columns=['Phase', 'ns', 'depth'])
+    top_level_ns = df.loc[df['depth'] == 0, 'ns'].sum() or df['ns'].sum()
+    table = df.groupby('Phase', sort=False)['ns'].agg(['count', 'sum', 'mean', 'max'])
+    table = pd.DataFrame({
+        'Phase': table.index,
+        'Count': table['count'].to_numpy(),
+        'Total (s)': (table['sum'] / 1e9).round(4).to_numpy(),
+        'Mean (ms)': (table['mean'] / 1e6).round(4).to_numpy(),
+        'Max (ms)': (table['max'] / 1e6).round(4).to_numpy(),
+        'Share (%)': (table['sum'] / top_level_ns * 100).round(2).to_numpy(),
+    })
+    return table.sort_values(by='Total (s)', ascending=False, ignore_index=True)
+
+
+def finish(output_path):
+    """
+    記録した区間をChromeのトレースとして保存し、フェーズごとの集計表を表示・CSVに保存する。
+
+    Args:
+        output_path (str): 出力するJSONファイルのパス (集計表は拡張子を.csvにしたパス)
+    """
+    export_chrome_trace(output_path)
+    table = summary()
+    print(table.to_string(index=False))
+    summary_path = os.path.splitext(output_path)[0] + '.csv'
+    table.to_csv(summary_path, index=False)
+    print(f"Trace summary has been written to {summary_path}")
@@ -1,22 +1,27 @@
 import ast
 import os
+import sys
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 from matplotlib.ticker import MaxNLocator  # MaxNLocatorをインポート
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from table_store import load_table  # noqa: E402
+
 csv_file = 'soturon_shap_graph.csv'
 data_dir = '../mlresults_analyze'
 
 # 入力ファイルのパスを設定
 csv_path = os.path.join(data_dir, csv_file)
 
-# データを読み込む
-df = pd.read_csv(csv_path)
+# データを読み込む (Variable Parameterはリストとして読み込む)
+df = load_table(csv_path)
 
-# ユニークなVariable Parameterの抽出
-unique_inputs = df['Variable Parameter'].unique()
+# ユニークなVariable Parameterの抽出 (リストはハッシュできないためタプルにする)
+input_codes, unique_inputs = pd.factorize(df['Variable Parameter'].map(tuple))
 
 # "Leave One" 列の値を修正（正規表現を使用）
 df["Leave One"] = df["Leave One"].replace(
@@ -58,9 +63,9 @@ if not os.path.exists(output_dir):
 # 1週目と2週目のPNGを保存するためのカウント
 roop_counter = 1
 
-for inputs in unique_inputs:
+for input_code, inputs in enumerate(unique_inputs):
     # Variable Parameterに基づいてフィルタリング
-    filtered_df = df[df['Variable Parameter'] == inputs]
+    filtered_df = df[input_codes == input_code]
 
     # SHAPの値をリストから辞書として解析
     filtered_df['SHAP Value'] = filtered_df['SHAP Value'].apply(lambda x: ast.literal_eval(x))
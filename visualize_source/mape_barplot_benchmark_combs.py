@@ -1,9 +1,15 @@
 import os
+import sys
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parameter_mask import MASK_COLUMN, matches_any, parameter_mask, parameter_masks  # noqa: E402
+from table_store import load_table  # noqa: E402
+
 # パラメータリスト
 PARAMETER_LISTS = [['T_MCO', 'T_SMO', 'T_MAO'], ['T_BST', 'T_MCO', 'T_SAO']]
 
@@ -46,9 +52,9 @@ def load_data(data_dir, csv_file):
         pd.DataFrame: 読み込んだデータフレーム。
     """
     csv_path = os.path.join(data_dir, csv_file)
-    df = pd.read_csv(csv_path)
-    # Variable Parameter列をリスト形式に変換
-    df['Variable Parameter'] = df['Variable Parameter'].apply(eval)
+    df = load_table(csv_path)
+    # 特徴量の組み合わせのビットマスク (古い結果には列がないため計算する)
+    df[MASK_COLUMN] = parameter_masks(df)
     return df
 
 
@@ -62,14 +68,8 @@ def filter_by_parameter(df):
     Returns:
         pd.DataFrame: フィルタリング後のデータフレーム。
     """
-
-    def match_parameter(param):
-        for parameter_list in PARAMETER_LISTS:
-            if set(param) == set(parameter_list):
-                return True
-        return False
-
-    return df[df['Variable Parameter'].apply(match_parameter)]
+    # PARAMETER_LISTSのいずれかと順不同で一致する行をビットマスクで抽出
+    return df[matches_any(df[MASK_COLUMN].to_numpy(), PARAMETER_LISTS)]
 
 
 def to_latex_subscript(parameter):
@@ -102,7 +102,9 @@ def prepare_data(df):
     Returns:
         pd.DataFrame: 変換後のデータフレーム。
     """
-    df['Benchmark Combinations'] = df['Variable Parameter'].apply(lambda x: get_label(x))
+    # ビットマスクからPARAMETER_LISTSの並び順のラベルを引く
+    labels = {parameter_mask(param_list): get_label(param_list) for param_list in PARAMETER_LISTS}
+    df['Benchmark Combinations'] = df[MASK_COLUMN].map(labels)
     return df
 
 
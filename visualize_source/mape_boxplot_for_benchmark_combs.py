@@ -5,6 +5,11 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parameter_mask import MASK_COLUMN, matches_any, parameter_mask, parameter_masks  # noqa: E402
+from table_store import load_table  # noqa: E402
+
 # LOO方式のMAPEを箱ひげ図で評価
 PARAMETER_LISTS = [["T_MCO", "T_SMO", "T_MAO"], ["T_MCO", "T_MAO"], ["T_MCO"],
                    ["T_BST", "T_MCO", "T_SAO"], ["T_BST", "T_MCO", "T_MMO", "T_SAO", "T_MAO"],
@@ -23,19 +28,11 @@ def main():
     # データの読み込み
     df = load_data(data_dir, data_file)
 
-    # Variable Parameter をリスト形式に変換
-    df['Variable Parameter'] = df['Variable Parameter'].apply(eval)
-
-    # PARAMETER_LISTSの要素に一致する行をフィルタリング
-    def filter_by_parameter(param):
-        # paramがリストであり、PARAMETER_LISTSの任意のリストと一致するかを確認
-        for parameter_list in PARAMETER_LISTS:
-            # paramがparameter_listと完全一致するかをチェック
-            if set(param) == set(parameter_list):
-                return True
-        return False
+    # 特徴量の組み合わせのビットマスク (古い結果には列がないため計算する)
+    df[MASK_COLUMN] = parameter_masks(df)
 
-    df_filtered = df[df['Variable Parameter'].apply(filter_by_parameter)]
+    # PARAMETER_LISTSの要素と順不同で一致する行をビットマスクで抽出
+    df_filtered = df[matches_any(df[MASK_COLUMN].to_numpy(), PARAMETER_LISTS)].copy()
 
     # モデルごとのMAPEを箱ひげ図で横並びに表示
     plot_combined_boxplot(df_filtered, output_dir)
@@ -62,7 +59,9 @@ def plot_combined_boxplot(df, output_dir):
         # LaTeX形式でリストとして表示
         return f"[{','.join([to_latex_subscript(param) for param in param_list])}]"
 
-    df['Model Label'] = df['Variable Parameter'].apply(lambda x: get_label(x))
+    # ビットマスクからPARAMETER_LISTSの並び順のラベルを引く
+    labels = {parameter_mask(param_list): get_label(param_list) for param_list in PARAMETER_LISTS}
+    df['Model Label'] = df[MASK_COLUMN].map(labels)
 
     # 'Model Label' の順序を PARAMETER_LISTS に従わせる
     df['Model Label'] = pd.Categorical(
@@ -126,7 +125,7 @@ def load_data(data_dir, data_file):
     """
     try:
         data_path = os.path.join(data_dir, data_file)
-        df = pd.read_csv(data_path)
+        df = load_table(data_path)
         if df.isna().any().any():
             raise ValueError("データに欠損値（NaN）が含まれています。")
         return df
@@ -4,6 +4,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parameter_mask import matches_any, parameter_masks  # noqa: E402
+from table_store import load_table  # noqa: E402
+
 
 def main():
     spec_parameter = [
@@ -20,17 +25,12 @@ def main():
     spec_df = load_data(data_dir, spec_csv)
     benchmark_df = load_data(data_dir, benchmark_csv)
 
-    # Variable Parameter をリスト形式に変換
-    spec_df['Variable Parameter'] = spec_df['Variable Parameter'].apply(eval)
-    benchmark_df['Variable Parameter'] = benchmark_df['Variable Parameter'].apply(eval)
-
-    # spec_df の Variable Parameter が spec_parameter と順不同で一致する行を抽出
-    spec_filtered_df = spec_df[spec_df['Variable Parameter'].apply(
-        lambda x: set(x) == set(spec_parameter))]
+    # spec_df の Variable Parameter が spec_parameter と順不同で一致する行をビットマスクで抽出
+    spec_filtered_df = spec_df[matches_any(parameter_masks(spec_df), [spec_parameter])]
 
     # benchmark_df の Variable Parameter が benchmark_parameter と順不同で一致する行を抽出
-    benchmark_filtered_df = benchmark_df[benchmark_df['Variable Parameter'].apply(
-        lambda x: set(x) == set(benchmark_parameter))]
+    benchmark_filtered_df = benchmark_df[matches_any(parameter_masks(benchmark_df),
+                                                     [benchmark_parameter])]
 
     # `Category` 列を追加して、どのデータが何のパラメータに対応するかを明示
     spec_filtered_df['Category'] = 'Hardware spec Model'
@@ -82,7 +82,7 @@ def load_data(data_dir, data_file):
     """
     try:
         data_path = os.path.join(data_dir, data_file)
-        df = pd.read_csv(data_path)
+        df = load_table(data_path)
         if df.isna().any().any():
             raise ValueError("データに欠損値（NaN）が含まれています。")
         return df
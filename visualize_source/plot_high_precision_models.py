@@ -4,6 +4,10 @@ import sys
 import matplotlib.pyplot as plt
 import pandas as pd
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from table_store import load_table  # noqa: E402
+
 
 def main():
     data_dir = '../mlresults_analyze'
@@ -15,8 +19,7 @@ def main():
     # データの読み込み
     df = load_data(data_dir, data_file)
 
-    # Variable Parameter をリスト形式に変換し、LaTeX スタイルにフォーマット
-    df['Variable Parameter'] = df['Variable Parameter'].apply(eval)
+    # Variable Parameter (load_tableでリストとして読み込む) を LaTeX スタイルにフォーマット
     df['Variable Parameter'] = df['Variable Parameter'].apply(
         lambda params: [to_latex_subscript(param) for param in params])
 
@@ -50,7 +53,7 @@ def load_data(data_dir, data_file):
     """
     try:
         data_path = os.path.join(data_dir, data_file)
-        df = pd.read_csv(data_path)
+        df = load_table(data_path)
         if df.isna().any().any():
             raise ValueError("データに欠損値（NaN）が含まれています。")
         return df
@@ -1,9 +1,15 @@
-import ast
+import os
+import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+# リポジトリ直下のモジュールを読み込めるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parameter_mask import matches_any, parameter_masks  # noqa: E402
+from table_store import load_table  # noqa: E402
+
 max_mape_list = ['T_MCO', 'T_SMO', 'T_MAO']
 trade_off_list = ['T_MCO']
 cost_on_list = ['T_SCO']
@@ -18,13 +24,12 @@ def main():
 
     # データの読み込み
     df = load_data(data_dir, data_file)
-    df['Variable Parameter'] = df['Variable Parameter'].apply(lambda x: ast.literal_eval(x)
-                                                              if isinstance(x, str) else x)
+    masks = parameter_masks(df)
 
-    # 条件: 'Variable Parameter' が max_mape_list と一致する場合
-    condition_1 = df['Variable Parameter'].apply(lambda x: set(x) == set(max_mape_list))
-    condition_2 = df['Variable Parameter'].apply(lambda x: set(x) == set(trade_off_list))
-    condition_3 = df['Variable Parameter'].apply(lambda x: set(x) == set(cost_on_list))
+    # 条件: 'Variable Parameter' が max_mape_list と順不同で一致する場合
+    condition_1 = matches_any(masks, [max_mape_list])
+    condition_2 = matches_any(masks, [trade_off_list])
+    condition_3 = matches_any(masks, [cost_on_list])
     condition_other = ~condition_1 & ~condition_2 & ~condition_3  # その他は青
 
     # # グラフの描画
@@ -119,7 +124,7 @@ def load_data(data_dir, data_file):
     import sys
     try:
         data_path = os.path.join(data_dir, data_file)
-        df = pd.read_csv(data_path)
+        df = load_table(data_path)
 
         # 欠損値の確認
         if df.isna().any().any():